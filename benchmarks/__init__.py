@@ -0,0 +1,4 @@
+"""
+MishMash benchmarks, and the synthetic music libraries they run against. These are not part of
+the installed package.
+"""
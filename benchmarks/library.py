@@ -0,0 +1,233 @@
+"""
+Generate a synthetic music library, for example::
+
+    $ python -m benchmarks.library /tmp/music --artists 1000 --seed 1
+
+The library is determined by the options and the seed: the same artists, albums, tracks, tags,
+images, and broken files are written each time, regardless of ``--jobs``. The audio is a few
+silent MPEG frames, so that large libraries are quick to write and do not need much space.
+
+With the default album and track counts artists average about 24 tracks, so 1k, 100k, and 1M
+track libraries are roughly 40, 4,000, and 40,000 artists.
+"""
+import os
+import sys
+import random
+import argparse
+from pathlib import Path
+from collections import namedtuple, Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import eyed3.id3
+from eyed3.id3 import ID3_V2_4
+from eyed3.id3.frames import ImageFrame
+from eyed3.core import Date, VARIOUS_TYPE, LP_TYPE, EP_TYPE
+
+from mishmash.core import EP_MAX_SIZE_HINT
+from mishmash.orm import VARIOUS_ARTISTS_NAME
+
+# An MPEG 1 layer III frame header (128 kb/s, 44.1 kHz), and the size of the silent frame.
+MP3_FRAME = b"\xff\xfb\x90\x00" + b"\x00" * 413
+
+SYLLABLES = ["ka", "lo", "mi", "ra", "ve", "tu", "no", "sa",
+             "be", "di", "fe", "go", "ha", "ji", "pu", "ze"]
+WORDS = ["black", "blue", "burning", "city", "cold", "dark", "days", "dead", "dream", "electric",
+         "empire", "fire", "ghost", "glass", "gold", "heart", "heavy", "high", "iron", "last",
+         "light", "lost", "love", "machine", "midnight", "moon", "night", "ocean", "red",
+         "river", "road", "rose", "shadow", "silver", "sky", "slow", "song", "star", "stone",
+         "storm", "sun", "sweet", "time", "velvet", "water", "white", "wild", "wind", "winter",
+         "world"]
+GENRES = ["Rock", "Pop", "Jazz", "Blues", "Metal", "Punk", "Electronic", "Hip-Hop", "Folk",
+          "Country", "Classical", "Reggae", "Soul", "Funk", "Ambient", "Indie", "Hardcore",
+          "Death Metal", "Noise", "Grunge"]
+BROKEN_TYPES = ("empty", "garbage", "no-tag", "no-title")
+
+LibraryOptions = namedtuple("LibraryOptions", ["seed", "artists", "albums", "tracks", "frames",
+                                               "compilations", "genres", "embedded_art",
+                                               "cover_files", "artist_files", "broken"])
+"""The generator options, ``albums`` and ``tracks`` are (min, max) counts."""
+
+
+def artistName(i):
+    """Returns the unique name of the artist numbered ``i``."""
+    # A permutation of 32 bit numbers, so names are unique but not obviously sequential.
+    n = (i * 2654435761) & 0xffffffff
+    syllables = [SYLLABLES[(n >> shift) & 0xf] for shift in range(0, 32, 4)]
+    return " ".join("".join(syllables[w:w + 4]).title() for w in (0, 4))
+
+
+def _title(rng, num_words):
+    return " ".join(rng.choice(WORDS) for _ in range(num_words)).title()
+
+
+def _imageData(rng):
+    # Only the PNG signature is checked when images are sync'd.
+    return b"\x89PNG\r\n\x1a\n" + rng.getrandbits(8 * 64).to_bytes(64, "big")
+
+
+def _writeTrack(path, tag, frames):
+    path.write_bytes(MP3_FRAME * frames)
+    tag.save(str(path), version=ID3_V2_4)
+
+
+def _writeBroken(path, rng, broken_type, tag, frames):
+    if broken_type == "empty":
+        path.write_bytes(b"")
+    elif broken_type == "garbage":
+        path.write_bytes(rng.getrandbits(8 * 1024).to_bytes(1024, "big"))
+    elif broken_type == "no-tag":
+        path.write_bytes(MP3_FRAME * frames)
+    else:
+        assert broken_type == "no-title"
+        tag.title = None
+        _writeTrack(path, tag, frames)
+
+
+def generateArtist(root, opts, i):
+    """Write the albums of artist ``i``, and compilation ``i`` (when it is one). Returns a
+    :class:`collections.Counter` of what was written."""
+    # Each artist has its own generator so the library does not depend on the order (or the
+    # processes) in which artists are written.
+    rng = random.Random(f"{opts.seed}:{i}")
+    counts = Counter()
+    root = Path(root)
+    artist = artistName(i)
+    genres = rng.sample(GENRES, min(opts.genres, len(GENRES)))
+
+    albums = []
+    for _ in range(rng.randint(*opts.albums)):
+        albums.append((artist, None))
+    if rng.random() < opts.compilations:
+        # Compilation tracks are by other artists.
+        albums.append((VARIOUS_ARTISTS_NAME, [artistName(rng.randrange(opts.artists))
+                                              for _ in range(opts.tracks[1])]))
+
+    titles = set()
+    for album_artist, track_artists in albums:
+        title = _title(rng, rng.randint(1, 4))
+        if track_artists:
+            # All compilations are in the Various Artists directory.
+            title += f" Vol. {i + 1}"
+        while title in titles:
+            title += " II"
+        titles.add(title)
+
+        year = rng.randint(1950, 2020)
+        num_tracks = rng.randint(*opts.tracks)
+        album_dir = root / album_artist.replace("/", "_") / f"{year} - {title}"
+        album_dir.mkdir(parents=True, exist_ok=True)
+        album_type = (VARIOUS_TYPE if track_artists
+                      else LP_TYPE if num_tracks > EP_MAX_SIZE_HINT else EP_TYPE)
+
+        cover = _imageData(rng) if rng.random() < opts.embedded_art else None
+        if rng.random() < opts.cover_files:
+            (album_dir / "cover-front.png").write_bytes(_imageData(rng))
+            counts["image files"] += 1
+        if not track_artists and rng.random() < opts.artist_files:
+            (album_dir / "artist.png").write_bytes(_imageData(rng))
+            counts["image files"] += 1
+
+        for n in range(1, num_tracks + 1):
+            tag = eyed3.id3.Tag(version=ID3_V2_4)
+            tag.artist = track_artists[n - 1] if track_artists else artist
+            tag.album_artist = album_artist
+            tag.album = title
+            tag.album_type = album_type
+            tag.title = _title(rng, rng.randint(1, 5))
+            tag.track_num = (n, num_tracks)
+            tag.original_release_date = Date(year)
+            tag.recording_date = Date(year)
+            tag.genre = rng.choice(genres)
+            if cover:
+                tag.images.set(ImageFrame.FRONT_COVER, cover, "image/png")
+
+            path = album_dir / f"{n:02d} - {tag.title}.mp3"
+            if rng.random() < opts.broken:
+                broken_type = rng.choice(BROKEN_TYPES)
+                _writeBroken(path, rng, broken_type, tag, opts.frames)
+                counts[f"broken ({broken_type})"] += 1
+            else:
+                _writeTrack(path, tag, opts.frames)
+                counts["tracks"] += 1
+
+        counts["compilations" if track_artists else "albums"] += 1
+
+    counts["artists"] += 1
+    return counts
+
+
+def generateLibrary(root, opts, jobs=1):
+    """Write the library described by the :class:`LibraryOptions` ``opts`` to ``root``. Returns
+    a :class:`collections.Counter` of what was written."""
+    counts = Counter()
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for c in pool.map(generateArtist, [root] * opts.artists, [opts] * opts.artists,
+                              range(opts.artists), chunksize=16):
+                counts.update(c)
+    else:
+        for i in range(opts.artists):
+            counts.update(generateArtist(root, opts, i))
+    return counts
+
+
+def _range(s):
+    lo, _, hi = s.partition("-")
+    lo, hi = int(lo), int(hi or lo)
+    if not 0 <= lo <= hi:
+        raise argparse.ArgumentTypeError(f"invalid range: {s}")
+    return lo, hi
+
+
+def _fraction(s):
+    f = float(s)
+    if not 0 <= f <= 1:
+        raise argparse.ArgumentTypeError(f"not a fraction between 0 and 1: {s}")
+    return f
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.library",
+                                     description="Generate a synthetic music library.")
+    parser.add_argument("root", help="The library directory, created if it does not exist.")
+    parser.add_argument("--seed", default="0", help="The random seed, default: %(default)s")
+    parser.add_argument("--artists", type=int, default=100,
+                        help="The number of artists, default: %(default)s")
+    parser.add_argument("--albums", type=_range, default="1-4", metavar="MIN-MAX",
+                        help="The number of albums per artist, default: %(default)s")
+    parser.add_argument("--tracks", type=_range, default="3-16", metavar="MIN-MAX",
+                        help="The number of tracks per album, default: %(default)s")
+    parser.add_argument("--frames", type=int, default=4,
+                        help="The number of MPEG frames per track, default: %(default)s")
+    parser.add_argument("--compilations", type=_fraction, default=0.05, metavar="FRACTION",
+                        help="The fraction of artists with a compilation, by other artists, "
+                             "default: %(default)s")
+    parser.add_argument("--genres", type=int, default=2,
+                        help="The number of genres per artist, default: %(default)s")
+    parser.add_argument("--embedded-art", type=_fraction, default=0.5, metavar="FRACTION",
+                        help="The fraction of albums with a cover embedded in each track, "
+                             "default: %(default)s")
+    parser.add_argument("--cover-files", type=_fraction, default=0.5, metavar="FRACTION",
+                        help="The fraction of albums with a cover image file, "
+                             "default: %(default)s")
+    parser.add_argument("--artist-files", type=_fraction, default=0.1, metavar="FRACTION",
+                        help="The fraction of albums with an artist image file, "
+                             "default: %(default)s")
+    parser.add_argument("--broken", type=_fraction, default=0.01, metavar="FRACTION",
+                        help="The fraction of broken files (empty, garbage, missing tag or "
+                             "title), default: %(default)s")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(),
+                        help="The number of processes writing files, default: %(default)s")
+    args = parser.parse_args(args)
+
+    opts = LibraryOptions(args.seed, args.artists, args.albums, args.tracks, args.frames,
+                          args.compilations, args.genres, args.embedded_art, args.cover_files,
+                          args.artist_files, args.broken)
+    counts = generateLibrary(args.root, opts, jobs=args.jobs)
+    for name, count in sorted(counts.items()):
+        print(f"{count} {name}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,322 @@
+"""
+Benchmarks for syncing, purging, searching, and the web views, for example::
+
+    $ python -m benchmarks.suite --scale 1k -o results.json
+    $ python -m benchmarks.suite --scale 1k --baseline results.json \\
+                                 -D sqlite:////tmp/bench.sqlite \\
+                                 -D postgresql://localhost/mishmash_bench
+
+The library is generated (see :mod:`benchmarks.library`) when it does not exist. Each database is
+dropped and created again, for each run of the sync and purge benchmarks, use dedicated
+databases. The results are written as JSON, and when a baseline (a previous results file) is
+given, benchmarks slower than the baseline by more than the threshold are reported and the exit
+status is 1. Benchmarks timed only once are reported, but are too noisy to fail the comparison.
+"""
+import os
+import sys
+import json
+import time
+import random
+import platform
+import argparse
+import tempfile
+import statistics
+import contextlib
+from pathlib import Path
+from datetime import datetime
+
+import eyed3
+from sqlalchemy import func
+from sqlalchemy.engine.url import make_url
+from sqlalchemy_utils.functions import database_exists
+
+from mishmash import database, version
+from mishmash.__main__ import MishMash
+from mishmash.orm import Track, Artist, Album, SyncRun, MAIN_LIB_ID
+from mishmash.commands.sync.index import TrackIndex
+from mishmash.commands.sync.utils import deleteOrphans
+
+from .library import LibraryOptions, generateLibrary, WORDS
+
+SCALES = {"1k": 40, "100k": 4000, "1m": 40000}
+"""Library sizes, in tracks, and the number of generated artists for each."""
+CHANGED_FRACTION = 0.01
+DEFAULT_THRESHOLD = 0.2
+# Differences smaller than this are noise.
+MIN_SECS = 0.01
+
+
+def _timeit(func, repeat):
+    """Returns the median and minimum times of ``repeat`` calls to ``func``."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return {"secs": statistics.median(times), "min_secs": min(times), "runs": len(times)}
+
+
+def _summarize(samples):
+    """Returns the result of the run with the median time of ``samples``, the results of
+    repeated runs of a benchmark, with its median and minimum times."""
+    times = [sample["secs"] for sample in samples]
+    result = dict(sorted(samples, key=lambda sample: sample["secs"])[(len(samples) - 1) // 2])
+    result.update({"secs": statistics.median(times), "min_secs": min(times),
+                   "runs": len(times)})
+    return result
+
+
+def _sample(files, fraction, seed):
+    """A deterministic sample of ``files``."""
+    files = sorted(files)
+    return random.Random(seed).sample(files, max(1, int(len(files) * fraction)))
+
+
+class Suite:
+    def __init__(self, library, db_url, repeat=5, sync_repeat=3, seed="0"):
+        self.library = Path(library)
+        self.db_url = db_url
+        self.repeat = repeat
+        self.sync_repeat = sync_repeat
+        self.seed = seed
+        self.results = {}
+        self._samples = {}    # {name: [result]}, of the sync and purge benchmarks
+
+    def run(self):
+        # The sync and purge benchmarks are timed once per run, on a new database.
+        for _ in range(self.sync_repeat):
+            if database_exists(self.db_url):
+                database.dropAll(self.db_url)
+            self.syncBenchmarks()
+            self.purgeBenchmark()
+        for name, samples in self._samples.items():
+            self.results[name] = _summarize(samples)
+
+        self.searchBenchmark()
+        self.webBenchmarks()
+        return self.results
+
+    def _sync(self, name):
+        args = ["-D", self.db_url, "-l", "mishmash:error", "-l", "eyed3:error",
+                "sync", "--no-prompt", str(self.library)]
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), \
+                contextlib.redirect_stderr(devnull):
+            start = time.perf_counter()
+            retval = MishMash()._run(args)
+            secs = time.perf_counter() - start
+        if retval != 0:
+            raise RuntimeError(f"{name} failed: {retval}")
+
+        db = database.init(self.db_url)
+        session = db.SessionMaker()
+        try:
+            run = session.query(SyncRun).order_by(SyncRun.id.desc()).first()
+            self._samples.setdefault(name, []).append({
+                "secs": secs,
+                "files": run.num_files,
+                "statements": run.statements,
+                "phases": {phase: getattr(run, f"{phase}_secs") for phase in SyncRun.PHASES},
+            })
+        finally:
+            session.close()
+            db.connection.close()
+            db.engine.dispose()
+
+    def syncBenchmarks(self):
+        self._sync("sync.initial")
+        self._sync("sync.noop")
+
+        # The title of 1% of the tracks is changed, or changed back.
+        files = _sample(self.library.rglob("*.mp3"), CHANGED_FRACTION, self.seed)
+        for path in files:
+            audio_file = eyed3.load(str(path))
+            if audio_file and audio_file.tag and audio_file.tag.title:
+                title = audio_file.tag.title
+                audio_file.tag.title = (title[:-len(" (changed)")] if title.endswith(" (changed)")
+                                        else title + " (changed)")
+                audio_file.tag.save()
+        self._sync("sync.changed")
+
+    def purgeBenchmark(self):
+        """Times :func:`deleteOrphans` with 1% of the files moved out of the library. The files
+        are moved back after, their tracks are added by the next sync."""
+        files = _sample(self.library.rglob("*.mp3"), CHANGED_FRACTION, self.seed + ":purge")
+        with tempfile.TemporaryDirectory() as tmp_d:
+            moved = [(path, Path(tmp_d) / str(i)) for i, path in enumerate(files)]
+            for path, tmp_path in moved:
+                path.rename(tmp_path)
+
+            db = database.init(self.db_url)
+            session = db.SessionMaker()
+            try:
+                with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                    start = time.perf_counter()
+                    index = TrackIndex.load(session, MAIN_LIB_ID)
+                    num_tracks, _, _ = deleteOrphans(session, index)
+                    session.commit()
+                self._samples.setdefault("purge", []).append(
+                    {"secs": time.perf_counter() - start, "tracks": num_tracks})
+            finally:
+                session.close()
+                db.connection.close()
+                db.engine.dispose()
+                for path, tmp_path in moved:
+                    tmp_path.rename(path)
+
+    def searchBenchmark(self):
+        db = database.init(self.db_url)
+        session = db.SessionMaker()
+        try:
+            artist = session.query(Artist.name).filter(Artist.lib_id == MAIN_LIB_ID)\
+                                               .order_by(Artist.id).first()
+            queries = [WORDS[0], WORDS[len(WORDS) // 2], artist.name.split()[0][:4]]
+            self.results["search"] = _timeit(
+                lambda: [database.search(session, q) for q in queries], self.repeat)
+        finally:
+            session.close()
+            db.connection.close()
+            db.engine.dispose()
+
+    def webBenchmarks(self):
+        from mishmash.web import MISHMASH_WEB
+        if not MISHMASH_WEB:
+            print("Skipping web benchmarks, the web extra is not installed", file=sys.stderr)
+            return
+
+        from webob import Request
+        from mishmash.web import _configure
+
+        db = database.init(self.db_url, scoped=True)
+        try:
+            session = db.SessionMaker()
+            # The artist with the most albums, and the album with the most tracks.
+            artist_id, = session.query(Album.artist_id).group_by(Album.artist_id)\
+                                .order_by(func.count(Album.id).desc(), Album.artist_id).first()
+            album_id, = session.query(Track.album_id).filter(Track.album_id.isnot(None))\
+                               .group_by(Track.album_id)\
+                               .order_by(func.count(Track.id).desc(), Track.album_id).first()
+            db.SessionMaker.remove()
+
+            app = _configure({}, db.SessionMaker).make_wsgi_app()
+
+            def _get(path):
+                resp = Request.blank(path).get_response(app)
+                db.SessionMaker.remove()
+                if resp.status_code != 200:
+                    raise RuntimeError(f"GET {path}: {resp.status}")
+
+            for name, path in [("web.allArtistsView", "/artists"),
+                               ("web.allAlbumsView", "/albums"),
+                               ("web.artistView", f"/artist/{artist_id}"),
+                               ("web.albumView", f"/album/{album_id}")]:
+                self.results[name] = _timeit(lambda: _get(path), self.repeat)
+        finally:
+            db.connection.close()
+            db.engine.dispose()
+
+
+def compare(results, baseline, threshold=DEFAULT_THRESHOLD):
+    """Compare ``results`` with ``baseline`` (both as written by :func:`main`). Returns a list of
+    (database, benchmark, secs, baseline secs, regressed). Benchmarks timed once, in either
+    results, are not counted as regressed."""
+    comparison = []
+    for db_name, benchmarks in results["databases"].items():
+        base_benchmarks = baseline["databases"].get(db_name, {})
+        for name, result in benchmarks.items():
+            if name not in base_benchmarks:
+                continue
+            secs, base_secs = result["secs"], base_benchmarks[name]["secs"]
+            repeated = min(result.get("runs", 1), base_benchmarks[name].get("runs", 1)) > 1
+            regressed = (repeated and secs > base_secs * (1 + threshold)
+                         and secs - base_secs > MIN_SECS)
+            comparison.append((db_name, name, secs, base_secs, regressed))
+    return comparison
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.suite",
+                                     description="Run the MishMash benchmarks.")
+    parser.add_argument("-D", "--database", dest="db_urls", action="append", metavar="URL",
+                        help="A database URL, the database is dropped and created. May be "
+                             "repeated, the default is a temporary SQLite database.")
+    parser.add_argument("--library", metavar="DIR",
+                        help="The library directory, generated when it does not exist. The "
+                             "default is a directory per scale in the temp directory.")
+    parser.add_argument("--scale", choices=SCALES, default="1k",
+                        help="The size of a generated library, in tracks. "
+                             "Default: %(default)s")
+    parser.add_argument("--seed", default="0",
+                        help="The random seed of the generated library. Default: %(default)s")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="The number of times the search and web benchmarks are run, the "
+                             "median time is reported. Default: %(default)s")
+    parser.add_argument("--sync-repeat", type=int, default=3,
+                        help="The number of times the sync and purge benchmarks are run, each "
+                             "on a new database, the median time is reported. "
+                             "Default: %(default)s")
+    parser.add_argument("-o", "--output", metavar="FILE",
+                        help="Write the results to FILE, as JSON.")
+    parser.add_argument("--baseline", metavar="FILE",
+                        help="Compare the results with those of a previous run.")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="The fraction by which a benchmark may be slower than the "
+                             "baseline. Default: %(default)s")
+    args = parser.parse_args(args)
+
+    library = Path(args.library or
+                   Path(tempfile.gettempdir()) / f"mishmash-bench-{args.scale}-{args.seed}")
+    if not library.exists():
+        print(f"Generating library: {library}", file=sys.stderr)
+        generateLibrary(str(library),
+                        LibraryOptions(seed=args.seed, artists=SCALES[args.scale],
+                                       albums=(1, 4), tracks=(3, 16), frames=4,
+                                       compilations=0.05, genres=2, embedded_art=0.5,
+                                       cover_files=0.5, artist_files=0.1, broken=0.01),
+                        jobs=os.cpu_count())
+
+    with tempfile.TemporaryDirectory() as tmp_d:
+        db_urls = args.db_urls or [f"sqlite:///{tmp_d}/bench.sqlite"]
+        results = {"version": version,
+                   "python": platform.python_version(),
+                   "platform": platform.platform(),
+                   "date": datetime.utcnow().isoformat(),
+                   "library": {"path": str(library), "scale": args.scale, "seed": args.seed},
+                   "databases": {},
+                  }
+        for url in db_urls:
+            db_name = make_url(url).get_backend_name()
+            print(f"Running benchmarks: {db_name}", file=sys.stderr)
+            results["databases"][db_name] = Suite(library, url, repeat=args.repeat,
+                                                  sync_repeat=args.sync_repeat,
+                                                  seed=args.seed).run()
+
+    for db_name, benchmarks in results["databases"].items():
+        for name, result in benchmarks.items():
+            print(f"{db_name:<12} {name:<20} {result['secs']:8.3f}s")
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            baseline = json.load(fp)
+        if baseline["library"] != results["library"]:
+            print("Warning: the baseline was run with a different library: "
+                  f"{baseline['library']}", file=sys.stderr)
+
+        print("\nCompared with the baseline:")
+        regressions = 0
+        for db_name, name, secs, base_secs, regressed in compare(results, baseline,
+                                                                 args.threshold):
+            regressions += regressed
+            print(f"{db_name:<12} {name:<20} {secs:8.3f}s {base_secs:8.3f}s "
+                  f"{(secs - base_secs) / base_secs:+7.1%}{'  REGRESSION' if regressed else ''}")
+        if regressions:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
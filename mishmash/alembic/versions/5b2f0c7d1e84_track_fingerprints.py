@@ -0,0 +1,29 @@
+"""Track fingerprints
+
+Revision ID: 5b2f0c7d1e84
+Revises: db38af26e35f
+Create Date: 2026-10-18 13:41:22.905317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b2f0c7d1e84'
+down_revision = 'db38af26e35f'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing tracks have their fingerprint set by the next sync.
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('inode', sa.BigInteger(), nullable=True))
+        batch_op.add_column(sa.Column('device', sa.BigInteger(), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('tracks', schema=None) as batch_op:
+        batch_op.drop_column('device')
+        batch_op.drop_column('inode')
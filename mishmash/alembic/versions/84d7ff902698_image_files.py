@@ -0,0 +1,48 @@
+"""Image files
+
+Revision ID: 84d7ff902698
+Revises: fff48ed484f9
+Create Date: 2026-10-18 11:02:47.518803
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from mishmash.orm import Track
+
+
+# revision identifiers, used by Alembic.
+revision = '84d7ff902698'
+down_revision = 'fff48ed484f9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('image_files',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('path', sa.String(length=Track.PATH_LIMIT),
+                              nullable=False),
+                    sa.Column('size_bytes', sa.Integer(), nullable=False),
+                    sa.Column('mtime', sa.DateTime(), nullable=False),
+                    sa.Column('album_id', sa.Integer(), nullable=False),
+                    sa.Column('lib_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['album_id'], ['albums.id'],
+                        name=op.f('fk_image_files_album_id_albums')),
+                    sa.ForeignKeyConstraint(
+                        ['lib_id'], ['libraries.id'],
+                        name=op.f('fk_image_files_lib_id_libraries')),
+                    sa.PrimaryKeyConstraint('id', name=op.f('pk_image_files')),
+                    sa.UniqueConstraint('path', 'lib_id',
+                                        name=op.f('uq_image_files_path'))
+    )
+    op.create_index(op.f('ix_image_files_album_id'), 'image_files', ['album_id'],
+                    unique=False)
+    op.create_index(op.f('ix_image_files_lib_id'), 'image_files', ['lib_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_image_files_lib_id'), table_name='image_files')
+    op.drop_index(op.f('ix_image_files_album_id'), table_name='image_files')
+    op.drop_table('image_files')
@@ -0,0 +1,38 @@
+"""Sync checkpoints
+
+Revision ID: a4e1c93b7f20
+Revises: 5b2f0c7d1e84
+Create Date: 2026-10-18 14:32:09.118624
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from mishmash.orm import Track
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e1c93b7f20'
+down_revision = '5b2f0c7d1e84'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sync_checkpoints',
+                    sa.Column('lib_id', sa.Integer(), nullable=False),
+                    sa.Column('path', sa.String(length=Track.PATH_LIMIT),
+                              nullable=False),
+                    sa.Column('started', sa.DateTime(), nullable=False),
+                    sa.Column('num_files', sa.Integer(), nullable=False),
+                    sa.Column('num_added', sa.Integer(), nullable=False),
+                    sa.Column('num_modified', sa.Integer(), nullable=False),
+                    sa.Column('num_moved', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['lib_id'], ['libraries.id'],
+                        name=op.f('fk_sync_checkpoints_lib_id_libraries')),
+                    sa.PrimaryKeyConstraint('lib_id', name=op.f('pk_sync_checkpoints'))
+    )
+
+
+def downgrade():
+    op.drop_table('sync_checkpoints')
@@ -0,0 +1,47 @@
+"""Sync runs
+
+Revision ID: c7d30e5a9b12
+Revises: a4e1c93b7f20
+Create Date: 2026-10-18 15:10:44.270135
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from mishmash.orm import SyncRun
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d30e5a9b12'
+down_revision = 'a4e1c93b7f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('sync_runs',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('started', sa.DateTime(), nullable=False),
+                    sa.Column('secs', sa.Float(), nullable=False),
+                    sa.Column('incremental', sa.Boolean(name="incremental_bool"),
+                              nullable=False),
+                    sa.Column('num_files', sa.Integer(), nullable=False),
+                    sa.Column('num_added', sa.Integer(), nullable=False),
+                    sa.Column('num_modified', sa.Integer(), nullable=False),
+                    sa.Column('num_moved', sa.Integer(), nullable=False),
+                    sa.Column('num_deleted', sa.Integer(), nullable=False),
+                    sa.Column('statements', sa.Integer(), nullable=False),
+                    sa.Column('bytes_parsed', sa.BigInteger(), nullable=False),
+                    *[sa.Column(f'{phase}_secs', sa.Float(), nullable=False)
+                        for phase in SyncRun.PHASES],
+                    sa.Column('lib_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['lib_id'], ['libraries.id'],
+                        name=op.f('fk_sync_runs_lib_id_libraries')),
+                    sa.PrimaryKeyConstraint('id', name=op.f('pk_sync_runs'))
+    )
+    op.create_index(op.f('ix_sync_runs_lib_id'), 'sync_runs', ['lib_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_sync_runs_lib_id'), table_name='sync_runs')
+    op.drop_table('sync_runs')
@@ -0,0 +1,42 @@
+"""Directories
+
+Revision ID: db38af26e35f
+Revises: 84d7ff902698
+Create Date: 2026-10-18 12:20:05.733190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from mishmash.orm import Track, Directory
+
+
+# revision identifiers, used by Alembic.
+revision = 'db38af26e35f'
+down_revision = '84d7ff902698'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('directories',
+                    sa.Column('id', sa.Integer(), nullable=False),
+                    sa.Column('path', sa.String(length=Track.PATH_LIMIT),
+                              nullable=False),
+                    sa.Column('mtime', sa.DateTime(), nullable=False),
+                    sa.Column('files_hash', sa.String(length=Directory.HASH_LIMIT),
+                              nullable=False),
+                    sa.Column('lib_id', sa.Integer(), nullable=False),
+                    sa.ForeignKeyConstraint(
+                        ['lib_id'], ['libraries.id'],
+                        name=op.f('fk_directories_lib_id_libraries')),
+                    sa.PrimaryKeyConstraint('id', name=op.f('pk_directories')),
+                    sa.UniqueConstraint('path', 'lib_id',
+                                        name=op.f('uq_directories_path'))
+    )
+    op.create_index(op.f('ix_directories_lib_id'), 'directories', ['lib_id'],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_directories_lib_id'), table_name='directories')
+    op.drop_table('directories')
@@ -0,0 +1,76 @@
+"""Shared images
+
+Images are stored once per md5 and type, existing duplicates are merged and the album and
+artist pivot tables updated to reference the remaining image.
+
+Revision ID: fff48ed484f9
+Revises: 2008219c2861
+Create Date: 2026-10-18 10:12:31.402215
+
+"""
+from collections import defaultdict
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'fff48ed484f9'
+down_revision = '2008219c2861'
+branch_labels = None
+depends_on = None
+
+images = sa.table("images", sa.column("id", sa.Integer), sa.column("md5", sa.String),
+                  sa.column("type", sa.String))
+pivots = [sa.table("album_images", sa.column("album_id", sa.Integer),
+                   sa.column("img_id", sa.Integer)),
+          sa.table("artist_images", sa.column("artist_id", sa.Integer),
+                   sa.column("img_id", sa.Integer)),
+         ]
+
+
+def upgrade():
+    conn = op.get_bind()
+
+    # {duplicate_id: kept_id}, the lowest id of each (md5, type) is kept
+    kept = {}
+    merged = {}
+    for id_, md5, type_ in conn.execute(sa.select([images.c.id, images.c.md5, images.c.type])
+                                          .order_by(images.c.id)):
+        key = (md5, type_)
+        if key in kept:
+            merged[id_] = kept[key]
+        else:
+            kept[key] = id_
+
+    if merged:
+        dup_ids = list(merged)
+        for pivot in pivots:
+            owner_col = [c for c in pivot.c if c.name != "img_id"][0]
+
+            # Rows referencing duplicates are rewritten, dropping repeats for an owner.
+            rows = defaultdict(set)
+            for i in range(0, len(dup_ids), 500):
+                for owner_id, img_id in conn.execute(
+                        sa.select([owner_col, pivot.c.img_id])
+                          .where(pivot.c.img_id.in_(dup_ids[i:i + 500]))):
+                    rows[owner_id].add(merged[img_id])
+                conn.execute(pivot.delete().where(pivot.c.img_id.in_(dup_ids[i:i + 500])))
+
+            inserts = []
+            for owner_id, img_ids in rows.items():
+                existing = {img_id for img_id, in conn.execute(
+                                sa.select([pivot.c.img_id]).where(owner_col == owner_id))}
+                inserts.extend({owner_col.name: owner_id, "img_id": img_id}
+                                   for img_id in img_ids - existing)
+            if inserts:
+                conn.execute(pivot.insert(), inserts)
+
+        for i in range(0, len(dup_ids), 500):
+            conn.execute(images.delete().where(images.c.id.in_(dup_ids[i:i + 500])))
+
+    op.create_index(op.f("ix_images_md5"), "images", ["md5", "type"], unique=True)
+
+
+def downgrade():
+    # Merged images are not split back apart.
+    op.drop_index(op.f("ix_images_md5"), table_name="images")
@@ -5,7 +5,7 @@ from sqlalchemy.exc import ProgrammingError, OperationalError
 from .. import version
 from ..core import Command
 from ..util import safeDbUrl
-from ..orm import Track, Artist, Album, Meta, Tag, Library
+from ..orm import Track, Artist, Album, Meta, Tag, Library, SyncRun
 
 """
 TODO:
@@ -44,6 +44,10 @@ class Info(Command):
         parser.add_argument("--artists", dest="show_artists",
                             action="store_true",
                             help="List all artists, per library.")
+        parser.add_argument("--sync-runs", dest="sync_runs", type=int, default=1,
+                            metavar="N",
+                            help="Show the last N syncs of each library, with the time spent "
+                                 "in each sync phase. The default is 1.")
 
     def lib_query(self, OrgType, lib):
         if isinstance(lib, int):
@@ -90,6 +94,27 @@ class Info(Command):
 
         display_list.print("{k} music {v}", clear=True)
 
+    def _displaySyncRuns(self, lib):
+        runs = self.lib_query(SyncRun, lib).order_by(SyncRun.id.desc())\
+                                           .limit(self.args.sync_runs).all()
+        for run in reversed(runs):
+            print("\n{} sync: {} [ {:.2f}s time ({:.1f} files/sec) ]"
+                  .format("Monitor" if run.incremental else "Full",
+                          Style.bright(str(run.started)), run.secs,
+                          run.num_files / run.secs if run.secs else 0))
+            print(f"{run.num_files} files sync'd, {run.num_added} added, "
+                  f"{run.num_modified} modified, {run.num_moved} moved, "
+                  f"{run.num_deleted} deleted")
+            print(f"{run.statements} database statements, "
+                  f"{run.bytes_parsed / 2 ** 20:.1f} MB parsed")
+
+            display_list = DisplayList()
+            for phase in SyncRun.PHASES:
+                secs = getattr(run, f"{phase}_secs")
+                display_list.add(Style.bright(phase),
+                                 f"{secs:.2f}s ({100 * secs / run.secs if run.secs else 0:.0f}%)")
+            display_list.print("  {k} {v}")
+
     def _displayArtists(self, lib):
         for a in self.lib_query(Artist, lib).order_by(Artist.sort_name).all():
             print(a.name)
@@ -107,3 +132,5 @@ class Info(Command):
             else:
                 print(Fg.green(f"\n=== {lib.name} library ==="))
                 self._displayLibraryInfo(lib)
+                if self.args.sync_runs:
+                    self._displaySyncRuns(lib)
@@ -1,112 +1,357 @@
+import os
+import errno
+import collections
 import multiprocessing
 
-from time import time
-from pathlib import Path
-from itertools import chain
+from time import monotonic
+from multiprocessing.connection import wait
 
 from inotify.adapters import Inotify
+from inotify.calls import InotifyError
 from inotify.constants import (IN_ACCESS, IN_ALL_EVENTS, IN_ATTRIB,
                                IN_CLOSE_WRITE, IN_CLOSE_NOWRITE, IN_CREATE,
                                IN_DELETE, IN_ISDIR, IN_OPEN, IN_MODIFY,
                                IN_MOVED_TO, IN_MOVED_FROM)
 from nicfit import getLogger
 
+from ...util import isAtOrBelow
+from .changes import (ChangeSet, Change, CREATED, DELETED, DIRECTORY,
+                      MOVED_DIRECTORY)
+from .watches import WatchRegistry, WatchStats, MonitorProcess
+
 log = getLogger(__name__)
-SYNC_INTERVAL = 10
+# Changes are sync'd once no events were seen for QUIET_PERIOD seconds, or at the latest
+# MAX_DELAY seconds after the first event (e.g. while a large copy is in progress).
+QUIET_PERIOD = 0.5
+MAX_DELAY = 5.0
+# When the inotify watch limit is reached, watching the remaining directories is retried this
+# often (seconds), e.g. in case watches were freed or the limit was raised.
+RETRY_INTERVAL = 60.0
+MAX_USER_WATCHES_PATH = "/proc/sys/fs/inotify/max_user_watches"
+
+
+def maxUserWatches():
+    """Returns the inotify watch limit of the user, ``None`` when it is not known."""
+    try:
+        with open(MAX_USER_WATCHES_PATH) as fp:
+            return int(fp.read())
+    except (OSError, ValueError):
+        return None
 
 
-class Monitor(multiprocessing.Process):
+class Monitor(MonitorProcess):
+    """Watches library directories, and requests syncs of the files that change.
 
-    def __init__(self):
-        self._inotify = Inotify()
+    Library directories are added by :meth:`watch`, the directory and all its subdirectories
+    are watched. The changes are put on :attr:`sync_queue` (given when it is shared, e.g. with
+    :class:`mishmash.commands.sync.poller.Poller` monitors) as a list of ``(lib_name, Change)``
+    (see :class:`mishmash.commands.sync.changes.Change`), one list per batch of events.
+
+    When the inotify watch limit is reached the directories that could not be watched are
+    retried every ``RETRY_INTERVAL`` seconds, and those that are then watched are sync'd
+    since their changes were missed. See :attr:`stats`.
+    """
+    def __init__(self, sync_queue=None):
+        # Events are waited for, with the directories to watch, by _main; reads do not block.
+        self._inotify = Inotify(block_duration_s=0)
+        self._events = None
         self._inotify_mask = IN_ALL_EVENTS & (~IN_ACCESS &
                                               ~IN_OPEN &
                                               ~IN_CLOSE_NOWRITE &
                                               ~IN_CLOSE_WRITE)
 
-        self._dir_queue = multiprocessing.Queue()
-        self._sync_queue = multiprocessing.Queue()
-        self._watched_dirs = {}   # {lib_name: set(dirs)}
+        self._watches = WatchRegistry()
+        self._unwatched = {}      # {path: libs}, not watched since the watch limit was reached
+        self._limit_reached = False
+        self._retry_t = None
+        self._num_failed = 0
+        # The watched, unwatched, and failed counts, shared with the parent process.
+        self._stats = multiprocessing.Array("q", 3)
+        self._changes = ChangeSet()
+        self._moves = {}          # {cookie: (src path, is_dir)}, moves not yet paired
 
-        super().__init__(target=self._main, args=(self._dir_queue,
-                                                  self._sync_queue))
+        super().__init__(sync_queue)
 
-    def _main(self, dir_queue, sync_queue):
-        next_sync_t = time() + SYNC_INTERVAL
-        sync_dirs = set()
+    def _watch(self, path, libs):
+        """Watch directory ``path`` for ``libs``. Returns ``False`` if it is not watched."""
+        wd = self._watches.wd(path)
+        if wd is not None:
+            self._watches.add(path, wd, libs)
+            return True
+        elif self._limit_reached:
+            self._unwatched.setdefault(path, set()).update(libs)
+            return False
+
+        try:
+            wd = self._inotify.add_watch(path, self._inotify_mask)
+        except InotifyError as ex:
+            if ex.errno == errno.ENOSPC:
+                self._limit_reached = True
+                self._unwatched.setdefault(path, set()).update(libs)
+                if self._retry_t is None:
+                    self._retry_t = monotonic() + RETRY_INTERVAL
+                    log.error(f"Unable to watch {path}, the inotify watch limit was reached "
+                              f"({maxUserWatches()} watches, see fs.inotify.max_user_watches) "
+                              f"with {len(self._watches)} directories watched. Changes below "
+                              "the directories that are not watched are not sync'd until they "
+                              f"are, watching them is retried every {RETRY_INTERVAL:.0f}s. "
+                              "Large libraries may be monitored by polling instead, see the "
+                              "library's 'monitor' setting.")
+            else:
+                # e.g. removed, or renamed, since it was listed
+                log.warning(f"Unable to watch {path}: {ex}")
+                self._num_failed += 1
+            return False
+
+        self._watches.add(path, wd, libs)
+        return True
+
+    def _watchTree(self, path, libs):
+        """Watch directory ``path``, and its subdirectories, for ``libs``. Returns ``False``
+        if ``path`` is not watched.
+
+        Directories are watched breadth first, so it is the deepest that are not watched when
+        the watch limit is reached. Each is watched before it is listed, so subdirectories
+        created meanwhile are either listed or reported by an event.
+        """
+        dirs = collections.deque([path])
+        while dirs:
+            d = dirs.popleft()
+            if not self._watch(d, libs):
+                continue
+            try:
+                with os.scandir(d) as entries:
+                    dirs.extend(e.path for e in entries if e.is_dir(follow_symlinks=False))
+            except OSError as ex:
+                log.warning(f"Unable to list {d}: {ex}")
+
+        return path in self._watches
+
+    def _watchNew(self, path):
+        """Watch the new directory ``path``, for the libraries watching its parent."""
+        libs = self._watches.libs(os.path.dirname(path))
+        if libs and os.path.isdir(path):
+            self._watchTree(path, libs)
+
+    def _unwatch(self, path, deleted=False):
+        """Stop watching directory ``path`` and its subdirectories. The watches of ``deleted``
+        directories were already removed by inotify."""
+        for d, _ in self._watches.remove(path):
+            try:
+                self._inotify.remove_watch(d, superficial=deleted)
+            except InotifyError as ex:
+                log.debug(f"Removing watch {d}: {ex}")
+
+        for d in [d for d in self._unwatched if isAtOrBelow(d, path)]:
+            del self._unwatched[d]
+
+    def _moveWatches(self, src_path, path):
+        """Update the watches of directory ``src_path``, and its subdirectories, which was
+        renamed to ``path``. The inotify watches follow the directories, only their paths
+        change."""
+        libs = self._watches.libs(os.path.dirname(path))
+        if not libs:
+            # Moved out of the libraries
+            self._unwatch(src_path)
+            return
+
+        # A directory replaced by the rename
+        self._unwatch(path, deleted=True)
+
+        for d in [d for d in self._unwatched if isAtOrBelow(d, src_path)]:
+            self._unwatched[path + d[len(src_path):]] = self._unwatched.pop(d)
+
+        if src_path not in self._watches:
+            # Moved from another directory, not watched
+            self._watchTree(path, libs)
+            return
+
+        for d, new_d, _ in self._watches.move(src_path, path, libs):
+            # Adding a watch for the same directory returns its existing watch descriptor,
+            # which the adapter then maps to the new path.
+            self._inotify.remove_watch(d, superficial=True)
+            try:
+                self._inotify.add_watch(new_d, self._inotify_mask)
+            except InotifyError as ex:
+                # Renamed again, the watch is moved by the next event.
+                log.debug(f"Unable to watch {new_d}: {ex}")
+
+    def _retryUnwatched(self):
+        """Watch the directories that were not watched when the watch limit was reached.
+        Returns the number of those now watched, they are sync'd since their changes were
+        missed."""
+        unwatched, self._unwatched = self._unwatched, {}
+        self._limit_reached = False
+        num_watched = 0
+        for path, libs in unwatched.items():
+            if os.path.isdir(path) and self._watchTree(path, libs):
+                self._changes.directory(path)
+                num_watched += 1
+
+        if self._unwatched:
+            self._retry_t = monotonic() + RETRY_INTERVAL
+            log.info(f"The inotify watch limit is still reached, {len(self._unwatched)} "
+                     "directories are not watched")
+        else:
+            self._retry_t = None
+            log.info(f"All directories are watched ({len(self._watches)})")
+        self._updateStats()
+        return num_watched
+
+    def _updateStats(self):
+        self._stats[:] = [len(self._watches), len(self._unwatched), self._num_failed]
+
+    def _readEvents(self):
+        """Reads the pending inotify events, without waiting for them, adding them to the
+        monitor's changes. Returns the number of changes."""
+        if self._events is None:
+            # Yields the events of each poll, then None.
+            self._events = self._inotify.event_gen()
+
+        num_changes = 0
+        for event in self._events:
+            if event is None:
+                break
+
+            (header,
+             type_names,
+             watch_path,
+             filename) = event
+
+            log.debug(
+                f"WD=({header.wd}) MASK=({header.mask}) "
+                f"MASK->NAMES={type_names} WATCH-PATH={watch_path} FILENAME={filename}")
+
+            if not filename:
+                # Events of the watched directory itself are reported by its parent.
+                continue
+            path = os.path.join(watch_path, filename)
+            is_dir = bool(header.mask & IN_ISDIR)
+
+            if header.mask & IN_MOVED_FROM:
+                # Paired with the IN_MOVED_TO of the same cookie, if it was moved to a
+                # watched directory.
+                self._moves[header.cookie] = (path, is_dir)
+            elif header.mask & IN_MOVED_TO:
+                src_path, _ = self._moves.pop(header.cookie, (None, None))
+                if is_dir and src_path:
+                    self._changes.movedDirectory(src_path, path)
+                    self._moveWatches(src_path, path)
+                elif is_dir:
+                    self._changes.directory(path)
+                    self._watchNew(path)
+                elif src_path:
+                    self._changes.moved(src_path, path)
+                else:
+                    self._changes.created(path)
+            elif is_dir:
+                if header.mask & IN_CREATE:
+                    self._changes.directory(path)
+                    self._watchNew(path)
+                elif header.mask & IN_DELETE:
+                    self._changes.directory(path)
+                    self._unwatch(path, deleted=True)
+                else:
+                    continue
+            elif header.mask & IN_CREATE:
+                self._changes.created(path)
+            elif header.mask & IN_DELETE:
+                self._changes.deleted(path)
+            elif header.mask & (IN_MODIFY | IN_ATTRIB):
+                self._changes.modified(path)
+            else:
+                continue
+
+            num_changes += 1
+
+        return num_changes
+
+    def _requestSyncs(self, sync_queue):
+        # Moves from a watched directory to one that is not, are deletes.
+        for src_path, is_dir in self._moves.values():
+            if is_dir:
+                self._changes.directory(src_path)
+                self._unwatch(src_path)
+            else:
+                self._changes.deleted(src_path)
+        self._moves.clear()
+
+        requests = []
+        for change in self._changes:
+            libs = self._watches.libs(os.path.dirname(change.path))
+            if change.type == DIRECTORY:
+                # e.g. a library root, or a directory watched after the watch limit was reached
+                libs = libs | self._watches.libs(change.path)
+            src_libs = (self._watches.libs(os.path.dirname(change.src_path))
+                        if change.src_path else libs)
+
+            for lib in sorted(libs | src_libs):
+                if lib not in src_libs:
+                    # Moved from another library, or an unwatched directory
+                    lib_change = Change(DIRECTORY if change.type == MOVED_DIRECTORY
+                                                  else CREATED, change.path, None)
+                elif lib not in libs:
+                    # Moved to another library
+                    lib_change = Change(DIRECTORY if change.type == MOVED_DIRECTORY
+                                                  else DELETED, change.src_path, None)
+                else:
+                    lib_change = change
+                log.info(f"Requesting sync {lib_change.type} {lib_change.path} (lib: {lib})")
+                requests.append((lib, lib_change))
+        self._changes.clear()
+
+        if requests:
+            sync_queue.put(requests)
+
+    def _main(self, sync_queue):
+        first_event_t = last_event_t = None
+        # The adapter does not expose its inotify file descriptor.
+        inotify_fd = self._inotify._Inotify__inotify_fd
 
         try:
             while True:
-                # Check for new directories to watch
-                while not dir_queue.empty():
-                    lib, path = dir_queue.get()
-
-                    watched = (path in set(chain(*self._watched_dirs.values())))
-
-                    if lib not in self._watched_dirs:
-                        self._watched_dirs[lib] = set()
-                    self._watched_dirs[lib].add(path)
-
-                    if not watched:
-                        self._inotify.add_watch(str(path), self._inotify_mask)
-                        log.info(f"Watching {path} (lib: {lib}) "
-                                 f"(total dirs: {len(self._watched_dirs[lib])}")
-
-                # Process Inotify
-                for event in self._inotify.event_gen():
-                    if event is None:
-                        break
-
-                    (header,
-                     type_names,
-                     watch_path,
-                     filename) = event
-                    watch_path = Path(watch_path)
-                    filename = Path(filename)
-
-                    log.debug(
-                        f"WD=({header.wd}) MASK=({header.mask}) "
-                        f"MASK->NAMES={type_names} WATCH-PATH={watch_path} FILENAME={filename}")
-
-                    if header.mask & (IN_ATTRIB | IN_CREATE | IN_DELETE |
-                                      IN_MODIFY | IN_MOVED_TO | IN_MOVED_FROM):
-                        if IN_ISDIR & header.mask and header.mask & IN_CREATE:
-                            watch_path = watch_path / filename
-                        elif IN_ISDIR & header.mask and header.mask & IN_DELETE:
-                            self._inotify.remove_watch(str(watch_path))
-
-                        sync_dirs.add(watch_path)
-
-                def _reqSync(l, d):
-                    if d.exists():
-                        sync_queue.put((lib, d))
-                        log.info(f"Requesting sync {d} (lib: {l})")
-
-                if time() > next_sync_t:
-                    for d in sync_dirs:
-                        for lib in self._watched_dirs:
-                            lib_paths = self._watched_dirs[lib]
-                            if d in lib_paths:
-                                _reqSync(lib, d)
-                                if not d.exists():
-                                    self._watched_dirs[lib].remove(d)
-                            elif d.parent in lib_paths:
-                                _reqSync(lib, d)
-                                self.dir_queue.put((lib, d))
-
-                    sync_dirs.clear()
-                    next_sync_t = time() + SYNC_INTERVAL
+                dirs = self._receiveDirs()
+                if dirs:
+                    # Library directories to watch
+                    start_t = monotonic()
+                    for lib, path in dirs:
+                        self._watchTree(os.path.abspath(path), {lib})
+                    self._updateStats()
+                    log.info(f"Watching {len(self._watches)} directories "
+                             f"({monotonic() - start_t:.2f}s)")
+
+                # Wait for events, or directories to watch. Only the changes to sync, and the
+                # retry of unwatched directories, are due at a given time.
+                deadlines = []
+                if self._retry_t is not None:
+                    deadlines.append(self._retry_t)
+                if first_event_t is not None:
+                    deadlines += [last_event_t + QUIET_PERIOD, first_event_t + MAX_DELAY]
+                timeout = max(0, min(deadlines) - monotonic()) if deadlines else None
+
+                ready = wait([self._dir_reader, inotify_fd], timeout)
+                num_changes = self._readEvents() if inotify_fd in ready else 0
+                if self._retry_t is not None and monotonic() >= self._retry_t:
+                    num_changes += self._retryUnwatched()
+                if num_changes:
+                    last_event_t = monotonic()
+                    if first_event_t is None:
+                        first_event_t = last_event_t
+
+                if first_event_t is not None:
+                    now = monotonic()
+                    if (now - last_event_t >= QUIET_PERIOD or
+                            now - first_event_t >= MAX_DELAY):
+                        self._requestSyncs(sync_queue)
+                        first_event_t = last_event_t = None
 
         except KeyboardInterrupt:
             pass
         finally:
-            for path in set(chain(*self._watched_dirs.values())):
-                self._inotify.remove_watch(str(path))
-
-    @property
-    def dir_queue(self):
-        return self._dir_queue
+            for path in self._watches:
+                self._inotify.remove_watch(path)
 
     @property
-    def sync_queue(self):
-        return self._sync_queue
+    def stats(self):
+        """The :class:`mishmash.commands.sync.watches.WatchStats` of the monitor."""
+        return WatchStats(*self._stats[:], maxUserWatches())
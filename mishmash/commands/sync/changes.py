@@ -0,0 +1,107 @@
+"""
+The changes to a library's files found by a monitor, and applied by monitor syncs.
+"""
+import os
+from collections import namedtuple
+
+from ...util import isAtOrBelow
+
+CREATED = "created"
+MODIFIED = "modified"
+DELETED = "deleted"
+MOVED = "moved"
+DIRECTORY = "directory"
+MOVED_DIRECTORY = "moved directory"
+
+Change = namedtuple("Change", ["type", "path", "src_path"])
+"""A change to the file ``path``, ``src_path`` is the file's previous path when ``MOVED``.
+A ``DIRECTORY`` change is for a directory that must be sync'd (or purged, when it no longer
+exists) as a whole, e.g. because it was created or deleted. A ``MOVED_DIRECTORY`` change is
+for the directory ``src_path`` renamed to ``path``."""
+
+
+class ChangeSet:
+    """Collects the changes to a library's files, the changes to a path are merged so that
+    there is at most one :class:`Change` per path."""
+    def __init__(self):
+        self._changes = {}    # {path: Change}
+        self._dir_moves = []  # [Change], in the order the directories were moved
+
+    def __len__(self):
+        return len(self._dir_moves) + len(self._changes)
+
+    def __iter__(self):
+        """Yields the directory moves first, in order, since the paths of the other changes
+        are those after the moves."""
+        yield from self._dir_moves
+        yield from self._changes.values()
+
+    def created(self, path):
+        prev = self._changes.get(path)
+        # A file deleted and created again was replaced.
+        self._set(MODIFIED if prev and prev.type == DELETED else CREATED, path)
+
+    def modified(self, path):
+        prev = self._changes.get(path)
+        if not prev or prev.type == DELETED:
+            self._set(MODIFIED, path)
+
+    def deleted(self, path):
+        prev = self._changes.get(path)
+        if prev and prev.type == MOVED and prev.src_path not in self._changes:
+            # The file is still known by its previous path
+            self._set(DELETED, prev.src_path)
+        self._set(DELETED, path)
+
+    def moved(self, src_path, path):
+        prev = self._changes.pop(src_path, None)
+        if prev and prev.type == CREATED:
+            # Not known by its previous path either
+            self._set(CREATED, path)
+        elif prev and prev.type == MOVED:
+            self._set(MOVED, path, prev.src_path)
+        else:
+            self._set(MOVED, path, src_path)
+
+    def directory(self, path):
+        self._set(DIRECTORY, path)
+
+    def movedDirectory(self, src_path, path):
+        first_src_path = src_path
+        if self._dir_moves and self._dir_moves[-1].path == src_path:
+            # Renamed again
+            first_src_path = self._dir_moves.pop().src_path
+        if first_src_path != path:
+            self._dir_moves.append(Change(MOVED_DIRECTORY, path, first_src_path))
+
+        # The previous changes of files in the directory are for their new paths.
+        changes = self._changes.values()
+        self._changes = {}
+        for change in changes:
+            change = change._replace(path=_movedPath(change.path, src_path, path),
+                                     src_path=_movedPath(change.src_path, src_path, path))
+            self._changes[change.path] = change
+
+    def clear(self):
+        self._changes.clear()
+        self._dir_moves.clear()
+
+    def _set(self, change_type, path, src_path=None):
+        self._changes[path] = Change(change_type, path, src_path)
+
+
+def _movedPath(p, src_path, path):
+    if p and isAtOrBelow(p, src_path):
+        return path + p[len(src_path):]
+    return p
+
+
+def changeDirs(change):
+    """Returns the directories affected by ``change``."""
+    if change.type == DIRECTORY:
+        return [change.path]
+    elif change.type == MOVED_DIRECTORY:
+        return [change.path, change.src_path]
+    elif change.type == MOVED:
+        return [os.path.dirname(change.path), os.path.dirname(change.src_path)]
+    return [os.path.dirname(change.path)]
@@ -0,0 +1,227 @@
+"""
+An in-memory index of a library's tracks, loaded once per sync.
+"""
+import os
+import bisect
+from array import array
+from collections import namedtuple
+from datetime import datetime
+
+from ...orm import Track
+from ...util import dirsAtOrBelow, usecs, usecsToDatetime, statUsecs, statFingerprint
+
+IndexedTrack = namedtuple("IndexedTrack", ["id", "path", "ctime", "mtime", "size_bytes",
+                                           "album_id", "inode", "device"])
+"""A track index entry. ``ctime`` and ``mtime`` are in microseconds, see
+:func:`mishmash.util.usecs`. ``inode`` and ``device`` are 0 when not known."""
+
+
+class TrackIndex:
+    """Maps a track path to its id, ctime, mtime, size, album id, inode, and device.
+
+    Paths are split into interned directory names and per-directory file names, the track
+    values are kept in parallel arrays.
+    """
+    def __init__(self):
+        self._dirs = {}    # {dirname: {basename: row}}
+        self._free_rows = []
+        self._ids = array("q")
+        self._ctimes = array("q")
+        self._mtimes = array("q")
+        self._sizes = array("q")
+        self._album_ids = array("q")   # 0 when the track has no album
+        self._inodes = array("q")      # 0 when not known
+        self._devices = array("q")
+        self._by_inode = None          # {inode: [(dirname, basename)]}, see findMoved
+        self._sorted_dirs = None       # The sorted dirnames, see dirnames
+        self._len = 0
+
+    @staticmethod
+    def load(session, lib_id):
+        """Create an index of all the tracks of library ``lib_id``."""
+        index = TrackIndex()
+        for row in session.query(Track.id, Track.path, Track.ctime, Track.mtime,
+                                 Track.size_bytes, Track.album_id, Track.inode, Track.device)\
+                          .filter_by(lib_id=lib_id)\
+                          .yield_per(10000):
+            index._set(*row)
+        return index
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, path):
+        return self._row(path) is not None
+
+    def __iter__(self):
+        for dirname, names in self._dirs.items():
+            for name, row in names.items():
+                yield self._entry(os.path.join(dirname, name), row)
+
+    def dirnames(self, paths=None):
+        """Returns the indexed directories, see :meth:`tracksIn`. When ``paths`` is provided
+        only the directories at or below those directories are returned."""
+        if paths is None:
+            return list(self._dirs)
+
+        if self._sorted_dirs is None:
+            # Only needed by scoped lookups, so built on first use.
+            self._sorted_dirs = sorted(self._dirs)
+        dirnames = {}
+        for path in paths:
+            dirnames.update(dict.fromkeys(dirsAtOrBelow(self._sorted_dirs, path)))
+        return list(dirnames)
+
+    def tracksIn(self, dirname):
+        """Returns the :class:`IndexedTrack` entries of the files in directory ``dirname``."""
+        return [self._entry(os.path.join(dirname, name), row)
+                    for name, row in self._dirs.get(dirname, {}).items()]
+
+    def get(self, path):
+        """Returns an :class:`IndexedTrack` for ``path``, or ``None`` when not indexed."""
+        row = self._row(path)
+        return self._entry(path, row) if row is not None else None
+
+    def isUnchanged(self, path, st=None):
+        """Returns ``True`` if ``path`` is indexed and its size and timestamps match the stat
+        result ``st``, which is obtained from ``path`` when not provided."""
+        row = self._row(path)
+        if row is None:
+            return False
+
+        st = st or os.stat(path)
+        return (self._sizes[row] == st.st_size and
+                (self._ctimes[row], self._mtimes[row]) == statUsecs(st))
+
+    def findMoved(self, st):
+        """Returns the :class:`IndexedTrack` of a file that was moved, i.e. an indexed file
+        with the inode, device, size, and mtime of the stat result ``st`` and whose path
+        no longer exists. ``None`` is returned when there is no such file."""
+        if self._by_inode is None:
+            # Only needed when there are new files, so built on first use.
+            self._by_inode = {}
+            for dirname, names in self._dirs.items():
+                for name, row in names.items():
+                    if self._inodes[row]:
+                        self._by_inode.setdefault(self._inodes[row], []).append((dirname, name))
+
+        inode, device = statFingerprint(st)
+        mtime = statUsecs(st)[1]
+        for dirname, name in self._by_inode.get(inode, []):
+            row = self._dirs[dirname][name]
+            if (self._devices[row], self._sizes[row], self._mtimes[row]) == \
+                    (device, st.st_size, mtime):
+                path = os.path.join(dirname, name)
+                if not os.path.lexists(path):
+                    return self._entry(path, row)
+        return None
+
+    def update(self, track):
+        """Add, or update, the index entry for the :class:`mishmash.orm.Track` ``track``."""
+        self._set(track.id, track.path, track.ctime, track.mtime, track.size_bytes,
+                  track.album_id, track.inode, track.device)
+
+    def move(self, path, new_path, st):
+        """Move the entry for ``path`` to ``new_path``, whose stat result is ``st``."""
+        entry = self.get(path)
+        self.remove(path)
+        self._set(entry.id, new_path, datetime.fromtimestamp(st.st_ctime),
+                  datetime.fromtimestamp(st.st_mtime), st.st_size, entry.album_id,
+                  *statFingerprint(st))
+
+    def moveDir(self, dirname, new_dirname):
+        """Move the entries at or below directory ``dirname`` to ``new_dirname``, which must
+        not have entries. Returns the new directory names of the moved entries."""
+        moved = []
+        for d in self.dirnames([dirname]):
+            new_d = new_dirname + d[len(dirname):]
+            moved.append(new_d)
+            names = self._dirs[new_d] = self._dirs.pop(d)
+            self._unindexDir(d)
+            self._indexDir(new_d)
+            if self._by_inode is not None:
+                for name, row in names.items():
+                    if self._inodes[row]:
+                        paths = self._by_inode[self._inodes[row]]
+                        paths[paths.index((d, name))] = (new_d, name)
+        return moved
+
+    def hasDir(self, dirname):
+        """Returns ``True`` if there are entries at or below directory ``dirname``."""
+        return bool(self.dirnames([dirname]))
+
+    def setFingerprint(self, path, st):
+        """Set the inode and device of the indexed ``path`` from its stat result ``st``."""
+        entry = self.get(path)
+        self._set(entry.id, path, usecsToDatetime(entry.ctime), usecsToDatetime(entry.mtime),
+                  entry.size_bytes, entry.album_id, *statFingerprint(st))
+
+    def remove(self, path):
+        dirname, name = os.path.split(path)
+        names = self._dirs.get(dirname)
+        row = names.pop(name, None) if names is not None else None
+        if row is None:
+            return
+
+        self._unindexInode(row, dirname, name)
+        self._free_rows.append(row)
+        self._len -= 1
+        if not names:
+            del self._dirs[dirname]
+            self._unindexDir(dirname)
+
+    def _row(self, path):
+        dirname, name = os.path.split(path)
+        names = self._dirs.get(dirname)
+        return names.get(name) if names is not None else None
+
+    def _entry(self, path, row):
+        return IndexedTrack(self._ids[row], path, self._ctimes[row], self._mtimes[row],
+                            self._sizes[row], self._album_ids[row] or None, self._inodes[row],
+                            self._devices[row])
+
+    def _indexDir(self, dirname):
+        if self._sorted_dirs is not None:
+            bisect.insort(self._sorted_dirs, dirname)
+
+    def _unindexDir(self, dirname):
+        if self._sorted_dirs is not None:
+            del self._sorted_dirs[bisect.bisect_left(self._sorted_dirs, dirname)]
+
+    def _unindexInode(self, row, dirname, name):
+        if self._by_inode is not None and self._inodes[row]:
+            paths = self._by_inode.get(self._inodes[row], [])
+            if (dirname, name) in paths:
+                paths.remove((dirname, name))
+            if not paths:
+                self._by_inode.pop(self._inodes[row], None)
+
+    def _set(self, id, path, ctime, mtime, size_bytes, album_id, inode=None, device=None):
+        dirname, name = os.path.split(path)
+        values = (id, usecs(ctime), usecs(mtime), size_bytes, album_id or 0, inode or 0,
+                  device or 0)
+        columns = (self._ids, self._ctimes, self._mtimes, self._sizes, self._album_ids,
+                   self._inodes, self._devices)
+
+        names = self._dirs.get(dirname)
+        if names is None:
+            names = self._dirs[dirname] = {}
+            self._indexDir(dirname)
+        row = names.get(name)
+        if row is not None:
+            self._unindexInode(row, dirname, name)
+        else:
+            if self._free_rows:
+                row = self._free_rows.pop()
+            else:
+                row = len(self._ids)
+                for col in columns:
+                    col.append(0)
+            names[name] = row
+            self._len += 1
+
+        for col, val in zip(columns, values):
+            col[row] = val
+
+        if self._by_inode is not None and inode:
+            self._by_inode.setdefault(inode, []).append((dirname, name))
@@ -0,0 +1,123 @@
+"""
+Audio file parsing for sync. Files are loaded with eyeD3 and reduced to plain, picklable
+records so that parsing can be done by worker processes while the main process does the
+database work.
+"""
+from hashlib import md5
+from collections import namedtuple
+
+from nicfit import getLogger
+
+from eyed3 import core
+from eyed3.utils import guessMimetype
+from eyed3.utils.console import printError
+
+log = getLogger(__name__)
+
+AudioFileInfo = namedtuple("AudioFileInfo", ["path", "info", "tag"])
+"""The parsed data of an audio file, with the ``path``, ``info``, and ``tag`` attributes of
+:class:`eyed3.core.AudioFile`. ``info`` or ``tag`` may be ``None``."""
+
+AudioInfo = namedtuple("AudioInfo", ["size_bytes", "time_secs", "bit_rate"])
+"""The subset of :class:`eyed3.core.AudioInfo` used by sync."""
+
+TagInfo = namedtuple("TagInfo", ["version", "title", "artist", "album", "album_artist",
+                                 "artist_origin", "album_type", "genre", "track_num",
+                                 "disc_num", "release_date", "original_release_date",
+                                 "recording_date", "images"])
+"""The subset of :class:`eyed3.id3.Tag` used by sync. ``genre`` is the genre name, and the
+dates are strings since :class:`eyed3.core.Date` is not picklable."""
+
+ImageInfo = namedtuple("ImageInfo", ["picture_type", "mime_type", "description", "md5",
+                                     "image_data"])
+"""A tag image (APIC) frame along with the md5 hex digest of its data."""
+
+LoadResult = namedtuple("LoadResult", ["audio_files", "image_files", "skipped"])
+"""The results of :func:`loadFiles`, a list of :class:`AudioFileInfo`, a list of image file
+paths, and the list of unchanged paths that were not loaded."""
+
+
+def _dateStr(date):
+    return str(date) if date else None
+
+
+def _tagInfo(tag, image_memo):
+    images = []
+    for img in tag.images:
+        data = img.image_data
+        if data in image_memo:
+            md5sum, data = image_memo[data]
+        else:
+            md5sum = md5(data).hexdigest()
+            image_memo[data] = (md5sum, data)
+        images.append(ImageInfo(img.picture_type, img.mime_type, img.description, md5sum,
+                                data))
+
+    return TagInfo(version=tag.version, title=tag.title, artist=tag.artist, album=tag.album,
+                   album_artist=tag.album_artist, artist_origin=tag.artist_origin,
+                   album_type=tag.album_type, genre=tag.genre.name if tag.genre else None,
+                   track_num=tuple(tag.track_num), disc_num=tuple(tag.disc_num),
+                   release_date=_dateStr(tag.release_date),
+                   original_release_date=_dateStr(tag.original_release_date),
+                   recording_date=_dateStr(tag.recording_date),
+                   images=images)
+
+
+def audioFileInfo(audio_file, image_memo=None):
+    """Convert an :class:`eyed3.core.AudioFile` to an :class:`AudioFileInfo`.
+
+    ``image_memo`` is an optional dict shared by calls for the files of one directory, so
+    that an image embedded in each file is hashed once and its data is a single object
+    (which is also pickled once).
+    """
+    info = audio_file.info
+    tag = audio_file.tag
+    return AudioFileInfo(
+        path=audio_file.path,
+        info=AudioInfo(info.size_bytes, info.time_secs, info.bit_rate) if info else None,
+        tag=_tagInfo(tag, image_memo if image_memo is not None else {}) if tag else None)
+
+
+def loadFiles(paths, unchanged=None):
+    """Load each file in ``paths``, a single directory's worth of files. Audio files are
+    parsed and image files are noted, all others are ignored.
+
+    ``unchanged`` is an optional list of paths (also in ``paths``) that are known to be
+    unmodified since the last sync. These are not loaded unless another audio file in the
+    directory is, since the album type hint requires all the files of a directory.
+
+    This function is run in worker processes, so the arguments and the return value
+    (:class:`LoadResult`) are picklable.
+    """
+    unchanged = set(unchanged or [])
+    audio_files, image_files = [], []
+    image_memo = {}
+
+    def _load(path):
+        try:
+            audio_file = core.load(path)
+        except NotImplementedError as ex:
+            # Frame decryption, for instance...
+            printError(str(ex))
+            return
+
+        if audio_file:
+            audio_files.append(audioFileInfo(audio_file, image_memo))
+        else:
+            mt = guessMimetype(path)
+            if mt and mt.startswith("image/"):
+                image_files.append(path)
+
+    for path in [p for p in paths if p not in unchanged]:
+        _load(path)
+
+    skipped = [p for p in paths if p in unchanged]
+    if audio_files and skipped:
+        for path in skipped:
+            _load(path)
+        skipped = []
+        # Preserve the directory order
+        order = {p: i for i, p in enumerate(paths)}
+        audio_files.sort(key=lambda f: order[f.path])
+
+    return LoadResult(audio_files, image_files, skipped)
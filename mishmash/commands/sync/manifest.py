@@ -0,0 +1,234 @@
+"""
+A manifest of a library's directories, used to walk a library without listing the
+directories that have not changed since the last sync.
+"""
+import os
+import re
+from hashlib import md5
+from collections import namedtuple, defaultdict
+
+from sqlalchemy import sql
+from nicfit import getLogger
+
+from ...orm import Directory
+from ...util import isAtOrBelow, usecs, statUsecs, usecsToDatetime
+from .utils import IdAllocator, ID_BATCH_SIZE
+
+log = getLogger(__name__)
+
+ManifestEntry = namedtuple("ManifestEntry", ["id", "mtime", "files_hash"])
+"""A directory's manifest, ``mtime`` is in microseconds (see :func:`mishmash.util.usecs`)."""
+
+
+class DirectoryManifest:
+    """The :class:`mishmash.orm.Directory` rows of a library, updated by :meth:`walk` and
+    written by :meth:`save`.
+
+    A directory's mtime changes when entries are added, removed, or renamed, but not when a
+    file is modified in place. When pruning, a directory with an unchanged mtime is not
+    listed, and its recorded subdirectories are walked instead. Every directory is still
+    stat'd, a directory's mtime does not change with the contents of its subdirectories.
+    """
+    def __init__(self, lib_id):
+        self._lib_id = lib_id
+        self._entries = {}                  # {path: ManifestEntry}
+        self._children = defaultdict(set)   # {path: set(subdir paths)}
+        self._updated = set()               # paths
+        self._removed = set()               # ids
+        self._invalid = set()               # paths
+        self.unchanged_dirs = set()
+        """The directories found unchanged by :meth:`walk`, when pruning."""
+
+    @staticmethod
+    def load(session, lib_id):
+        manifest = DirectoryManifest(lib_id)
+        for id_, path, mtime, files_hash in \
+                session.query(Directory.id, Directory.path, Directory.mtime,
+                              Directory.files_hash)\
+                       .filter_by(lib_id=lib_id)\
+                       .yield_per(10000):
+            manifest._set(path, ManifestEntry(id_, usecs(mtime), files_hash))
+        return manifest
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, path):
+        return self._entries.get(os.path.abspath(path))
+
+    def walk(self, handler, path, excludes=None, recursive=True, prune=False):
+        """Walk ``path`` calling the ``handleFile`` and ``handleDirectory`` methods of
+        ``handler``, as :func:`eyed3.utils.walk` does. The manifest is updated for each
+        directory when ``recursive``. The files of listed directories are passed to
+        ``handleFile`` with their ``stat`` result, so they need not be stat'd again.
+
+        With ``prune``, a directory whose mtime is unchanged is not listed and its files are
+        not passed to ``handler``. Neither are the files of a directory whose mtime has
+        changed but whose files have not (e.g. a subdirectory was added).
+        """
+        path = str(path)
+        excludes_re = [re.compile(e) for e in excludes or []]
+
+        if not os.path.exists(path):
+            raise IOError(f"file not found: {path}")
+        elif os.path.isfile(path):
+            if not any(ex.match(path) for ex in excludes_re):
+                handler.handleFile(os.path.abspath(path))
+            return
+
+        try:
+            self._walk(handler, path, excludes_re, recursive, prune and recursive)
+        except StopIteration:
+            pass
+
+    def move(self, path, new_path):
+        """Move the entries at or below ``path`` to ``new_path``, the directory was renamed.
+        The :class:`mishmash.orm.Directory` paths are updated by
+        :func:`mishmash.commands.sync.utils.moveDirectory`."""
+        path, new_path = os.path.abspath(path), os.path.abspath(new_path)
+
+        def _moved(p):
+            return new_path + p[len(path):] if isAtOrBelow(p, path) else p
+
+        for p in [p for p in self._entries if isAtOrBelow(p, path)]:
+            self._entries[_moved(p)] = self._entries.pop(p)
+        for parent in [p for p in self._children if isAtOrBelow(p, path)]:
+            self._children[_moved(parent)] = {_moved(c) for c in self._children.pop(parent)}
+        self._children[os.path.dirname(path)].discard(path)
+        if new_path in self._entries:
+            self._children[os.path.dirname(new_path)].add(new_path)
+        self._updated = {_moved(p) for p in self._updated}
+        self._invalid = {_moved(p) for p in self._invalid}
+        self.unchanged_dirs = {_moved(p) for p in self.unchanged_dirs}
+
+    def hasDir(self, path):
+        """Returns ``True`` if there are entries at or below directory ``path``."""
+        path = os.path.abspath(path)
+        return any(isAtOrBelow(p, path) for p in self._entries)
+
+    def invalidate(self, path):
+        """Forget the manifest of directory ``path`` so that it is listed by the next sync,
+        for example when syncing one of its files failed."""
+        path = os.path.abspath(path)
+        self._invalid.add(path)
+        self._updated.add(path)
+
+    def save(self, session, id_allocator=None):
+        """Write the added, updated, and removed directories."""
+        if self._removed:
+            ids = list(self._removed)
+            for i in range(0, len(ids), ID_BATCH_SIZE):
+                session.execute(Directory.__table__.delete()
+                                         .where(Directory.id.in_(ids[i:i + ID_BATCH_SIZE])))
+
+        inserts, updates = [], []
+        ids = id_allocator or IdAllocator(session, Directory, batch_size=1000)
+        for path in self._updated:
+            entry = self._entries.get(path)
+            if entry is None:
+                continue
+            if path in self._invalid:
+                entry = entry._replace(mtime=-1, files_hash="")
+                self._entries[path] = entry
+
+            values = {"mtime": usecsToDatetime(max(entry.mtime, 0)),
+                      "files_hash": entry.files_hash}
+            if entry.id is None:
+                entry = entry._replace(id=ids.next())
+                self._entries[path] = entry
+                inserts.append(dict(values, id=entry.id, path=path, lib_id=self._lib_id))
+            else:
+                updates.append(dict(values, d_id=entry.id))
+
+        if inserts:
+            session.execute(Directory.__table__.insert(), inserts)
+        if updates:
+            session.execute(Directory.__table__.update()
+                                     .where(Directory.id == sql.bindparam("d_id")),
+                            updates)
+
+        self._updated.clear()
+        self._removed.clear()
+        self._invalid.clear()
+
+    def _walk(self, handler, d, excludes_re, recursive, prune):
+        """Walk directory ``d``."""
+        try:
+            st = os.stat(d)
+        except OSError as ex:
+            log.warning(f"Skipping directory: {ex}")
+            return
+
+        abs_d = os.path.abspath(d)
+        mtime = statUsecs(st)[1]
+        entry = self._entries.get(abs_d)
+
+        if prune and entry and entry.mtime == mtime:
+            self.unchanged_dirs.add(abs_d)
+            files_hash = entry.files_hash
+            subdirs = sorted(os.path.join(d, os.path.basename(p))
+                                for p in self._children[abs_d])
+        else:
+            try:
+                files, subdirs = self._list(d, excludes_re)
+            except OSError as ex:
+                log.warning(f"Skipping directory: {ex}")
+                return
+
+            files_hash = md5()
+            for name, st in files:
+                files_hash.update(f"{name}\0{st.st_size}\0{statUsecs(st)[1]}\n"
+                                  .encode("utf8", "surrogateescape"))
+            files_hash = files_hash.hexdigest()
+
+            if files and not (prune and entry and entry.files_hash == files_hash):
+                for name, st in files:
+                    handler.handleFile(os.path.abspath(os.path.join(d, name)), stat=st)
+                handler.handleDirectory(d, [name for name, _ in files])
+
+            # Subdirectories that are gone
+            current = {os.path.abspath(s) for s in subdirs}
+            for gone in self._children[abs_d] - current:
+                self._remove(gone)
+
+        if not recursive:
+            return
+
+        new_entry = ManifestEntry(entry.id if entry else None, mtime, files_hash)
+        if new_entry != entry:
+            self._set(abs_d, new_entry)
+            self._updated.add(abs_d)
+
+        for sub in subdirs:
+            self._walk(handler, sub, excludes_re, recursive, prune)
+
+    @staticmethod
+    def _list(d, excludes_re):
+        """Returns the (name, ``os.stat_result``) of the files of ``d`` sorted by name, and the
+        sorted paths of its subdirectories (symbolic links to directories are not followed, as
+        with ``os.walk``)."""
+        files, subdirs = [], []
+        with os.scandir(d) as entries:
+            for e in entries:
+                if e.is_dir():
+                    if not e.is_symlink():
+                        subdirs.append(os.path.join(d, e.name))
+                elif e.is_file():
+                    if any(ex.match(os.path.abspath(e.path)) for ex in excludes_re):
+                        continue
+                    files.append((e.name, e.stat()))
+
+        return sorted(files, key=lambda f: f[0]), sorted(subdirs)
+
+    def _set(self, path, entry):
+        self._entries[path] = entry
+        self._children[os.path.dirname(path)].add(path)
+
+    def _remove(self, path):
+        entry = self._entries.pop(path, None)
+        if entry and entry.id is not None:
+            self._removed.add(entry.id)
+        self._updated.discard(path)
+        self._children[os.path.dirname(path)].discard(path)
+        for child in self._children.pop(path, set()):
+            self._remove(child)
@@ -0,0 +1,240 @@
+"""
+A monitor that polls library directories for changes, for file systems where inotify does not
+report the changes made by other hosts (e.g. NFS, SMB).
+"""
+import os
+import time
+import collections
+
+from time import monotonic
+from collections import namedtuple
+
+from nicfit import getLogger
+
+from .changes import ChangeSet
+from .watches import MonitorProcess
+
+log = getLogger(__name__)
+# The changes found while polling are sync'd at least this often (seconds), and at the end
+# of each scan. Moves are found within each batch of changes.
+FLUSH_INTERVAL = 10.0
+# Pacing sleeps shorter than this are deferred, and made up for by a later sleep.
+MIN_SLEEP = 0.05
+
+DirState = namedtuple("DirState", ["mtime", "files", "subdirs"])
+"""The state of a polled directory, its ``mtime`` (ns), ``files`` as
+``{name: (size, mtime, inode)}``, and ``subdirs`` as ``{name: inode}``."""
+
+
+class Poller(MonitorProcess):
+    """Polls the directories of library ``lib_name`` for changes, and requests syncs of the
+    files that change. The directories are scanned every ``interval`` seconds, at most
+    ``budget`` file system operations (stats and listings) are made per second, ``None`` for
+    no limit.
+
+    A directory is only listed when its mtime changed, the files of the others are stat'd.
+    Files and directories are moved when one with the same inode, and mtime (and size, for
+    files), was removed. Since inodes are reused, the mtime is compared too; a rename does
+    not change it.
+
+    The interface is that of :class:`mishmash.commands.sync._inotify.Monitor`: library
+    directories are added by :meth:`watch`, and the changes are put on :attr:`sync_queue`.
+    """
+    def __init__(self, lib_name, sync_queue=None, interval=60.0, budget=None):
+        self._lib_name = lib_name
+        self._interval = interval
+        self._budget = budget
+
+        self._roots = []
+        self._dirs = {}           # {path: DirState}
+        self._changes = ChangeSet()
+        # The changes not yet paired as moves, keyed by the file or directory identity
+        self._created = {}        # {(dev, inode, size, mtime): path}
+        self._deleted = {}        # {(dev, inode, size, mtime): path}
+        self._added_dirs = {}     # {(dev, inode, mtime): path}, not yet scanned
+        self._removed_dirs = {}   # {(dev, inode, mtime): path}
+        self._ops = 0
+        self._ops_t = monotonic()
+        self._flush_t = None
+
+        super().__init__(sync_queue)
+
+    def _io(self, n=1):
+        """Account for ``n`` file system operations, sleeping as needed to keep within the
+        budget."""
+        self._ops += n
+        if not self._budget:
+            return
+        ahead = self._ops / self._budget - (monotonic() - self._ops_t)
+        if ahead >= MIN_SLEEP:
+            time.sleep(ahead)
+
+    def _stat(self, path):
+        self._io()
+        return os.stat(path)
+
+    def _list(self, d):
+        """Returns the files, and subdirectories, of ``d`` as in :class:`DirState`. Symbolic
+        links to directories are not followed."""
+        files, subdirs = {}, {}
+        self._io()
+        with os.scandir(d) as entries:
+            for e in entries:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs[e.name] = e.inode()
+                elif e.is_file():
+                    self._io()
+                    try:
+                        st = e.stat()
+                    except FileNotFoundError:
+                        continue
+                    files[e.name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        return files, subdirs
+
+    def _scan(self, path, sync_queue=None):
+        """Scan directory ``path`` and its subdirectories, recording the changes since they
+        were last scanned. Directories not scanned before are recorded, without changes.
+        With a ``sync_queue`` the changes are sync'd every ``FLUSH_INTERVAL`` seconds."""
+        dirs = collections.deque([path])
+        while dirs:
+            d = dirs.popleft()
+            try:
+                dirs.extend(self._scanDir(d))
+            except OSError as ex:
+                # e.g. removed since it was listed, the change is found by the parent's scan.
+                log.debug(f"Unable to scan {d}: {ex}")
+
+            if sync_queue is not None and monotonic() >= self._flush_t:
+                self._requestSyncs(sync_queue)
+
+    def _scanDir(self, d):
+        """Scan directory ``d``, returns the subdirectories to scan."""
+        st = self._stat(d)
+        state = self._dirs.get(d)
+        if state is None:
+            files, subdirs = self._list(d)
+            self._dirs[d] = DirState(st.st_mtime_ns, files, subdirs)
+            return [os.path.join(d, name) for name in subdirs]
+
+        if st.st_mtime_ns != state.mtime:
+            files, subdirs = self._list(d)
+        else:
+            # The same names, only the files' contents may have changed.
+            files, subdirs = {}, state.subdirs
+            for name in state.files:
+                try:
+                    file_st = self._stat(os.path.join(d, name))
+                except FileNotFoundError:
+                    continue
+                files[name] = (file_st.st_size, file_st.st_mtime_ns, file_st.st_ino)
+
+        for name, (size, mtime, inode) in files.items():
+            prev = state.files.get(name)
+            path = os.path.join(d, name)
+            if prev is None:
+                self._created[(st.st_dev, inode, size, mtime)] = path
+            elif prev != (size, mtime, inode):
+                self._changes.modified(path)
+        for name, (size, mtime, inode) in state.files.items():
+            if name not in files:
+                self._deleted[(st.st_dev, inode, size, mtime)] = os.path.join(d, name)
+
+        for name, inode in subdirs.items():
+            if state.subdirs.get(name) != inode:
+                path = os.path.join(d, name)
+                try:
+                    mtime = self._stat(path).st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                self._added_dirs[(st.st_dev, inode, mtime)] = path
+        for name, inode in state.subdirs.items():
+            if subdirs.get(name) != inode:
+                path = os.path.join(d, name)
+                mtime = self._dirs[path].mtime if path in self._dirs else None
+                self._removed_dirs[(st.st_dev, inode, mtime)] = path
+
+        self._dirs[d] = DirState(st.st_mtime_ns, files, subdirs)
+        # New directories are scanned once it is known whether they were moved.
+        return [os.path.join(d, name) for name, inode in subdirs.items()
+                    if state.subdirs.get(name) == inode]
+
+    def _tree(self, path):
+        """Returns the scanned directories at or below ``path``, parents first."""
+        paths = [path] if path in self._dirs else []
+        i = 0
+        while i < len(paths):
+            paths.extend(os.path.join(paths[i], name) for name in self._dirs[paths[i]].subdirs
+                         if os.path.join(paths[i], name) in self._dirs)
+            i += 1
+        return paths
+
+    def _pairChanges(self):
+        """Adds the created and deleted files, and the added and removed directories, to the
+        changes. Those with the same inode were moved."""
+        moved_dirs = []
+        for key, src_path in self._removed_dirs.items():
+            path = self._added_dirs.pop(key, None)
+            if path is not None:
+                moved_dirs.append((src_path, path))
+            else:
+                self._changes.directory(src_path)
+                for d in self._tree(src_path):
+                    del self._dirs[d]
+        # After the removals, since a directory may have been replaced by one moved
+        for src_path, path in moved_dirs:
+            self._changes.movedDirectory(src_path, path)
+            moved = [(d, path + d[len(src_path):]) for d in self._tree(src_path)]
+            states = [self._dirs.pop(d) for d, _ in moved]
+            for (_, new_d), state in zip(moved, states):
+                self._dirs[new_d] = state
+
+        for key, path in self._deleted.items():
+            src_path, path = path, self._created.pop(key, None)
+            if path is not None:
+                self._changes.moved(src_path, path)
+            else:
+                self._changes.deleted(src_path)
+        for path in self._created.values():
+            self._changes.created(path)
+
+        # Directories created, or moved from outside the library, are sync'd as a whole.
+        added_dirs = list(self._added_dirs.values())
+        self._removed_dirs.clear()
+        self._added_dirs.clear()
+        self._deleted.clear()
+        self._created.clear()
+        for path in added_dirs:
+            self._changes.directory(path)
+            self._scan(path)
+
+    def _requestSyncs(self, sync_queue):
+        self._flush_t = monotonic() + FLUSH_INTERVAL
+        self._pairChanges()
+        requests = [(self._lib_name, change) for change in self._changes]
+        self._changes.clear()
+        for _, change in requests:
+            log.info(f"Requesting sync {change.type} {change.path} (lib: {self._lib_name})")
+        if requests:
+            sync_queue.put(requests)
+
+    def _main(self, sync_queue):
+        try:
+            while True:
+                # New library directories are scanned, without changes.
+                for _, path in self._receiveDirs():
+                    path = os.path.abspath(path)
+                    if path not in self._roots:
+                        self._roots.append(path)
+
+                self._ops, self._ops_t = 0, monotonic()
+                self._flush_t = self._ops_t + FLUSH_INTERVAL
+                for root in self._roots:
+                    self._scan(root, sync_queue)
+                self._requestSyncs(sync_queue)
+
+                secs = monotonic() - self._ops_t
+                log.info(f"Polled {len(self._dirs)} directories, {self._ops} operations "
+                         f"({secs:.2f}s)")
+                self._dir_reader.poll(max(0, self._interval - secs))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,50 @@
+"""
+Per-phase timers and counters for a sync, saved as a :class:`mishmash.orm.SyncRun`.
+"""
+import time
+from contextlib import contextmanager
+
+from ...orm import SyncRun
+
+
+class SyncStats:
+    """Times the phases of a sync (see :attr:`SyncRun.PHASES`), and counts the database
+    statements executed and the size of the files parsed.
+
+    Phase times are exclusive, the time spent in a phase entered from another is not
+    counted by the outer phase.
+    """
+    def __init__(self):
+        self.secs = dict.fromkeys(SyncRun.PHASES, 0.0)
+        self.statements = 0
+        self.bytes_parsed = 0
+        self._stack = []    # [[phase, start time]]
+
+    @contextmanager
+    def phase(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._stop(now)
+        self._stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._stop(now)
+            self._stack.pop()
+            if self._stack:
+                self._stack[-1][1] = now
+
+    def countStatement(self, *_):
+        """A ``before_cursor_execute`` event listener."""
+        self.statements += 1
+
+    def syncRun(self, **kwargs):
+        """Returns a new :class:`SyncRun` with the phase times and counts, and ``kwargs``."""
+        return SyncRun(statements=self.statements, bytes_parsed=self.bytes_parsed,
+                       **{f"{phase}_secs": secs for phase, secs in self.secs.items()},
+                       **kwargs)
+
+    def _stop(self, now):
+        name, start = self._stack[-1]
+        self.secs[name] += now - start
@@ -1,12 +1,17 @@
 import os
+import re
+import queue
 import platform
+import multiprocessing
 import time
 import collections
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 from os.path import getctime
 from datetime import datetime
 
 from nicfit import getLogger
+from sqlalchemy import sql, event
 from sqlalchemy.orm.exc import NoResultFound
 
 import eyed3
@@ -14,20 +19,25 @@ import eyed3.main
 from eyed3.utils import art
 from eyed3.plugins import LoaderPlugin
 from eyed3.utils.prompt import PromptExit
-from eyed3.main import main as eyed3_main
-from eyed3.core import TXXX_ALBUM_TYPE, VARIOUS_TYPE, LP_TYPE, SINGLE_TYPE, EP_TYPE
+from eyed3.core import Date, VARIOUS_TYPE, LP_TYPE, SINGLE_TYPE, EP_TYPE
 from nicfit.console.ansi import Fg
 from nicfit.console import pout, perr
 
-from ...util import normalizeCountry
-from ...orm import (Track, Artist, Album, Meta, Image, Library,
-                    VARIOUS_ARTISTS_ID, VARIOUS_ARTISTS_NAME, MAIN_LIB_NAME, NULL_LIB_ID)
+from ...util import normalizeCountry, isAtOrBelow, usecs, statUsecs, statFingerprint
+from ...orm import (Track, Artist, Album, Meta, Image, ImageFile, Directory, Library, Tag,
+                    SyncCheckpoint, VARIOUS_ARTISTS_ID, VARIOUS_ARTISTS_NAME, MAIN_LIB_NAME,
+                    NULL_LIB_ID)
 from ... import console
-from ... import database as db
 from ...core import Command, EP_MAX_SIZE_HINT
-from ...config import MusicLibrary
+from ...config import MusicLibrary, MONITOR_POLL
 
-from .utils import syncImage, deleteOrphans
+from .utils import (syncImage, syncTrackTags, deleteOrphans, moveDirectory, IdAllocator,
+                    PurgeScope)
+from .loader import loadFiles, LoadResult
+from .index import TrackIndex
+from .manifest import DirectoryManifest
+from .stats import SyncStats
+from .changes import changeDirs, MOVED, DELETED, DIRECTORY, MOVED_DIRECTORY
 
 log = getLogger(__name__)
 IMAGE_TYPES = {"artist": (Image.LOGO_TYPE, Image.ARTIST_TYPE, Image.LIVE_TYPE),
@@ -45,7 +55,7 @@ class SyncPlugin(LoaderPlugin):
 
     def __init__(self, arg_parser):
         """Constructor"""
-        super().__init__(arg_parser, cache_files=True, track_images=True)
+        super().__init__(arg_parser)
 
         eyed3.main.setFileScannerOpts(
             arg_parser, default_recursive=True, paths_metavar="PATH_OR_LIB",
@@ -55,6 +65,10 @@ class SyncPlugin(LoaderPlugin):
         arg_parser.add_argument(
                 "--monitor", action="store_true", dest="monitor",
                 help="Monitor sync'd dirs for changes.")
+        arg_parser.add_argument(
+                "--poll", action="store_true", dest="poll",
+                help="Monitor by polling for changes, for network file systems (e.g. NFS, "
+                     "SMB). This overrides the 'monitor' setting of the libraries.")
         arg_parser.add_argument(
                 "-f", "--force", action="store_true", dest="force",
                 help="Force sync a library when sync=False.")
@@ -67,28 +81,90 @@ class SyncPlugin(LoaderPlugin):
                 "--no-prompt", action="store_true", dest="no_prompt",
                 help="Skip files that require user input.")
         arg_parser.add_argument(
-            "--speed", default="fast", choices=("fast", "normal"),
-            help="Sync speed. 'fast' will skips files whose timestamps have not changed, while "
+            "--speed", default="fast", choices=("fastest", "fast", "normal"),
+            help="Sync speed. 'fastest' also skips directories whose timestamps have not "
+                 "changed, without listing them, so files modified in place are not noticed. "
+                 "'fast' will skips files whose timestamps have not changed, while "
                  "'normal' scans all files all the time.")
+        arg_parser.add_argument(
+            "--commit-dirs", type=int, metavar="N",
+            help="Commit to the database every N directories. The default is to commit after "
+                 "every directory, unless set in the library configuration.")
+        arg_parser.add_argument(
+            "--commit-tracks", type=int, metavar="N",
+            help="Commit to the database every N added or modified tracks.")
+        arg_parser.add_argument(
+            "--commit-secs", type=float, metavar="SECS",
+            help="Commit to the database every SECS seconds.")
+        arg_parser.add_argument(
+            "--resume", action="store_true",
+            help="Resume an interrupted sync from the last directory committed to the "
+                 "database, instead of starting over. Orphans are purged once the sync "
+                 "completes.")
+        arg_parser.add_argument(
+            "-j", "--jobs", type=int, default=1, metavar="N",
+            help="Number of worker processes used to parse files. Database updates are always "
+                 "done by the main process. The default is 1, no worker processes.")
 
         self.monitor_proc = None
+        self.poll_procs = {}          # {lib_name: Poller}
+        self.sync_queue = None        # The changes found by the monitor and pollers
+        self._dir_files = []
+        self._dir_stats = {}          # {path: os.stat_result}, of the walk's listing
+        self._track_index = None
+        self._track_indexes = {}      # {lib_id: TrackIndex}, kept across monitor syncs
+        self._manifest = None
+        self._manifests = {}          # {lib_id: DirectoryManifest}, kept across monitor syncs
+        self._touched_albums = set()  # Album ids referenced by sync'd tracks, before syncing
+        self._touched_artists = set()
+        self._unlinked_imgs = set()   # Image ids unlinked from albums and artists by syncImage
+        self._artist_cache = {}       # {(lib_id, name, city, state, country): [artist_id]}
+        self._resolved_artists = {}   # {(lib_id, name, city, state, country): artist_id}
+        self._album_cache = {}        # {(lib_id, artist_id, title, *dates): album_id}
+        self._dir_albums = {}         # {(lib_id, artist_id, title, *dates): Album}
+        self._tag_cache = {}          # {name: tag_id}
+        self._tag_caches = {}         # {lib_id: tag cache}, kept across monitor syncs
+        self._dir_track_tags = []     # [(Track, tag_ids, is_new)]
+        self._dir_tracks = {}         # {track_id: Track}
+        self._dir_artists = {}        # {artist_id: Artist}, new (unflushed) artists
+        self._image_cache = {}        # {(md5, type): image_id}
+        self._dir_images = {}         # {image_id: Image}, new (unflushed) images
+        self._dir_tag_images = set()  # {(album_id, type, md5)}, tag images sync'd per directory
+        self._image_files = {}        # {path: (image_file_id, size_bytes, mtime, album_id)}
+        self._lib_image_files = {}    # {lib_id: image files}, kept across monitor syncs
+        self._ids = {}                # {orm_type: IdAllocator}, kept across monitor syncs
+        self._commit_limits = (None, None, None)
+        self._uncommitted = [0, 0]    # [num dirs, num tracks]
+        self._last_commit_time = None
+        self._checkpoint = None       # SyncCheckpoint, for full (not monitor) syncs
+        self._resume_key = None       # The walk key of the checkpoint being resumed
+        self._last_dir = None         # The last sync'd directory
+        self._pool = None
+        self._pending = collections.deque()
         self._num_added = 0
         self._num_modified = 0
+        self._num_moved = 0
         self._num_deleted = 0
         self._db_session = None
         self._lib = None
+        self._stats = None            # SyncStats
+        self._started = None
         self.start_time = None
 
     def start(self, args, config):
         import eyed3.utils.prompt
 
-        self._num_loaded = 0
+        self._num_loaded = self._num_added = self._num_modified = self._num_moved = 0
+        self._num_deleted = 0
 
         eyed3.utils.prompt.DISABLE_PROMPT = "raise" if args.no_prompt else None
 
         super().start(args, config)
         self.start_time = time.time()
+        self._started = datetime.utcnow()
         self._db_session = args.db_session
+        self._stats = SyncStats()
+        event.listen(args.db_engine, "before_cursor_execute", self._stats.countStatement)
 
         try:
             lib = self._db_session.query(Library)\
@@ -99,62 +175,250 @@ class SyncPlugin(LoaderPlugin):
             self._db_session.flush()
         self._lib = lib
 
-        if self.args.monitor:
-            from ._inotify import Monitor
-            if self.monitor_proc is None:
-                self.monitor_proc = Monitor()
-            # Monitor roots, file dir are watched as the files are traversed
+        with self._stats.phase("load"):
+            # Monitor syncs reuse the library's index, which is kept current by each sync.
+            if not args._incremental or lib.id not in self._track_indexes:
+                self._track_indexes[lib.id] = TrackIndex.load(self._db_session, lib.id)
+            self._track_index = self._track_indexes[lib.id]
+            if not args._incremental or lib.id not in self._manifests:
+                self._manifests[lib.id] = DirectoryManifest.load(self._db_session, lib.id)
+            self._manifest = self._manifests[lib.id]
+            self._manifest.unchanged_dirs.clear()
+            self._touched_albums.clear()
+            self._touched_artists.clear()
+            self._unlinked_imgs.clear()
+            self._artist_cache.clear()
+            self._album_cache.clear()
+            # As are the tag, image, and image file memos, which the purge keeps current.
+            if not args._incremental or lib.id not in self._tag_caches:
+                self._tag_caches[lib.id] = dict(self._db_session.query(Tag.name, Tag.id)
+                                                                .filter_by(lib_id=lib.id))
+            self._tag_cache = self._tag_caches[lib.id]
+            if not args._incremental or not self._ids:
+                self._image_cache = {(md5, type_): id_ for id_, md5, type_ in
+                                        self._db_session.query(Image.id, Image.md5, Image.type)}
+                # New rows are assigned ids up front so each directory is written with a
+                # single flush
+                self._ids = {T: IdAllocator(self._db_session, T)
+                                for T in (Artist, Album, Track, Tag, Image, ImageFile, Directory)}
+            else:
+                # Other writers may have inserted rows since the last sync.
+                for ids in self._ids.values():
+                    ids.refresh()
+            if not args._incremental or lib.id not in self._lib_image_files:
+                self._lib_image_files[lib.id] = {
+                    path: (id_, size, usecs(mtime), album_id)
+                        for id_, path, size, mtime, album_id in
+                            self._db_session.query(ImageFile.id, ImageFile.path,
+                                                   ImageFile.size_bytes, ImageFile.mtime,
+                                                   ImageFile.album_id)
+                                            .filter_by(lib_id=lib.id)}
+            self._image_files = self._lib_image_files[lib.id]
+
+        # Command line options override the library config.
+        self._commit_limits = tuple(
+            arg if arg is not None else lib_arg
+                for arg, lib_arg in [(args.commit_dirs, args._library.commit_dirs),
+                                     (args.commit_tracks, args._library.commit_tracks),
+                                     (args.commit_secs, args._library.commit_secs)])
+        self._uncommitted = [0, 0]
+        self._last_commit_time = time.time()
+
+        # Full syncs record a checkpoint with each commit, see --resume.
+        self._checkpoint = self._resume_key = self._last_dir = None
+        if not args._incremental:
+            self._checkpoint = self._db_session.query(SyncCheckpoint).get(lib.id)
+            if self._checkpoint and args.resume:
+                self._resume_key = self._walkKey(self._checkpoint.path)
+                if self._resume_key is None:
+                    log.warning("Sync checkpoint not in the library paths, starting over: "
+                                f"{self._checkpoint.path}")
+                else:
+                    pout(Fg.blue("Resuming sync after directory") + ": " +
+                         self._checkpoint.path)
+                    (self._num_loaded, self._num_added,
+                     self._num_modified, self._num_moved) = (self._checkpoint.num_files,
+                                                             self._checkpoint.num_added,
+                                                             self._checkpoint.num_modified,
+                                                             self._checkpoint.num_moved)
+            if self._checkpoint is None:
+                self._checkpoint = SyncCheckpoint(lib_id=lib.id)
+            if self._resume_key is None:
+                self._checkpoint.started = datetime.utcnow()
+
+        if self.args.jobs > 1 and self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.args.jobs)
+
+        if self.args.monitor and not self.args._incremental:
+            if self.sync_queue is None:
+                self.sync_queue = multiprocessing.Queue()
+            library = self.args._library
+            if self.args.poll or library.monitor == MONITOR_POLL:
+                from .poller import Poller
+                if library.name not in self.poll_procs:
+                    self.poll_procs[library.name] = Poller(library.name, self.sync_queue,
+                                                           interval=library.poll_interval,
+                                                           budget=library.poll_budget)
+                monitor = self.poll_procs[library.name]
+            else:
+                from ._inotify import Monitor
+                if self.monitor_proc is None:
+                    self.monitor_proc = Monitor(self.sync_queue)
+                monitor = self.monitor_proc
+            # The monitor watches each root and its subdirectories, and then the directories
+            # that are created.
             for p in self.args.paths:
-                self._watchDir(p)
+                if os.path.isdir(p):
+                    monitor.watch(self._lib.name, p)
 
-    def _getArtist(self, session, name, origin, resolved_artist):
+    def _getArtist(self, session, name, origin):
+        """Returns the id of the artist ``name`` from ``origin``, adding the artist when it does
+        not exist. ``None`` is returned when a duplicate artist could not be resolved."""
         origin_dict = {"origin_city": origin.city if origin else None,
                        "origin_state": origin.state if origin else None,
                        "origin_country": normalizeCountry(origin.country) if origin else None,
                       }
         if name == VARIOUS_ARTISTS_NAME:
-            artist_rows = [session.query(Artist).filter_by(name=VARIOUS_ARTISTS_NAME,
-                                                           lib_id=NULL_LIB_ID).one()]
+            key = (NULL_LIB_ID, name, None, None, None)
         else:
-            artist_rows = session.query(Artist)\
-                                 .filter_by(name=name,
-                                            lib_id=self._lib.id,
-                                            **origin_dict)\
-                                 .all()
-
-        if artist_rows:
-            if len(artist_rows) > 1 and resolved_artist:
-                # Use previously resolved artist for this directory.
-                artist = resolved_artist
-            elif len(artist_rows) > 1:
-                # Resolve artist
-                try:
-                    heading = "Multiple artists names '%s'" % \
-                              artist_rows[0].name
-                    artist = console.selectArtist(Fg.blue(heading),
-                                                  choices=artist_rows,
-                                                  allow_create=True)
-                except PromptExit:
-                    log.warning("Duplicate artist requires user intervention to resolve.")
-                    artist = None
-                else:
-                    if artist not in artist_rows:
-                        session.add(artist)
-                        session.flush()
-                        pout(Fg.blue("Updating artist") + ": " + name)
-                    resolved_artist = artist
+            key = (self._lib.id, name, *origin_dict.values())
+
+        if key in self._resolved_artists:
+            # Use previously resolved artist for this directory.
+            return self._resolved_artists[key]
+
+        artist_ids = self._artist_cache.get(key)
+        if artist_ids is None:
+            if name == VARIOUS_ARTISTS_NAME:
+                artist_rows = [session.query(Artist).filter_by(name=VARIOUS_ARTISTS_NAME,
+                                                               lib_id=NULL_LIB_ID).one()]
             else:
-                assert len(artist_rows) == 1
-                # Artist match
-                artist = artist_rows[0]
-        else:
+                artist_rows = session.query(Artist)\
+                                     .filter_by(name=name,
+                                                lib_id=self._lib.id,
+                                                **origin_dict)\
+                                     .all()
+            artist_ids = self._artist_cache[key] = [a.id for a in artist_rows]
+
+        if len(artist_ids) == 1:
+            # Artist match
+            return artist_ids[0]
+        elif not artist_ids:
             # New artist
-            artist = Artist(name=name, lib_id=self._lib.id, **origin_dict)
+            artist = Artist(id=self._ids[Artist].next(), name=name, lib_id=self._lib.id,
+                            **origin_dict)
             session.add(artist)
-            session.flush()
+            self._dir_artists[artist.id] = artist
             pout(Fg.green("Adding artist") + ": " + name)
+            self._artist_cache[key] = [artist.id]
+            return artist.id
 
-        return artist, resolved_artist
+        # Resolve artist
+        artist_rows = session.query(Artist).filter(Artist.id.in_(artist_ids))\
+                                           .order_by(Artist.id).all()
+        try:
+            heading = "Multiple artists names '%s'" % artist_rows[0].name
+            artist = console.selectArtist(Fg.blue(heading), choices=artist_rows,
+                                          allow_create=True)
+        except PromptExit:
+            log.warning("Duplicate artist requires user intervention to resolve.")
+            return None
+
+        if artist not in artist_rows:
+            artist.id = self._ids[Artist].next()
+            artist.lib_id = self._lib.id
+            session.add(artist)
+            self._dir_artists[artist.id] = artist
+            pout(Fg.blue("Updating artist") + ": " + name)
+            # The artist rows for this key, and the key of the new artist, have changed
+            self._artist_cache.pop(key, None)
+            self._artist_cache.pop((artist.lib_id, artist.name, artist.origin_city,
+                                    artist.origin_state, artist.origin_country), None)
+
+        self._resolved_artists[key] = artist.id
+        return artist.id
+
+    def _getAlbum(self, session, artist_id, tag, album_type, d_datetime):
+        """Returns the album for ``tag`` by ``artist_id``, adding it when it does not exist."""
+        rel_date, rec_date, or_date = [Date.parse(d) if d else None
+                                       for d in (tag.release_date, tag.recording_date,
+                                                 tag.original_release_date)]
+        key = (self._lib.id, artist_id, tag.album,
+               *[str(d) if d else None for d in (or_date, rel_date, rec_date)])
+
+        album = self._dir_albums.get(key)
+        if album is None and key in self._album_cache:
+            album = session.query(Album).get(self._album_cache[key])
+
+        if album is None:
+            # By original release date, then release date, then release and recording dates.
+            criteria = []
+            if or_date:
+                criteria.append({"original_release_date": or_date})
+            if rel_date:
+                criteria.append({"release_date": rel_date})
+            if rec_date:
+                criteria.append({"release_date": rel_date, "recording_date": rec_date})
+            for criterion in criteria:
+                # Albums added by this directory are not flushed yet, and so not queried.
+                album = next((a for a in self._dir_albums.values()
+                                if (a.lib_id, a.artist_id, a.title) ==
+                                       (self._lib.id, artist_id, tag.album) and
+                                   all(getattr(a, attr) == value
+                                           for attr, value in criterion.items())),
+                             None)
+                if album is None:
+                    album = session.query(Album).filter_by(lib_id=self._lib.id,
+                                                           artist_id=artist_id,
+                                                           title=tag.album,
+                                                           **criterion).one_or_none()
+                if album is not None:
+                    break
+
+            if album is None:
+                album = Album(id=self._ids[Album].next(), title=tag.album, lib_id=self._lib.id,
+                              artist_id=artist_id, type=album_type,
+                              release_date=rel_date,
+                              original_release_date=or_date,
+                              recording_date=rec_date,
+                              date_added=d_datetime)
+                pout(f"{Fg.green('Adding album')}: {album.title}")
+                session.add(album)
+
+            # Cached by id once the directory is flushed.
+            self._dir_albums[key] = album
+
+        if album.type != album_type:
+            pout(Fg.yellow("Updating album") + ": " + album.title)
+            album.type = album_type
+
+        return album
+
+    def _getTagId(self, session, name):
+        name = name[:Tag.NAME_LIMIT]
+        if name not in self._tag_cache:
+            tag = Tag(id=self._ids[Tag].next(), name=name, lib_id=self._lib.id)
+            session.add(tag)
+            self._tag_cache[name] = tag.id
+        return self._tag_cache[name]
+
+    def _getImage(self, session, img):
+        """Returns the stored image with the same md5 and type as the new :class:`Image`
+        ``img``, otherwise ``img`` is assigned an id and returned."""
+        image_id = self._image_cache.get((img.md5, img.type))
+        if image_id is not None:
+            # New images are not in the identity map until the directory is flushed.
+            return self._dir_images.get(image_id) or session.query(Image).get(image_id)
+
+        img.id = self._ids[Image].next()
+        self._image_cache[(img.md5, img.type)] = img.id
+        self._dir_images[img.id] = img
+        return img
+
+    def _getAlbumArtist(self, session, album):
+        # New artists are not in the identity map until the directory is flushed.
+        return (self._dir_artists.get(album.artist_id)
+                or session.query(Artist).get(album.artist_id))
 
     def _syncAudioFile(self, audio_file, album_type, d_datetime, session):
         path = audio_file.path
@@ -172,81 +436,39 @@ class SyncPlugin(LoaderPlugin):
                         "metadata, skipping: %s" % path)
             return None, None
 
-        # Used when a duplicate artist is resolved for the entire directory.
-        resolved_artist = None
-        resolved_album_artist = None
-
-        try:
-            track = session.query(Track)\
-                           .filter_by(path=path, lib_id=self._lib.id).one()
-        except NoResultFound:
-            track = None
-        else:
-            if (self.args.speed == "fast"
-                    and datetime.fromtimestamp(getctime(path)) == track.ctime):
-                # Track is in DB and the file is not modified.
-                return track, track.album
+        indexed = self._track_index.get(path)
+        track = self._dir_tracks.get(indexed.id) if indexed else None
+        if track and self._isUnchanged(path):
+            # Track is in DB and the file is not modified.
+            return track, track.album
 
         # Either adding the track (track == None)
         # or modifying (track != None)
 
-        artist, resolved_artist = self._getArtist(session, tag.artist, tag.artist_origin,
-                                                  resolved_artist)
-        if album_type != SINGLE_TYPE:
-            if tag.album_artist and tag.artist != tag.album_artist:
-                album_artist, resolved_album_artist = self._getArtist(session, tag.album_artist,
-                                                                      tag.artist_origin,
-                                                                      resolved_album_artist)
-            else:
-                album_artist = artist
-
-            if artist is None:
+        with self._stats.phase("resolve"):
+            artist_id = self._getArtist(session, tag.artist, tag.artist_origin)
+            if artist_id is None:
                 # see PromptExit
                 return None, None
 
-            album_artist_id = album_artist.id if not is_various \
-                                              else VARIOUS_ARTISTS_ID
-            rel_date = tag.release_date
-            rec_date = tag.recording_date
-            or_date = tag.original_release_date
-
-            # Original release date
-            if or_date:
-                album = session.query(Album).filter_by(lib_id=self._lib.id,
-                                                       artist_id=album_artist_id,
-                                                       title=tag.album,
-                                                       original_release_date=or_date).one_or_none()
-            # Release date
-            if not album and rel_date:
-                album = session.query(Album).filter_by(lib_id=self._lib.id,
-                                                       artist_id=album_artist_id,
-                                                       title=tag.album,
-                                                       release_date=rel_date).one_or_none()
-            # Recording date
-            if not album and rec_date:
-                album = session.query(Album).filter_by(lib_id=self._lib.id,
-                                                       artist_id=album_artist_id,
-                                                       title=tag.album,
-                                                       release_date=rel_date,
-                                                       recording_date=rec_date).one_or_none()
-            if album is None:
-                album = Album(title=tag.album, lib_id=self._lib.id,
-                              artist_id=album_artist_id, type=album_type,
-                              release_date=rel_date,
-                              original_release_date=or_date,
-                              recording_date=rec_date,
-                              date_added=d_datetime)
-                pout(f"{Fg.green('Adding album')}: {album.title}")
-                session.add(album)
-            else:
-                if album.type != album_type:
-                    pout(Fg.yellow("Updating album") + ": " + album.title)
-                    album.type = album_type
+            if album_type != SINGLE_TYPE:
+                if is_various:
+                    # The album artist tag is not resolved, it is not the album's artist and
+                    # would only add an artist without tracks or albums (purged as an orphan),
+                    # or prompt to resolve its duplicates.
+                    album_artist_id = VARIOUS_ARTISTS_ID
+                elif tag.album_artist and tag.artist != tag.album_artist:
+                    album_artist_id = self._getArtist(session, tag.album_artist, tag.artist_origin)
+                    if album_artist_id is None:
+                        # see PromptExit
+                        return None, None
+                else:
+                    album_artist_id = artist_id
 
-            session.flush()
+                album = self._getAlbum(session, album_artist_id, tag, album_type, d_datetime)
 
         if not track:
-            track = Track(audio_file=audio_file, lib_id=self._lib.id)
+            track = Track(id=self._ids[Track].next(), audio_file=audio_file, lib_id=self._lib.id)
             self._num_added += 1
             pout(Fg.green("Adding track") + ": " + path)
         else:
@@ -254,38 +476,46 @@ class SyncPlugin(LoaderPlugin):
             self._num_modified += 1
             pout(Fg.yellow("Updating track") + ": " + path)
 
-        track.artist_id = artist.id
+        track.artist_id = artist_id
         track.album_id = album.id if album else None
 
+        tag_ids = set()
         if tag.genre:
             # Not uncommon for multiple genres to be 0x00 delimited
-            for genre in tag.genre.name.split("\x00"):
-                genre_tag = db.getTag(genre, session, self._lib.id, add=True)
-                track.tags.append(genre_tag)
+            for genre in [g for g in tag.genre.split("\x00") if g]:
+                tag_ids.add(self._getTagId(session, genre))
+        # The track_tags rows are written once the directory is flushed.
+        self._dir_track_tags.append((track, tag_ids, indexed is None))
 
         session.add(track)
 
         if album:
-            # Tag images
-            img_type = None
-            for img in tag.images:
-                for img_type in art.TO_ID3_ART_TYPES:
-                    if img.picture_type in art.TO_ID3_ART_TYPES[img_type]:
-                        break
-                    img_type = None
-
-                if img_type is None:
-                    log.warning(f"Skipping unsupported image type: {img.picture_type}")
-                    continue
+            with self._stats.phase("images"):
+                # Tag images
+                img_type = None
+                for img in tag.images:
+                    for img_type in art.TO_ID3_ART_TYPES:
+                        if img.picture_type in art.TO_ID3_ART_TYPES[img_type]:
+                            break
+                        img_type = None
+
+                    if img_type is None:
+                        log.warning(f"Skipping unsupported image type: {img.picture_type}")
+                        continue
 
-                new_img = Image.fromTagFrame(img, img_type)
-                if new_img:
-                    syncImage(new_img,
-                              album if img_type in IMAGE_TYPES["album"]
-                                    else album.artist,
-                              session)
-                else:
-                    log.warning("Invalid image in tag")
+                    # Albums commonly embed the same image in each track, sync it once.
+                    if (album.id, img_type, img.md5) in self._dir_tag_images:
+                        continue
+                    self._dir_tag_images.add((album.id, img_type, img.md5))
+
+                    new_img = Image.fromTagFrame(img, img_type, md5sum=img.md5)
+                    if new_img:
+                        syncImage(self._getImage(session, new_img),
+                                  album if img_type in IMAGE_TYPES["album"]
+                                        else self._getAlbumArtist(session, album),
+                                  session, unlinked=self._unlinked_imgs)
+                    else:
+                        log.warning("Invalid image in tag")
 
         return track, album
 
@@ -300,9 +530,8 @@ class SyncPlugin(LoaderPlugin):
         # 3) not associated with a collection (tag.artist and tag.album differ)
 
         for tag in [f.tag for f in audio_files if f.tag]:
-            album_type = tag.user_text_frames.get(TXXX_ALBUM_TYPE)
-            if album_type:
-                types[album_type.text] += 1
+            if tag.album_type:
+                types[tag.album_type] += 1
 
         if len(types) == 1:
             return types.most_common()[0][0]
@@ -338,80 +567,409 @@ class SyncPlugin(LoaderPlugin):
             log.warning("Inconsistent type hints: %s" % str(types.keys()))
             return None
 
+    def handleFile(self, f, *args, stat=None, **kwargs):
+        # Files are loaded per directory, see handleDirectory
+        self._dir_files.append(f)
+        if stat is not None:
+            self._dir_stats[f] = stat
+
+    def _isUnchanged(self, path, st=None):
+        return self.args.speed != "normal" and self._track_index.isUnchanged(path, st)
+
+    def _syncFingerprints(self, files, stats=None):
+        """Update the path of the tracks that were moved to one of ``files``, and record the
+        inode and device of tracks which do not have them. Returns the stat results of
+        ``files``, those in ``stats`` (e.g. from the walk's listing) are not stat'd again."""
+        stats = dict(stats or {})
+        fingerprints = []
+        for f in files:
+            st = stats.get(f)
+            if st is None:
+                try:
+                    stats[f] = st = os.stat(f)
+                except OSError:
+                    continue
+
+            indexed = self._track_index.get(f)
+            if indexed is None:
+                moved = self._track_index.findMoved(st)
+                if moved:
+                    self._moveTrack(moved, f, st)
+            elif not indexed.inode and self._isUnchanged(f, st):
+                # Tracks sync'd before fingerprints were stored.
+                self._track_index.setFingerprint(f, st)
+                fingerprints.append(dict(zip(("t_id", "inode", "device"),
+                                             (indexed.id, *statFingerprint(st)))))
+
+        if fingerprints:
+            self._db_session.execute(Track.__table__.update()
+                                                    .where(Track.id == sql.bindparam("t_id"))
+                                                    .values(inode=sql.bindparam("inode"),
+                                                            device=sql.bindparam("device")),
+                                     fingerprints)
+        return stats
+
+    def _moveTrack(self, indexed, path, st):
+        """Update the path of the track ``indexed`` to ``path``, whose stat result is ``st``.
+        The file must not be modified, so its tags (and its album) have not changed."""
+        pout(Fg.yellow("Moving track") + f": {indexed.path} -> {path}")
+        inode, device = statFingerprint(st)
+        self._db_session.query(Track).filter(Track.id == indexed.id)\
+            .update({"path": path, "ctime": datetime.fromtimestamp(st.st_ctime),
+                     "inode": inode, "device": device},
+                    synchronize_session="evaluate")
+        self._track_index.move(indexed.path, path, st)
+        self._num_moved += 1
+
+    def _syncChanges(self, changes):
+        """Sync the monitor's file ``changes`` (see :class:`ChangeSet`), only the changed files
+        are parsed. Deleted files are purged, since the changed directories are the sync's
+        paths. Returns the directories to walk instead, as ``{path: recursive}``: those of the
+        ``DIRECTORY`` changes, and those of the files that can not be sync'd on their own."""
+        excludes_re = [re.compile(e) for e in self.args.excludes or []]
+        changed_dirs = [c.path for c in changes if c.type == DIRECTORY]
+        removed_dirs = {os.path.dirname(c.path if c.type == DELETED else c.src_path)
+                            for c in changes if c.type in (DELETED, MOVED)}
+        for change in [c for c in changes if c.type == MOVED_DIRECTORY]:
+            moved_dirs = self._moveDirectory(change.src_path, change.path)
+            if moved_dirs is None:
+                # Sync'd as a deleted directory and a new one.
+                changed_dirs += [change.src_path, change.path]
+            else:
+                # Renaming did not remove any files, so the directories are not listed by the
+                # purge.
+                self._manifest.unchanged_dirs.update(set(moved_dirs) - removed_dirs)
+
+        def _isWalked(path):
+            return any(isAtOrBelow(path, d) for d in changed_dirs)
+
+        walks = {d: True for d in changed_dirs if os.path.isdir(d)}
+        dir_files = collections.defaultdict(list)
+        for change in changes:
+            if (change.type in (DIRECTORY, MOVED_DIRECTORY, DELETED) or _isWalked(change.path)
+                    or any(ex.match(change.path) for ex in excludes_re)):
+                continue
+            if change.type == MOVED:
+                self._applyMove(change.src_path, change.path)
+            dir_files[os.path.dirname(change.path)].append(change.path)
+
+        for d, files in sorted(dir_files.items()):
+            if not self._syncFiles(d, sorted(files)) and os.path.isdir(d):
+                walks[d] = False
+
+        return walks
+
+    def _moveDirectory(self, src_path, path):
+        """Update the paths below directory ``src_path``, which was renamed to ``path``, without
+        reading any files. Returns the new paths of the track directories that were moved, or
+        ``None`` if there are already tracks, image files, or directories at or below
+        ``path``."""
+        if (self._track_index.hasDir(path) or self._manifest.hasDir(path)
+                or any(isAtOrBelow(p, path) for p in self._image_files)):
+            return None
+
+        with self._stats.phase("sync"):
+            num_tracks = moveDirectory(self._db_session, self._lib.id, src_path, path)
+            moved_dirs = self._track_index.moveDir(src_path, path)
+            self._manifest.move(src_path, path)
+            for p in [p for p in self._image_files if isAtOrBelow(p, src_path)]:
+                self._image_files[path + p[len(src_path):]] = self._image_files.pop(p)
+
+        pout(Fg.yellow("Moving directory") + f": {src_path} -> {path} ({num_tracks} tracks)")
+        self._num_moved += num_tracks
+        return moved_dirs
+
+    def _applyMove(self, src_path, path):
+        indexed = self._track_index.get(src_path)
+        if indexed is None or path in self._track_index or os.path.lexists(src_path):
+            return
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+
+        # Otherwise the file was modified too, it is sync'd as a new track and the track of
+        # src_path is purged.
+        if (indexed.size_bytes, indexed.mtime) == (st.st_size, statUsecs(st)[1]):
+            self._moveTrack(indexed, path, st)
+
+    def _syncFiles(self, d, files):
+        """Sync ``files``, some of the files of directory ``d``, without the rest of the
+        directory. Returns ``False`` when the directory must be sync'd instead."""
+        with self._stats.phase("stat"):
+            stats = self._syncFingerprints(files)
+            changed = [f for f in files if f in stats and not self._isUnchanged(f, stats[f])]
+        if not changed:
+            return True
+
+        with self._stats.phase("parse"):
+            audio_files, image_files, _ = loadFiles(changed)
+        if image_files:
+            # Image files are sync'd with the album of the directory's tracks.
+            return False
+
+        album_type = self._dirAlbumType(d, audio_files)
+        if album_type is None:
+            return False
+
+        with self._stats.phase("sync"):
+            self._syncDirectory(d, LoadResult(audio_files, [], []), album_type=album_type)
+        return True
+
+    def _dirAlbumType(self, d, audio_files):
+        """Returns the album type for ``audio_files``, some of the files of directory ``d``,
+        from the album of the directory's other tracks. ``None`` is returned when it is not
+        known, and all of the directory's files are needed (see :meth:`_albumTypeHint`)."""
+        paths = {f.path for f in audio_files}
+        others = [t for t in self._track_index.tracksIn(d) if t.path not in paths]
+        album_ids = {t.album_id for t in others}
+        if len(album_ids) != 1 or None in album_ids:
+            return None
+
+        album = self._db_session.query(Album).get(album_ids.pop())
+        tags = [f.tag for f in audio_files if f.tag]
+        if any(tag.album != album.title or tag.album_type not in (None, album.type)
+                   for tag in tags):
+            return None
+
+        if album.type in (LP_TYPE, EP_TYPE) and not all(tag.album_type for tag in tags):
+            # Depends on the number of tracks
+            num_tracks = len(others) + len(audio_files)
+            if album.type != (LP_TYPE if num_tracks > EP_MAX_SIZE_HINT else EP_TYPE):
+                return None
+
+        return album.type
+
+    def _walkKey(self, d):
+        """Returns a key that orders directory ``d`` in walk order (see
+        :meth:`DirectoryManifest.walk`), ``None`` if ``d`` is not in the sync'd paths."""
+        dirpath = Path(os.path.abspath(d))
+        for i, root in enumerate(self.args.paths):
+            try:
+                return i, dirpath.relative_to(os.path.abspath(root)).parts
+            except ValueError:
+                continue
+        return None
+
     def handleDirectory(self, d, _):
-        pout(Fg.blue("Syncing directory") + ": " + str(d))
-        audio_files = list(self._file_cache)
-        self._file_cache = []
+        files, stats = self._dir_files, self._dir_stats
+        self._dir_files, self._dir_stats = [], {}
+
+        if self._resume_key is not None:
+            key = self._walkKey(d)
+            if key is not None and key <= self._resume_key:
+                # Sync'd before the sync being resumed was interrupted.
+                return
+            self._resume_key = None
+
+        with self._stats.phase("stat"):
+            stats = self._syncFingerprints(files, stats)
+            # Files with timestamps and size matching the database are not parsed (speed=fast).
+            unchanged = [f for f in files if f in stats and self._isUnchanged(f, stats[f])]
+
+        if self._pool is None:
+            with self._stats.phase("parse"):
+                load_result = loadFiles(files, unchanged)
+            with self._stats.phase("sync"):
+                self._syncDirectory(d, load_result, stats=stats)
+            return
 
-        image_files = self._dir_images
-        self._dir_images = []
+        # Parsing is done by the worker pool, and the results are sync'd in walk order.
+        self._pending.append((d, self._pool.submit(loadFiles, files, unchanged), stats))
+        while self._pending and (self._pending[0][1].done()
+                                 or len(self._pending) > self.args.jobs * 2):
+            self._syncNextPending()
+
+    def _syncNextPending(self):
+        d, future, stats = self._pending.popleft()
+        with self._stats.phase("parse"):
+            load_result = future.result()
+        with self._stats.phase("sync"):
+            self._syncDirectory(d, load_result, stats=stats)
+
+    def _syncDirectory(self, d, load_result, album_type=None, stats=None):
+        """Sync the files of directory ``d``. ``stats`` are the known stat results of its
+        files, see :meth:`_syncFingerprints`."""
+        pout(Fg.blue("Syncing directory") + ": " + str(d))
+        audio_files, image_files, skipped = load_result
+        self._num_loaded += len(audio_files) + len(skipped)
+        self._stats.bytes_parsed += sum(f.info.size_bytes for f in audio_files if f.info)
 
-        if not audio_files:
+        if not audio_files and not skipped:
             return
 
         d_datetime = datetime.fromtimestamp(getctime(d))
 
-        album_type = self._albumTypeHint(audio_files) or LP_TYPE
+        album_type = album_type or self._albumTypeHint(audio_files) or LP_TYPE
+        # Duplicate artists are resolved once per directory.
+        self._resolved_artists.clear()
 
         album = None
+        tracks = []
         session = self._db_session
-        for audio_file in audio_files:
-            try:
-                track, album = self._syncAudioFile(audio_file, album_type, d_datetime, session)
-            except Exception as ex:
-                log.error(f"{audio_file.path} sync error: {ex}")
-                # Continue
 
-        if album:
-            # Directory images.
-            for img_file in image_files:
-                img_type = art.matchArtFile(img_file)
-                if img_type is None:
-                    log.warning(f"Skipping unrecognized image file: {img_file}")
-                    continue
-
-                new_img = Image.fromFile(img_file, img_type)
-                if new_img:
-                    new_img.description = os.path.basename(img_file)
-                    syncImage(new_img, album if img_type in IMAGE_TYPES["album"]
-                                             else album.artist,
-                              session)
+        # The directory's known tracks are loaded with a single query.
+        track_ids = [t.id for t in [self._track_index.get(f.path) for f in audio_files] if t]
+        if track_ids:
+            self._dir_tracks = {t.id: t
+                                   for t in session.query(Track).filter(Track.id.in_(track_ids))}
+            for t in self._dir_tracks.values():
+                self._touched_artists.add(t.artist_id)
+                if t.album_id:
+                    self._touched_albums.add(t.album_id)
+
+        # New and modified rows are written with a single flush, see IdAllocator.
+        with session.no_autoflush:
+            for audio_file in audio_files:
+                try:
+                    track, album = self._syncAudioFile(audio_file, album_type, d_datetime,
+                                                       session)
+                except Exception as ex:
+                    log.error(f"{audio_file.path} sync error: {ex}")
+                    self._manifest.invalidate(d)
+                    # Continue
                 else:
-                    log.warning(f"Invalid image file: {img_file}")
+                    if track:
+                        tracks.append(track)
 
-        session.commit()
-        if self.args.monitor:
-            self._watchDir(d)
-
-    def _watchDir(self, d):
-        valid_path = False
-        dirpath = Path(d)
-        for root in [Path(p) for p in self.args.paths]:
-            try:
-                dirpath.relative_to(root)
-            except ValueError:
-                continue
+            if skipped:
+                # The directory is unchanged, but its images may not be.
+                album_id = self._track_index.get(skipped[-1]).album_id
             else:
-                valid_path = True
-                self.monitor_proc.dir_queue.put((self._lib.name, dirpath))
-                # Add parents up to root. It is safe to all the same dir to
-                # the  Monitor
-                parent = dirpath.parent
-                try:
-                    parent.relative_to(root)
-                except ValueError:
-                    # Added a root
-                    pass
+                album_id = album.id if album else None
+
+            with self._stats.phase("images"):
+                # Image files are only read when new, modified, or the album has changed.
+                stats = stats or {}
+                image_files = [f for f in image_files
+                                   if not self._isImageFileUnchanged(f, album_id, stats.get(f))]
+                if skipped and album_id and image_files:
+                    album = session.query(Album).get(album_id)
+
+                if album:
+                    # Directory images.
+                    for img_file in image_files:
+                        img_type = art.matchArtFile(img_file)
+                        if img_type is None:
+                            log.warning(f"Skipping unrecognized image file: {img_file}")
+                            continue
+
+                        self._updateImageFile(session, img_file, album.id, stats.get(img_file))
+                        self._stats.bytes_parsed += self._image_files[img_file][1]
+                        new_img = Image.fromFile(img_file, img_type)
+                        if new_img:
+                            new_img.description = os.path.basename(img_file)
+                            syncImage(self._getImage(session, new_img),
+                                      album if img_type in IMAGE_TYPES["album"]
+                                            else self._getAlbumArtist(session, album),
+                                      session, unlinked=self._unlinked_imgs)
+                        else:
+                            log.warning(f"Invalid image file: {img_file}")
+
+        with self._stats.phase("commit"):
+            session.flush()
+            for track in tracks:
+                self._track_index.update(track)
+            syncTrackTags(session,
+                          {track.id: tag_ids for track, tag_ids, _ in self._dir_track_tags},
+                          new_ids={track.id for track, _, is_new in self._dir_track_tags if is_new})
+        self._uncommitted[0] += 1
+        self._uncommitted[1] += len(self._dir_track_tags)
+        self._dir_track_tags.clear()
+        self._album_cache.update({key: album.id for key, album in self._dir_albums.items()})
+        self._dir_albums.clear()
+        self._dir_artists.clear()
+        self._dir_images.clear()
+        self._dir_tag_images.clear()
+        self._dir_tracks.clear()
+        self._last_dir = os.path.abspath(d)
+
+        if self._isCommitDue():
+            self._commit()
+
+    def _isImageFileUnchanged(self, path, album_id, st=None):
+        if self.args.speed == "normal" or album_id is None or path not in self._image_files:
+            return False
+
+        _, size_bytes, mtime, file_album_id = self._image_files[path]
+        st = st or os.stat(path)
+        return (size_bytes, mtime, file_album_id) == (st.st_size, statUsecs(st)[1], album_id)
+
+    def _updateImageFile(self, session, path, album_id, st=None):
+        """Record the size and mtime of image file ``path``, sync'd to ``album_id``. ``st`` is
+        its stat result, if known."""
+        st = st or os.stat(path)
+        if path in self._image_files:
+            image_file = session.query(ImageFile).get(self._image_files[path][0])
+        else:
+            image_file = ImageFile(id=self._ids[ImageFile].next(), path=path,
+                                   lib_id=self._lib.id)
+            session.add(image_file)
+        image_file.size_bytes = st.st_size
+        image_file.mtime = datetime.fromtimestamp(st.st_mtime)
+        image_file.album_id = album_id
+
+        self._image_files[path] = (image_file.id, st.st_size, usecs(image_file.mtime), album_id)
+
+    def _isCommitDue(self):
+        dirs, tracks, secs = self._commit_limits
+        if (dirs, tracks, secs) == (None, None, None):
+            # Commit every directory
+            return True
+
+        num_dirs, num_tracks = self._uncommitted
+        return bool((dirs and num_dirs >= dirs) or
+                    (tracks and num_tracks >= tracks) or
+                    (secs and time.time() - self._last_commit_time >= secs))
+
+    def _commit(self):
+        with self._stats.phase("commit"):
+            if self._checkpoint is not None and self._last_dir is not None:
+                self._checkpoint.path = self._last_dir
+                (self._checkpoint.num_files, self._checkpoint.num_added,
+                 self._checkpoint.num_modified, self._checkpoint.num_moved) = \
+                        (self._num_loaded, self._num_added, self._num_modified, self._num_moved)
+                self._db_session.add(self._checkpoint)
+            self._db_session.commit()
+            for ids in self._ids.values():
+                ids.refresh()
+        self._uncommitted = [0, 0]
+        self._last_commit_time = time.time()
+
+    def run(self, args):
+        """Sync ``args.paths``, this replaces :func:`eyed3.main.main` in order to walk the
+        paths using the library's :class:`DirectoryManifest`."""
+        try:
+            self.start(args, None)
+
+            # Monitor syncs are for directories known to have changed.
+            prune = args.speed == "fastest" and not args._incremental
+            with self._stats.phase("walk"):
+                if args._changes is None:
+                    walks = [(p, not args.non_recursive) for p in args.paths]
                 else:
-                    while parent != root:
-                        self.monitor_proc.dir_queue.put((self._lib.name,
-                                                         parent))
-                        parent = parent.parent
-                break
-        assert valid_path
+                    walks = self._syncChanges(args._changes).items()
+                for p, recursive in walks:
+                    self._manifest.walk(self, p, excludes=args.excludes, recursive=recursive,
+                                        prune=prune)
+
+            return self.handleDone() or 0
+        finally:
+            # Even when the sync fails, or the statements of later syncs would be counted too.
+            if self._stats and event.contains(args.db_engine, "before_cursor_execute",
+                                              self._stats.countStatement):
+                event.remove(args.db_engine, "before_cursor_execute", self._stats.countStatement)
 
     def handleDone(self):
-        t = time.time() - self.start_time
+        while self._pending:
+            self._syncNextPending()
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+        with self._stats.phase("commit"):
+            self._manifest.save(self._db_session, self._ids[Directory])
+        self._commit()
+
         session = self._db_session
 
         session.query(Meta).one().last_sync = datetime.utcnow()
@@ -420,10 +978,30 @@ class SyncPlugin(LoaderPlugin):
         num_orphaned_artists = 0
         num_orphaned_albums = 0
         if not self.args.no_purge:
+            # Monitor syncs only purge what the sync'd directories referenced.
+            scope = PurgeScope(self.args.paths, self._touched_albums, self._touched_artists,
+                               self._unlinked_imgs) if self.args._incremental else None
             log.debug("Purging orphans (tracks, artists, albums) from database")
-            (self._num_deleted,
-             num_orphaned_artists,
-             num_orphaned_albums) = deleteOrphans(session)
+            with self._stats.phase("purge"):
+                (self._num_deleted,
+                 num_orphaned_artists,
+                 num_orphaned_albums) = deleteOrphans(session, self._track_index, scope=scope,
+                                                      unchanged_dirs=self._manifest.unchanged_dirs,
+                                                      image_files=self._image_files,
+                                                      image_cache=self._image_cache)
+
+        if self._checkpoint is not None:
+            # The sync is complete, and purged.
+            session.query(SyncCheckpoint).filter_by(lib_id=self._lib.id).delete()
+            self._checkpoint = None
+
+        t = time.time() - self.start_time
+        session.add(self._stats.syncRun(lib_id=self._lib.id, started=self._started, secs=t,
+                                        incremental=bool(self.args._incremental),
+                                        num_files=self._num_loaded, num_added=self._num_added,
+                                        num_modified=self._num_modified,
+                                        num_moved=self._num_moved,
+                                        num_deleted=self._num_deleted))
 
         if self._num_loaded or self._num_deleted:
             pout("")
@@ -432,10 +1010,15 @@ class SyncPlugin(LoaderPlugin):
             pout("%d files sync'd" % self._num_loaded)
             pout("%d tracks added" % self._num_added)
             pout("%d tracks modified" % self._num_modified)
+            pout("%d tracks moved" % self._num_moved)
             if not self.args.no_purge:
                 pout("%d orphaned tracks deleted" % self._num_deleted)
                 pout("%d orphaned artists deleted" % num_orphaned_artists)
                 pout("%d orphaned albums deleted" % num_orphaned_albums)
+            pout("%d database statements, %.1f MB parsed" % (self._stats.statements,
+                                                              self._stats.bytes_parsed / 2 ** 20))
+            pout("Phases: " + ", ".join(f"{phase} {secs:.2f}s"
+                                            for phase, secs in self._stats.secs.items()))
             pout("")
 
 
@@ -453,11 +1036,6 @@ class Sync(Command):
         args = args or self.args
         args.plugin = self.plugin
 
-        if args.monitor and platform.system() == "Darwin":
-            perr("Monitor mode is not supported on OS/X\n")
-            self.parser.print_usage()
-            return 1
-
         libs = {lib.name: lib for lib in args.config.music_libs}
         if not libs and not args.paths:
             perr("\nMissing at least one path/library in which to sync!\n")
@@ -479,10 +1057,18 @@ class Sync(Command):
         else:
             sync_libs = list(libs.values())
 
+        if (args.monitor and not args.poll and platform.system() == "Darwin" and
+                any(lib.monitor != MONITOR_POLL for lib in sync_libs)):
+            perr("Monitor mode is not supported on OS/X, except by polling (--poll)\n")
+            self.parser.print_usage()
+            return 1
+
         args.db_engine, args.db_session = self.db_engine, self.db_session
 
-        def _syncLib(lib):
+        def _syncLib(lib, incremental=False, changes=None):
             args._library = lib
+            args._incremental = incremental
+            args._changes = changes
 
             args.paths = []
             for p in lib.paths:
@@ -493,7 +1079,7 @@ class Sync(Command):
                  log=log)
 
             args.excludes = lib.excludes
-            return eyed3_main(args, None)
+            return self.plugin.run(args)
 
         try:
             for lib in sync_libs:
@@ -508,30 +1094,43 @@ class Sync(Command):
             return 1
 
         if args.monitor:
-            from ._inotify import SYNC_INTERVAL
-            monitor = self.plugin.monitor_proc
+            monitors = list(self.plugin.poll_procs.values())
+            if self.plugin.monitor_proc is not None:
+                monitors.append(self.plugin.monitor_proc)
+            sync_queue = self.plugin.sync_queue
+            monitor_libs = {lib.name: lib for lib in sync_libs}
 
             # Commit now, since we won't be returning
             self.db_session.commit()
 
-            monitor.start()
+            for monitor in monitors:
+                monitor.start()
             try:
                 while True:
-                    if monitor.sync_queue.empty():
-                        time.sleep(SYNC_INTERVAL / 2)
-                        continue
-
-                    sync_libs = {}
-                    for i in range(monitor.sync_queue.qsize()):
-                        lib, path = monitor.sync_queue.get_nowait()
-                        if lib not in sync_libs:
-                            sync_libs[lib] = set()
-                        sync_libs[lib].add(path)
-
-                    for lib, paths in sync_libs.items():
-                        result = _syncLib(MusicLibrary(lib, paths=paths))
+                    # Blocks until a monitor requests syncs, then takes any other pending
+                    # requests too.
+                    requests = sync_queue.get()
+                    while True:
+                        try:
+                            requests += sync_queue.get_nowait()
+                        except queue.Empty:
+                            break
+
+                    lib_changes = {}
+                    for lib, change in requests:
+                        if lib not in lib_changes:
+                            lib_changes[lib] = []
+                        lib_changes[lib].append(change)
+
+                    for lib, changes in lib_changes.items():
+                        # The sync, and purge, is limited to the changed directories.
+                        paths = sorted({d for c in changes for d in changeDirs(c)})
+                        excludes = monitor_libs[lib].excludes if lib in monitor_libs else None
+                        result = _syncLib(MusicLibrary(lib, paths=paths, excludes=excludes),
+                                          incremental=True, changes=changes)
                         if result != 0:
                             return result
                         self.db_session.commit()
             finally:
-                monitor.join()
+                for monitor in monitors:
+                    monitor.join()
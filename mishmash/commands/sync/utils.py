@@ -1,92 +1,367 @@
 import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
 import nicfit
+from sqlalchemy import sql
 from nicfit.console import pout
 from nicfit.console.ansi import Fg
 
+from ...util import dirsAtOrBelow
 from ...orm import VARIOUS_ARTISTS_ID
-from ...orm import Artist, Track, Album
+from ...orm import Artist, Track, Album, Image, ImageFile, Directory
+from ...orm import track_tags, album_tags, album_images, artist_tags, artist_images
 
 log = nicfit.getLogger(__name__)
+PurgeScope = collections.namedtuple("PurgeScope",
+                                    ["paths", "album_ids", "artist_ids", "image_ids"])
+"""Limits :func:`deleteOrphans` to the tracks at or below the directories ``paths``, the
+albums and artists with ids in ``album_ids`` and ``artist_ids``, and the images with ids in
+``image_ids`` (e.g. those unlinked by :func:`syncImage`). Albums and artists of the deleted
+tracks, and the images of those deleted, are always included."""
+ID_BATCH_SIZE = 500
+"""The maximum number of ids used in a single ``IN`` clause."""
+LISTING_THREADS = 8
+"""The number of threads used to list directories when purging, directory listings are
+mostly I/O wait and on network storage benefit from being concurrent."""
 
 
-def deleteOrphans(session):
-    num_orphaned_artists = 0
-    num_orphaned_albums = 0
+class IdAllocator:
+    """Assigns primary key ids for new rows of ``orm_type``, reserved ``batch_size`` at a time.
+    With ids assigned up front the rows of many objects can be inserted with a single
+    (executemany) statement, rather than one statement per object to fetch each new id.
+
+    PostgreSQL ids are reserved from the table's sequence, otherwise (SQLite) ids are counted
+    from the table's maximum id, which is read again after each :meth:`refresh`.
+    """
+    def __init__(self, session, orm_type, batch_size=100):
+        self._session = session
+        self._type = orm_type
+        self._batch_size = batch_size
+        self._ids = collections.deque()
+        self._next_id = None
+
+        if session.bind.dialect.name == "postgresql":
+            self._sequence = orm_type.__table__.c.id.default.name
+        else:
+            self._sequence = None
+
+    def next(self):
+        if not self._ids:
+            self._reserve(self._batch_size)
+        return self._ids.popleft()
+
+    def refresh(self):
+        """Drop the reserved ids, when other writers may have inserted rows since they were
+        reserved (i.e. after a commit). Sequence ids are never reused, and are kept."""
+        if self._sequence is None:
+            self._ids.clear()
+            self._next_id = None
+
+    def _reserve(self, n):
+        if self._sequence:
+            self._ids.extend(
+                id for id, in self._session.execute(
+                    sql.text(f"SELECT nextval('{self._sequence}') FROM generate_series(1, :n)"),
+                    {"n": n}))
+        else:
+            if self._next_id is None:
+                self._next_id = (self._session.query(sql.func.max(self._type.id)).scalar()
+                                 or 0) + 1
+            self._ids.extend(range(self._next_id, self._next_id + n))
+            self._next_id += n
+
+
+def _missingFiles(dirname, names):
+    """Returns the subset of the set ``names`` that are not found in directory ``dirname``. Symbolic
+    links only count as found when their target exists."""
+    try:
+        with os.scandir(dirname) as entries:
+            found = {e.name for e in entries
+                        if not e.is_symlink() or os.path.exists(e.path)}
+    except (FileNotFoundError, NotADirectoryError):
+        # The entire directory is gone
+        return names
+    except OSError:
+        # Unlistable (e.g. no read permission), check each file.
+        return {n for n in names if not os.path.exists(os.path.join(dirname, n))}
+
+    return names - found
+
+
+def findOrphanedTracks(track_index, paths=None, unchanged_dirs=None, threads=LISTING_THREADS):
+    """Returns the :class:`IndexedTrack` entries of ``track_index`` whose files no longer
+    exist. Each directory is listed once, using ``threads`` concurrent listings, rather than
+    stat'ing every track. When ``paths`` is provided only the tracks at or below those
+    directories are checked. Directories in ``unchanged_dirs`` are known to have had no
+    entries removed, and are not listed."""
+    if paths is not None:
+        paths = [os.path.normpath(str(p)) for p in paths]
+    dirnames = track_index.dirnames(paths)
+    if unchanged_dirs:
+        dirnames = [d for d in dirnames if d not in unchanged_dirs]
+    dirs = [(d, {os.path.basename(t.path): t for t in track_index.tracksIn(d)})
+                for d in dirnames]
+    orphans = []
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        listings = pool.map(_missingFiles, [d for d, _ in dirs], [set(t) for _, t in dirs])
+        for (_, tracks), missing in zip(dirs, listings):
+            orphans.extend(tracks[name] for name in sorted(missing))
+
+    return orphans
+
+
+def findOrphanedImageFiles(image_files, paths=None, unchanged_dirs=None,
+                           threads=LISTING_THREADS):
+    """Returns the paths in ``image_files`` whose files no longer exist, listing each
+    directory once. See :func:`findOrphanedTracks` for ``paths`` and ``unchanged_dirs``."""
+    dirs = collections.defaultdict(set)
+    for path in image_files:
+        dirs[os.path.dirname(path)].add(os.path.basename(path))
+    if paths is not None:
+        sorted_dirs = sorted(dirs)
+        dirs = {d: dirs[d] for p in paths
+                    for d in dirsAtOrBelow(sorted_dirs, os.path.normpath(str(p)))}
+    if unchanged_dirs:
+        dirs = {d: names for d, names in dirs.items() if d not in unchanged_dirs}
+    orphans = []
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        listings = pool.map(_missingFiles, list(dirs), list(dirs.values()))
+        for d, missing in zip(list(dirs), listings):
+            orphans.extend(os.path.join(d, name) for name in sorted(missing))
+
+    return orphans
+
+
+def _scoped(column, ids):
+    """Yields the ``WHERE`` conditions limiting a statement to ``column`` values in ``ids``,
+    in batches. When ``ids`` is ``None`` the statement is not limited."""
+    if ids is None:
+        yield sql.true()
+        return
+
+    ids = list(ids)
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        yield column.in_(ids[i:i + ID_BATCH_SIZE])
+
+
+def deleteOrphans(session, track_index, scope=None, unchanged_dirs=None, image_files=None,
+                  image_cache=None):
+    """Delete the tracks in ``track_index`` (a :class:`TrackIndex`) whose files no longer
+    exist, and any artists and albums left without tracks. Returns the number of tracks,
+    artists, and albums deleted.
+
+    A :class:`PurgeScope` limits the purge to the tracks of some directories, and the
+    albums and artists those tracks referenced, otherwise the entire database is purged.
+    See :func:`findOrphanedTracks` for ``unchanged_dirs``.
+
+    ``image_files`` maps the paths of a library's image files to tuples starting with their
+    ``image_files`` row id. The rows of the files that no longer exist (in scope), and of the
+    orphaned albums, are deleted and removed from ``image_files``. The deleted images are
+    removed from ``image_cache``, a dict of ``(md5, type)`` to image id.
+    """
+    tracks, albums = Track.__table__, Album.__table__
+    artists, images = Artist.__table__, Image.__table__
+    album_ids = set(scope.album_ids) if scope else None
+    artist_ids = set(scope.artist_ids) if scope else None
+    img_ids = set(scope.image_ids) if scope else None
     num_orphaned_tracks = 0
-    found_ids = set()
 
     # Tracks
-    for track in session.query(Track).all():
-        if not os.path.exists(track.path):
-            pout(Fg.red("Removing track") + ": " + track.path)
-            session.delete(track)
-            num_orphaned_tracks += 1
-            log.warn("Deleting track: %s" % str(track))
-    session.flush()
+    orphans = findOrphanedTracks(track_index, paths=scope.paths if scope else None,
+                                 unchanged_dirs=unchanged_dirs)
+    for i in range(0, len(orphans), ID_BATCH_SIZE):
+        batch = orphans[i:i + ID_BATCH_SIZE]
+        track_ids = [t.id for t in batch]
+        for t in batch:
+            pout(Fg.red("Removing track") + ": " + t.path)
+            log.warn("Deleting track: %s" % t.path)
+        if scope:
+            album_ids.update(t.album_id for t in batch if t.album_id)
+            artist_ids.update(id for id, in session.execute(
+                sql.select([tracks.c.artist_id]).where(tracks.c.id.in_(track_ids))))
+        session.execute(track_tags.delete().where(track_tags.c.track_id.in_(track_ids)))
+        num_orphaned_tracks += session.execute(tracks.delete()
+                                                     .where(tracks.c.id.in_(track_ids))).rowcount
+    for t in orphans:
+        track_index.remove(t.path)
+
+    # Image files, those of orphaned albums are deleted with the albums
+    num_orphaned_image_files = 0
+    if image_files:
+        img_orphans = findOrphanedImageFiles(image_files,
+                                             paths=scope.paths if scope else None,
+                                             unchanged_dirs=unchanged_dirs)
+        for i in range(0, len(img_orphans), ID_BATCH_SIZE):
+            batch = img_orphans[i:i + ID_BATCH_SIZE]
+            num_orphaned_image_files += session.execute(
+                ImageFile.__table__.delete()
+                                   .where(ImageFile.id.in_([image_files[p][0] for p in batch]))
+            ).rowcount
+        for path in img_orphans:
+            log.debug("Deleted image file: %s" % path)
+            del image_files[path]
 
     # Albums
-    found_ids.clear()
-    for album in session.query(Album).all():
-        if album.id in found_ids:
-            continue
-
-        any_track = session.query(Track).filter(Track.album_id == album.id).first()
-        if not any_track:
-            log.warn("Deleting album: %s" % str(album))
-            session.delete(album)
-            num_orphaned_albums += 1
-        else:
-            found_ids.add(album.id)
-    session.flush()
+    num_orphaned_albums = 0
+    for in_scope in _scoped(albums.c.id, album_ids):
+        orphaned_albums = sql.select([albums.c.id]).where(sql.and_(
+            in_scope,
+            ~sql.exists().where(tracks.c.album_id == albums.c.id)))
+        if scope:
+            artist_ids.update(id for id, in session.execute(
+                sql.select([albums.c.artist_id]).where(albums.c.id.in_(orphaned_albums))))
+            img_ids.update(id for id, in session.execute(
+                sql.select([album_images.c.img_id])
+                   .where(album_images.c.album_id.in_(orphaned_albums))))
+        session.execute(album_tags.delete().where(album_tags.c.album_id.in_(orphaned_albums)))
+        if image_files:
+            for path, in session.execute(sql.select([ImageFile.path])
+                                            .where(ImageFile.album_id.in_(orphaned_albums))):
+                image_files.pop(path, None)
+        session.execute(ImageFile.__table__.delete()
+                                           .where(ImageFile.album_id.in_(orphaned_albums)))
+        session.execute(album_images.delete()
+                                    .where(album_images.c.album_id.in_(orphaned_albums)))
+        num_orphaned_albums += session.execute(albums.delete()
+                                                     .where(albums.c.id.in_(orphaned_albums))
+                                              ).rowcount
 
     # Artists
-    found_ids.clear()
-    for artist in session.query(Artist).all():
-        if (artist.id == VARIOUS_ARTISTS_ID or
-                artist.id in found_ids):
-            continue
-
-        any_track = session.query(Track).filter(Track.artist_id == artist.id) \
-                                        .first()
-        any_album = session.query(Album).filter(Album.artist_id == artist.id) \
-                                        .first()
-        if not any_track and (not any_album or not any_album.tracks):
-            log.warn("Deleting artist: %s" % str(artist))
-            session.delete(artist)
-            num_orphaned_artists += 1
-        else:
-            found_ids.add(artist.id)
-    session.flush()
+    num_orphaned_artists = 0
+    for in_scope in _scoped(artists.c.id, artist_ids):
+        orphaned_artists = sql.select([artists.c.id]).where(sql.and_(
+            in_scope,
+            artists.c.id != VARIOUS_ARTISTS_ID,
+            ~sql.exists().where(tracks.c.artist_id == artists.c.id),
+            ~sql.exists().where(albums.c.artist_id == artists.c.id)))
+        if scope:
+            img_ids.update(id for id, in session.execute(
+                sql.select([artist_images.c.img_id])
+                   .where(artist_images.c.artist_id.in_(orphaned_artists))))
+        session.execute(artist_tags.delete()
+                                   .where(artist_tags.c.artist_id.in_(orphaned_artists)))
+        session.execute(artist_images.delete()
+                                     .where(artist_images.c.artist_id.in_(orphaned_artists)))
+        num_orphaned_artists += session.execute(artists.delete()
+                                                       .where(artists.c.id.in_(orphaned_artists))
+                                               ).rowcount
+
+    # Images no longer referenced by any album or artist
+    num_orphaned_images = 0
+    deleted_img_ids = set()
+    for in_scope in _scoped(images.c.id, img_ids):
+        orphaned_images = sql.and_(
+            in_scope,
+            ~sql.exists().where(album_images.c.img_id == images.c.id),
+            ~sql.exists().where(artist_images.c.img_id == images.c.id))
+        if image_cache:
+            deleted_img_ids.update(id for id, in session.execute(
+                sql.select([images.c.id]).where(orphaned_images)))
+        num_orphaned_images += session.execute(images.delete()
+                                                     .where(orphaned_images)).rowcount
+    if deleted_img_ids:
+        for key in [k for k, id in image_cache.items() if id in deleted_img_ids]:
+            del image_cache[key]
+
+    if (num_orphaned_albums or num_orphaned_artists or num_orphaned_images
+            or num_orphaned_image_files):
+        log.warn("Deleted %d albums, %d artists, %d images, and %d image files" %
+                 (num_orphaned_albums, num_orphaned_artists, num_orphaned_images,
+                  num_orphaned_image_files))
 
     return (num_orphaned_tracks, num_orphaned_artists, num_orphaned_albums)
 
 
-def syncImage(img, current, session):
-    """Add or updated the Image."""
+def _atOrBelow(column, dirname, dialect):
+    """The condition for ``column`` paths at or below the directory ``dirname``."""
+    prefix = dirname.rstrip(os.sep) + os.sep
+    if dialect == "sqlite":
+        # Text is compared byte by byte, so the paths below dirname are a range of the path
+        # index.
+        below = sql.and_(column >= prefix, column < prefix[:-1] + chr(ord(os.sep) + 1))
+    else:
+        below = column.startswith(prefix, autoescape=True)
+    return sql.or_(column == dirname, below)
+
+
+def moveDirectory(session, lib_id, src_path, path):
+    """Update the paths of the tracks, image files, and directories of library ``lib_id`` at
+    or below the directory ``src_path``, which was renamed to ``path``. Returns the number of
+    tracks moved."""
+    dialect = session.bind.dialect.name
+    num_tracks = 0
+    for table in (Track.__table__, ImageFile.__table__, Directory.__table__):
+        result = session.execute(
+            table.update()
+                 .where(sql.and_(table.c.lib_id == lib_id,
+                                 _atOrBelow(table.c.path, src_path, dialect)))
+                 .values(path=sql.literal(path) + sql.func.substr(table.c.path,
+                                                                  len(src_path) + 1)))
+        if table is Track.__table__:
+            num_tracks = result.rowcount
+    return num_tracks
+
+
+def syncTrackTags(session, tags, new_ids=None):
+    """Set the tags of each track in ``tags``, a dict of track id to a set of tag ids. Only
+    the differences from the current ``track_tags`` rows are written, and duplicate rows are
+    removed. Tracks in ``new_ids`` are known to have no tags yet."""
+    new_ids = new_ids or set()
+    current = collections.defaultdict(list)
+
+    existing_ids = [tid for tid in tags if tid not in new_ids]
+    for i in range(0, len(existing_ids), ID_BATCH_SIZE):
+        batch = existing_ids[i:i + ID_BATCH_SIZE]
+        for track_id, tag_id in session.execute(
+                sql.select([track_tags.c.track_id, track_tags.c.tag_id])
+                   .where(track_tags.c.track_id.in_(batch))):
+            current[track_id].append(tag_id)
+
+    deletes, inserts = [], []
+    for track_id, tag_ids in tags.items():
+        curr_ids = current[track_id]
+        for tag_id in set(curr_ids):
+            if tag_id not in tag_ids or curr_ids.count(tag_id) > 1:
+                deletes.append({"t_id": track_id, "g_id": tag_id})
+        for tag_id in tag_ids:
+            if tag_id not in curr_ids or curr_ids.count(tag_id) > 1:
+                inserts.append({"track_id": track_id, "tag_id": tag_id})
+
+    if deletes:
+        session.execute(track_tags.delete()
+                                  .where(sql.and_(track_tags.c.track_id == sql.bindparam("t_id"),
+                                                  track_tags.c.tag_id == sql.bindparam("g_id"))),
+                        deletes)
+    if inserts:
+        session.execute(track_tags.insert(), inserts)
+
+
+def syncImage(img, current, session, unlinked=None):
+    """Add or updated the Image. ``img`` may be shared with other albums or artists. The ids
+    of images no longer linked to ``current`` are added to the set ``unlinked``, if given."""
     def _img_str(i):
         return "%s - %s" % (i.type, i.description)
 
-    for db_img in current.images:
-        img_info = (img.type, img.md5, img.size)
-        db_img_info = (db_img.type, db_img.md5, db_img.size)
+    img_info = (img.type, img.md5, img.size)
+    if any((db_img.type, db_img.md5, db_img.size) == img_info for db_img in current.images):
+        return
 
-        if db_img_info == img_info:
-            img = None
-            break
-        elif (db_img.type == img.type and
+    for db_img in current.images:
+        if (db_img.type == img.type and
                 db_img.description == img.description):
+            # Update image
+            current.images.remove(db_img)
+            if unlinked is not None and db_img.id is not None:
+                unlinked.add(db_img.id)
+            current.images.append(img)
+            session.add(current)
+            pout(Fg.green("Updating image") + ": " + _img_str(img))
+            return
 
-            if img.md5 != db_img.md5:
-                # Update image
-                current.images.remove(db_img)
-                current.images.append(img)
-                session.add(current)
-                pout(Fg.green("Updating image") + ": " + _img_str(img))
-            img = None
-            break
-
-    if img:
-        # Add image
-        current.images.append(img)
-        session.add(current)
-        pout(Fg.green("Adding image") + ": " + _img_str(img))
+    # Add image
+    current.images.append(img)
+    session.add(current)
+    pout(Fg.green("Adding image") + ": " + _img_str(img))
@@ -0,0 +1,137 @@
+"""
+The directories watched by a monitor, and the libraries each directory is watched for.
+"""
+import os
+import multiprocessing
+from collections import namedtuple
+
+WatchStats = namedtuple("WatchStats", ["watched", "unwatched", "failed", "limit"])
+"""The number of ``watched`` directories, the number of directories waiting for a watch
+(``unwatched``, their subdirectories are not counted) because the watch ``limit`` was reached,
+and the number of directories that ``failed`` to be watched for other reasons (e.g. removed,
+or not readable)."""
+
+
+class WatchRegistry:
+    """The watched directories, indexed by path and by watch descriptor, and the libraries
+    each watch is for. The subdirectories of each directory are indexed too, so that a tree
+    is removed or moved without scanning all the watches.
+
+    Paths are absolute ``str`` paths.
+    """
+    def __init__(self):
+        self._wds = {}       # {path: wd}
+        self._paths = {}     # {wd: path}
+        self._libs = {}      # {wd: set(lib_name)}
+        self._children = {}  # {path: set(path)}, the watched subdirectories of path
+
+    def __len__(self):
+        return len(self._wds)
+
+    def __contains__(self, path):
+        return path in self._wds
+
+    def __iter__(self):
+        return iter(list(self._wds))
+
+    def wd(self, path):
+        return self._wds.get(path)
+
+    def path(self, wd):
+        return self._paths.get(wd)
+
+    def libs(self, path):
+        """Returns the libraries directory ``path`` is watched for, an empty set when it is
+        not watched."""
+        wd = self._wds.get(path)
+        return self._libs[wd] if wd is not None else frozenset()
+
+    def add(self, path, wd, libs):
+        """Add the watch ``wd`` of directory ``path`` for ``libs``, or add ``libs`` to the
+        watch when ``path`` is already watched."""
+        if path in self._wds:
+            self._libs[self._wds[path]].update(libs)
+            return
+        self._wds[path] = wd
+        self._paths[wd] = path
+        self._libs[wd] = set(libs)
+        self._children.setdefault(os.path.dirname(path), set()).add(path)
+
+    def tree(self, path):
+        """Returns the watched directories at or below ``path``, parents first."""
+        paths = [path] if path in self._wds else []
+        i = 0
+        while i < len(paths):
+            paths.extend(self._children.get(paths[i], ()))
+            i += 1
+        return paths
+
+    def remove(self, path):
+        """Remove the watches of directory ``path`` and its subdirectories. Returns the
+        removed ``(path, wd)``."""
+        removed = []
+        for p in self.tree(path):
+            wd = self._wds.pop(p)
+            del self._paths[wd]
+            del self._libs[wd]
+            self._children.pop(p, None)
+            removed.append((p, wd))
+
+        siblings = self._children.get(os.path.dirname(path))
+        if siblings is not None:
+            siblings.discard(path)
+            if not siblings:
+                del self._children[os.path.dirname(path)]
+        return removed
+
+    def move(self, src_path, path, libs):
+        """Move the watches of directory ``src_path`` and its subdirectories, which was
+        renamed to ``path``, and set their libraries to ``libs``. The watch descriptors do not
+        change. Returns the moved ``(src path, path, wd)``."""
+        moved = [(p, path + p[len(src_path):], self._wds[p]) for p in self.tree(src_path)]
+        self.remove(src_path)
+        for _, new_p, wd in moved:
+            self.add(new_p, wd, libs)
+        return moved
+
+
+class MonitorProcess(multiprocessing.Process):
+    """The process of a monitor, which is sent the library directories to watch by
+    :meth:`watch`, and puts the changes it finds on :attr:`sync_queue` (given when it is
+    shared by several monitors). Subclasses implement ``_main(sync_queue)``.
+
+    The directories are sent on a pipe the monitor owns, its end is :attr:`_dir_reader` and
+    the directories received are returned by :meth:`_receiveDirs`.
+    """
+    def __init__(self, sync_queue=None):
+        self._dir_reader, self._dir_writer = multiprocessing.Pipe(duplex=False)
+        self._sync_queue = sync_queue or multiprocessing.Queue()
+        self._pending_dirs = []   # Sent once the process is started
+
+        super().__init__(target=self._main, args=(self._sync_queue,))
+
+    def watch(self, lib_name, path):
+        """Watch directory ``path``, and its subdirectories, for library ``lib_name``."""
+        if self._pending_dirs is not None:
+            # Until the process is reading, sending could block once the pipe is full.
+            self._pending_dirs.append((lib_name, str(path)))
+        else:
+            self._dir_writer.send((lib_name, str(path)))
+
+    def start(self):
+        super().start()
+        pending, self._pending_dirs = self._pending_dirs, None
+        for lib_name, path in pending:
+            self._dir_writer.send((lib_name, path))
+
+    def _receiveDirs(self):
+        """Returns the ``(lib_name, path)`` directories sent by :meth:`watch`, without
+        waiting."""
+        dirs = []
+        while self._dir_reader.poll():
+            dirs.append(self._dir_reader.recv())
+        return dirs
+
+    @property
+    def sync_queue(self):
+        return self._sync_queue
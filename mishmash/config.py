@@ -10,6 +10,8 @@ CONFIG_ENV_VAR = "MISHMASH_CONFIG"
 SQLITE_DB_URL = "sqlite:///{0}/mishmash.db".format(Path().cwd())
 POSTGRES_DB_URL = "postgresql://mishmash@localhost/mishmash"
 LOG_FORMAT = "<%(name)s:%(threadName)s> [%(levelname)s]: %(message)s"
+MONITOR_INOTIFY = "inotify"
+MONITOR_POLL = "poll"
 
 LOGGING_CONFIG = (
     nicfit.logger.FileConfig(level="WARNING")
@@ -34,6 +36,18 @@ sqlalchemy.url = {SQLITE_DB_URL}
 # Directories to exclude, each as a regex
 ;excludes = dir_regex1
 ;           dir_regex2
+# Sync commits after every directory by default; batching commits speeds up large
+# syncs. A commit occurs when any of the limits is reached.
+;commit_dirs = 50
+;commit_tracks = 1000
+;commit_secs = 30
+# How 'sync --monitor' finds changes, 'inotify' or 'poll'. Use 'poll' for network file
+# systems (e.g. NFS, SMB), where the changes made by other hosts are not reported by inotify.
+# The library is scanned every poll_interval seconds, with at most poll_budget file system
+# operations (stats and listings) per second.
+;monitor = inotify
+;poll_interval = 60
+;poll_budget = 1000
 
 
 [app:main]
@@ -60,11 +74,22 @@ port = {WEB_PORT}
 
 
 class MusicLibrary:
-    def __init__(self, name, paths=None, excludes=None, sync=True):
+    def __init__(self, name, paths=None, excludes=None, sync=True,
+                 commit_dirs=None, commit_tracks=None, commit_secs=None,
+                 monitor=MONITOR_INOTIFY, poll_interval=60.0, poll_budget=None):
+        if monitor not in (MONITOR_INOTIFY, MONITOR_POLL):
+            raise ValueError(f"Invalid monitor for library '{name}': {monitor}")
+
         self.name = name
         self.paths = paths or []
         self.sync = sync
         self.excludes = excludes
+        self.commit_dirs = commit_dirs
+        self.commit_tracks = commit_tracks
+        self.commit_secs = commit_secs
+        self.monitor = monitor
+        self.poll_interval = poll_interval
+        self.poll_budget = poll_budget
 
     @staticmethod
     def fromConfig(config):
@@ -83,7 +108,13 @@ class MusicLibrary:
 
         return MusicLibrary(config.name.split(":", 1)[1], paths=all_paths,
                             excludes=excludes,
-                            sync=config.getboolean("sync", True))
+                            sync=config.getboolean("sync", True),
+                            commit_dirs=config.getint("commit_dirs", None),
+                            commit_tracks=config.getint("commit_tracks", None),
+                            commit_secs=config.getfloat("commit_secs", None),
+                            monitor=config.get("monitor", MONITOR_INOTIFY).strip(),
+                            poll_interval=config.getfloat("poll_interval", 60.0),
+                            poll_budget=config.getint("poll_budget", None))
 
 
 class Config(nicfit.Config):
@@ -1,7 +1,8 @@
 from .core import *   # noqa: F403
 
 # Core orm
-TYPES = [Meta, Library, Tag, Artist, Album, Track, Image]  # noqa: F405
+TYPES = [Meta, Library, Tag, Artist, Album, Track, Image, ImageFile,  # noqa: F405
+         Directory, SyncCheckpoint, SyncRun]  # noqa: F405
 TAGS = [artist_tags, album_tags, track_tags, artist_images, album_images]  # noqa: F405
 IMAGE_TABLES = [artist_images, album_images]  # noqa: F405
 ENUMS = [Image._types_enum, Album._types_enum]  # noqa: F405
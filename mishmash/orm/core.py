@@ -20,6 +20,8 @@ from eyed3.core import Date as Eyed3Date
 from eyed3.core import ALBUM_TYPE_IDS, VARIOUS_TYPE, LIVE_TYPE
 from eyed3.id3 import ID3_V1_0, ID3_V1_1, ID3_V2_2, ID3_V2_3, ID3_V2_4, versionToString
 
+from ..util import statFingerprint
+
 VARIOUS_ARTISTS_ID = 1
 VARIOUS_ARTISTS_NAME = _("Various Artists")
 NULL_LIB_ID = 1
@@ -162,8 +164,8 @@ class Artist(Base, OrmObject):
     """all tracks by the artist"""
     tags = orm.relation("Tag", secondary=artist_tags)
     """one-to-many (artist->tag) and many-to-one (tag->artist)"""
-    images = orm.relation("Image", secondary=artist_images, cascade="all")
-    """one-to-many artist images."""
+    images = orm.relation("Image", secondary=artist_images)
+    """many-to-many artist images, images are shared (see :class:`Image`)."""
     library = orm.relation("Library")
 
     def getAlbumsByType(self, album_type):
@@ -291,8 +293,8 @@ class Album(Base, OrmObject):
     tracks = orm.relation("Track", order_by="Track.track_num",
                           cascade="all")
     tags = orm.relation("Tag", secondary=album_tags)
-    images = orm.relation("Image", secondary=album_images, cascade="all")
-    """one-to-many album images."""
+    images = orm.relation("Image", secondary=album_images)
+    """many-to-many album images, images are shared (see :class:`Image`)."""
     library = orm.relation("Library")
 
     def getBestDate(self):
@@ -328,6 +330,9 @@ class Track(Base, OrmObject):
     size_bytes = sql.Column(sql.Integer, nullable=False)
     ctime = sql.Column(sql.DateTime(), nullable=False)
     mtime = sql.Column(sql.DateTime(), nullable=False)
+    # The file's inode and device, used to detect moved files.
+    inode = sql.Column(sql.BigInteger)
+    device = sql.Column(sql.BigInteger)
     date_added = sql.Column(sql.DateTime(), nullable=False,
                             default=datetime.now)
     time_secs = sql.Column(sql.Float, nullable=False)
@@ -374,8 +379,10 @@ class Track(Base, OrmObject):
 
         self.path = path
         self.size_bytes = info.size_bytes
-        self.ctime = datetime.fromtimestamp(os.path.getctime(path))
-        self.mtime = datetime.fromtimestamp(os.path.getmtime(path))
+        st = os.stat(path)
+        self.ctime = datetime.fromtimestamp(st.st_ctime)
+        self.mtime = datetime.fromtimestamp(st.st_mtime)
+        self.inode, self.device = statFingerprint(st)
         self.time_secs = info.time_secs
         self.title = (tag.title if "\x00" not in tag.title
                                 else tag.title.split("\x00")[0])
@@ -427,7 +434,10 @@ class Tag(Base, OrmObject):
 
 
 class Image(Base, OrmObject):
+    """Image data is stored once per md5 and image type, albums and artists with the same
+    picture share the row via the ``album_images`` and ``artist_images`` pivot tables."""
     __tablename__ = "images"
+    __table_args__ = (sql.Index("ix_images_md5", "md5", "type", unique=True), {})
 
     FRONT_COVER_TYPE = art.FRONT_COVER
     BACK_COVER_TYPE = art.BACK_COVER
@@ -461,17 +471,21 @@ class Image(Base, OrmObject):
             return False
 
     @staticmethod
-    def fromTagFrame(img, type_):
+    def fromTagFrame(img, type_, md5sum=None):
+        """Create an Image from a tag image frame. The md5 of the image data is computed
+        unless provided by ``md5sum``."""
         if not Image._validMimeType(img.mime_type):
             return None
 
-        md5hash = md5()
-        md5hash.update(img.image_data)
+        if md5sum is None:
+            md5hash = md5()
+            md5hash.update(img.image_data)
+            md5sum = md5hash.hexdigest()
 
         return Image(type=type_,
                      description=img.description,
                      mime_type=img.mime_type,
-                     md5=md5hash.hexdigest(),
+                     md5=md5sum,
                      size=len(img.image_data),
                      data=img.image_data)
 
@@ -505,6 +519,54 @@ class Image(Base, OrmObject):
         return self._truncate(value, self.DESC_LIMIT)
 
 
+class ImageFile(Base, OrmObject):
+    """The size and modification time of a sync'd image file, and the album it was sync'd
+    to, so that unchanged files are not read again."""
+    __tablename__ = "image_files"
+    __table_args__ = (sql.UniqueConstraint("path",
+                                           "lib_id",
+                                          ), {})
+
+    # Columns
+    id = sql.Column(sql.Integer, Sequence("image_files_id_seq"), primary_key=True)
+    path = sql.Column(sql.String(Track.PATH_LIMIT), nullable=False)
+    size_bytes = sql.Column(sql.Integer, nullable=False)
+    mtime = sql.Column(sql.DateTime(), nullable=False)
+
+    # Foreign keys
+    album_id = sql.Column(sql.Integer, sql.ForeignKey("albums.id"),
+                          nullable=False, index=True)
+    lib_id = sql.Column(sql.Integer, sql.ForeignKey("libraries.id"),
+                        nullable=False, index=True)
+
+    # Relations
+    album = orm.relation("Album")
+    library = orm.relation("Library")
+
+
+class Directory(Base, OrmObject):
+    """A sync'd directory, its modification time and the hash of its files. The
+    ``files_hash`` covers the name, size, and mtime of the directory's files."""
+    __tablename__ = "directories"
+    __table_args__ = (sql.UniqueConstraint("path",
+                                           "lib_id",
+                                          ), {})
+    HASH_LIMIT = 32
+
+    # Columns
+    id = sql.Column(sql.Integer, Sequence("directories_id_seq"), primary_key=True)
+    path = sql.Column(sql.String(Track.PATH_LIMIT), nullable=False)
+    mtime = sql.Column(sql.DateTime(), nullable=False)
+    files_hash = sql.Column(sql.String(HASH_LIMIT), nullable=False)
+
+    # Foreign keys
+    lib_id = sql.Column(sql.Integer, sql.ForeignKey("libraries.id"),
+                        nullable=False, index=True)
+
+    # Relations
+    library = orm.relation("Library")
+
+
 class Library(Base, OrmObject):
     __tablename__ = "libraries"
     NAME_LIMIT = 64
@@ -535,6 +597,74 @@ class Library(Base, OrmObject):
                 yield lib
 
 
+class SyncCheckpoint(Base, OrmObject):
+    """The progress of an unfinished library sync: the last committed directory, in walk
+    order, and the sync counters at that point. It is removed when the sync completes."""
+    __tablename__ = "sync_checkpoints"
+
+    # Columns
+    lib_id = sql.Column(sql.Integer, sql.ForeignKey("libraries.id"), primary_key=True)
+    path = sql.Column(sql.String(Track.PATH_LIMIT), nullable=False)
+    started = sql.Column(sql.DateTime(), nullable=False)
+    num_files = sql.Column(sql.Integer, nullable=False, default=0)
+    num_added = sql.Column(sql.Integer, nullable=False, default=0)
+    num_modified = sql.Column(sql.Integer, nullable=False, default=0)
+    num_moved = sql.Column(sql.Integer, nullable=False, default=0)
+
+    # Relations
+    library = orm.relation("Library")
+
+
+class SyncRun(Base, OrmObject):
+    """A library sync: its counts, the number of database statements executed and the size of
+    the files parsed, and the seconds spent in each of the sync ``PHASES``."""
+    __tablename__ = "sync_runs"
+
+    PHASES = ("load", "walk", "stat", "parse", "sync", "resolve", "images", "commit", "purge")
+
+    # Columns
+    id = sql.Column(sql.Integer, Sequence("sync_runs_id_seq"), primary_key=True)
+    started = sql.Column(sql.DateTime(), nullable=False)
+    """A UTC timestamp of the start of the sync."""
+    secs = sql.Column(sql.Float, nullable=False)
+    incremental = sql.Column(sql.Boolean, nullable=False, default=False)
+    """A monitor sync of changed directories."""
+    num_files = sql.Column(sql.Integer, nullable=False)
+    num_added = sql.Column(sql.Integer, nullable=False)
+    num_modified = sql.Column(sql.Integer, nullable=False)
+    num_moved = sql.Column(sql.Integer, nullable=False)
+    num_deleted = sql.Column(sql.Integer, nullable=False)
+    statements = sql.Column(sql.Integer, nullable=False)
+    bytes_parsed = sql.Column(sql.BigInteger, nullable=False)
+    """The size of the audio and image files parsed. Only the tags, and headers, of audio
+    files are read, this is not the I/O of the sync."""
+    load_secs = sql.Column(sql.Float, nullable=False)
+    """Loading the library's track index, directory manifest, and caches."""
+    walk_secs = sql.Column(sql.Float, nullable=False)
+    """Listing directories."""
+    stat_secs = sql.Column(sql.Float, nullable=False)
+    """Checking files for changes, and moves."""
+    parse_secs = sql.Column(sql.Float, nullable=False)
+    """Reading tags, or waiting on the worker processes to."""
+    sync_secs = sql.Column(sql.Float, nullable=False)
+    """Updating tracks, not counting the phases below."""
+    resolve_secs = sql.Column(sql.Float, nullable=False)
+    """Finding, or adding, artists and albums."""
+    images_secs = sql.Column(sql.Float, nullable=False)
+    """Reading and updating images."""
+    commit_secs = sql.Column(sql.Float, nullable=False)
+    """Writing to and committing the database."""
+    purge_secs = sql.Column(sql.Float, nullable=False)
+    """Deleting orphans."""
+
+    # Foreign keys
+    lib_id = sql.Column(sql.Integer, sql.ForeignKey("libraries.id"),
+                        nullable=False, index=True)
+
+    # Relations
+    library = orm.relation("Library")
+
+
 @event.listens_for(Engine, "connect")
 def set_sqlite_pragma(dbapi_connection, connection_record):
     """Allows foreign keys to work in sqlite."""
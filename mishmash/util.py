@@ -1,9 +1,13 @@
 import os
+import bisect
 import argparse
 from urllib.parse import urlparse
+from datetime import datetime, timedelta
 from eyed3.utils import datePicker
 
 NAME_PREFIXES = ["the ", "los ", "la ", "el "]
+_EPOCH = datetime(1970, 1, 1)
+_USEC = timedelta(microseconds=1)
 
 
 def splitNameByPrefix(s):
@@ -55,6 +59,48 @@ def commonDirectoryPrefix(*args):
     return os.path.commonprefix(args).rpartition(os.path.sep)[0]
 
 
+def isAtOrBelow(path, dirname):
+    """Returns ``True`` if ``path`` is the directory ``dirname``, or is below it."""
+    return path == dirname or path.startswith(dirname.rstrip(os.sep) + os.sep)
+
+
+def dirsAtOrBelow(dirnames, dirname):
+    """Returns the directories of the sorted list ``dirnames`` that are the directory
+    ``dirname``, or are below it. Sorted, the paths below a directory are adjacent, and are
+    found without comparing every path."""
+    prefix = dirname.rstrip(os.sep) + os.sep
+    start = bisect.bisect_left(dirnames, prefix)
+    end = bisect.bisect_left(dirnames, prefix[:-1] + chr(ord(os.sep) + 1), start)
+    i = bisect.bisect_left(dirnames, dirname)
+    exact = [dirname] if dirname != prefix and dirnames[i:i + 1] == [dirname] else []
+    return exact + dirnames[start:end]
+
+
+def usecs(dt):
+    """Convert the (naive) datetime ``dt`` to an integer count of microseconds. Timestamps are
+    stored in the database using ``datetime.fromtimestamp``, and file stat times must be
+    converted the same way for comparisons."""
+    return (dt - _EPOCH) // _USEC
+
+
+def usecsToDatetime(n):
+    """The inverse of :func:`usecs`."""
+    return _EPOCH + n * _USEC
+
+
+def statUsecs(st):
+    """Returns a tuple of the ``ctime`` and ``mtime``, as :func:`usecs`, for the
+    ``os.stat_result`` ``st``."""
+    return (usecs(datetime.fromtimestamp(st.st_ctime)),
+            usecs(datetime.fromtimestamp(st.st_mtime)))
+
+
+def statFingerprint(st):
+    """Returns the ``(inode, device)`` of the ``os.stat_result`` ``st``, as signed 64-bit
+    integers for storage."""
+    return tuple(n - 2 ** 64 if n >= 2 ** 63 else n for n in (st.st_ino, st.st_dev))
+
+
 def mostCommonItem(lst):
     """Choose the most common item from the list, or the first item if all
     items are unique."""
@@ -139,7 +139,8 @@ else:
         setup(classifiers=classifiers,
               package_dir={"": "."},
               packages=find_packages(".",
-                                     exclude=["tests", "tests.*"]),
+                                     exclude=["tests", "tests.*",
+                                              "benchmarks", "benchmarks.*"]),
               zip_safe=False,
               platforms=["Any"],
               keywords=["music", "database"],
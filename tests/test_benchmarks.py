@@ -0,0 +1,72 @@
+import json
+from pathlib import Path
+from eyed3 import load
+from benchmarks.library import LibraryOptions, generateLibrary, artistName
+from benchmarks.suite import main as benchmarks_main, compare
+
+
+def _files(root):
+    return {str(p.relative_to(root)): p.read_bytes() for p in Path(root).rglob("*")
+                if p.is_file()}
+
+
+def test_generateLibrary(tmpdir):
+    opts = LibraryOptions(seed="test", artists=4, albums=(1, 2), tracks=(2, 5), frames=2,
+                          compilations=0.5, genres=2, embedded_art=0.5, cover_files=0.5,
+                          artist_files=0.5, broken=0)
+    counts = generateLibrary(str(tmpdir / "a"), opts)
+    assert counts["artists"] == 4
+
+    # The library is the same regardless of the number of processes.
+    generateLibrary(str(tmpdir / "b"), opts, jobs=2)
+    files = _files(tmpdir / "a")
+    assert files == _files(tmpdir / "b")
+
+    mp3s = [p for p in Path(str(tmpdir / "a")).rglob("*.mp3")]
+    assert len(mp3s) == counts["tracks"]
+    audio_file = load(str(mp3s[0]))
+    assert audio_file.info and audio_file.tag.title and audio_file.tag.artist
+
+
+def test_artistName():
+    names = {artistName(i) for i in range(10000)}
+    assert len(names) == 10000
+
+
+def test_benchmarks(tmpdir):
+    library = str(tmpdir / "library")
+    generateLibrary(library, LibraryOptions(seed="test", artists=3, albums=(1, 2), tracks=(2, 5),
+                                            frames=2, compilations=0, genres=1,
+                                            embedded_art=0.5, cover_files=0.5, artist_files=0,
+                                            broken=0.1))
+    output = str(tmpdir / "results.json")
+    assert benchmarks_main(["--library", library, "--repeat", "1", "--sync-repeat", "2",
+                            "-o", output]) == 0
+
+    with open(output) as fp:
+        results = json.load(fp)
+    sqlite = results["databases"]["sqlite"]
+    assert sqlite["sync.initial"]["files"] > 0
+    assert sqlite["sync.noop"]["statements"] < sqlite["sync.initial"]["statements"]
+    assert {"sync.changed", "purge", "search"} <= set(sqlite)
+    assert sqlite["sync.initial"]["runs"] == sqlite["purge"]["runs"] == 2
+    assert sqlite["sync.initial"]["min_secs"] <= sqlite["sync.initial"]["secs"]
+
+    assert benchmarks_main(["--library", library, "--repeat", "1", "--baseline", output]) in (0, 1)
+
+
+def test_compare():
+    baseline = {"databases": {"sqlite": {"sync": {"secs": 1.0, "runs": 3},
+                                         "search": {"secs": 0.001, "runs": 3},
+                                         "purge": {"secs": 1.0, "runs": 1}}}}
+    results = {"databases": {"sqlite": {"sync": {"secs": 1.5, "runs": 3},
+                                        "search": {"secs": 0.002, "runs": 3},
+                                        "purge": {"secs": 2.0, "runs": 3},
+                                        "new": {"secs": 1.0}},
+                             "postgresql": {"sync": {"secs": 1.0}}}}
+    # Small differences, and single timings, are not regressions, and only benchmarks in both
+    # are compared.
+    assert compare(results, baseline) == [("sqlite", "sync", 1.5, 1.0, True),
+                                          ("sqlite", "search", 0.002, 0.001, False),
+                                          ("sqlite", "purge", 2.0, 1.0, False)]
+    assert not any(regressed for *_, regressed in compare(results, baseline, threshold=0.6))
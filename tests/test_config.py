@@ -10,3 +10,31 @@ def test_Config_nofile():
         assert c.db_url is None
     with pytest.raises(Exception):
         assert c.music_libs is None
+
+
+def test_MusicLibrary_commitLimits():
+    c = Config(None)
+    c.read_string("[library:Music]\n"
+                  "commit_dirs = 50\n"
+                  "commit_secs = 2.5\n")
+    lib, = list(c.music_libs)
+    assert lib.commit_dirs == 50
+    assert lib.commit_tracks is None
+    assert lib.commit_secs == 2.5
+
+
+def test_MusicLibrary_monitor():
+    c = Config(None)
+    c.read_string("[library:Music]\n"
+                  "[library:NFS]\n"
+                  "monitor = poll\n"
+                  "poll_interval = 300\n"
+                  "poll_budget = 200\n"
+                  "[library:Bad]\n"
+                  "monitor = fanotify\n")
+    libs = c.music_libs
+    music, nfs = next(libs), next(libs)
+    assert (music.monitor, music.poll_budget) == ("inotify", None)
+    assert (nfs.monitor, nfs.poll_interval, nfs.poll_budget) == ("poll", 300.0, 200)
+    with pytest.raises(ValueError):
+        next(libs)
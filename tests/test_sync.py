@@ -1,5 +1,28 @@
-from mishmash.orm import (Artist, Album, Library, VARIOUS_ARTISTS_NAME,
-                          MAIN_LIB_ID, NULL_LIB_ID)
+import os
+import time
+import queue
+import shutil
+import eyed3
+import pytest
+from sqlalchemy import event
+from pathlib import Path
+from datetime import datetime
+from eyed3.core import Date, VARIOUS_TYPE
+from eyed3.id3 import ID3_V2_4
+from eyed3.id3.frames import ImageFrame
+from mishmash.orm import (Artist, Album, Track, Tag, Image, ImageFile, Directory, Library,
+                          SyncCheckpoint, SyncRun, VARIOUS_ARTISTS_NAME, VARIOUS_ARTISTS_ID,
+                          MAIN_LIB_ID, NULL_LIB_ID, track_tags, album_images)
+from mishmash.commands.sync.sync import SyncPlugin
+from mishmash.commands.sync.loader import loadFiles
+from mishmash.commands.sync.index import TrackIndex
+from mishmash.commands.sync.manifest import DirectoryManifest
+from mishmash.commands.sync.changes import (ChangeSet, Change, changeDirs, CREATED, MODIFIED,
+                                            DELETED, MOVED, DIRECTORY, MOVED_DIRECTORY)
+from mishmash.commands.sync.watches import WatchRegistry
+from mishmash.commands.sync.poller import Poller
+from mishmash.commands.sync.utils import (syncTrackTags, deleteOrphans, findOrphanedTracks,
+                                          moveDirectory, PurgeScope, IdAllocator)
 from .factories import (EpFactory, LibraryFactory, LpFactory,
                         DirectoryStructure)
 
@@ -99,3 +122,897 @@ def test_epSync(tmpdir, database, mishmash_cmd):
 
     # TODO: validate tracks
 
+
+def test_mixedDateTagsSync(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+
+    # One track of the album also has an original release date.
+    lp = LpFactory(temp_dir=str(tmpdir))
+    for i, t in enumerate(lp.tracks):
+        tag = t._mp3_file.tag
+        # v2.3 does not have separate release and original release dates
+        tag.version = ID3_V2_4
+        tag.original_release_date = Date(1999) if i == len(lp.tracks) // 2 else None
+        tag.release_date = Date(2000)
+        tag.recording_date = None
+        tag.save(version=ID3_V2_4)
+    album_dir = Path(str(tmpdir)) / "Album"
+    album_dir.mkdir()
+    for t in lp.tracks:
+        Path(t._mp3_file.path).rename(album_dir / Path(t._mp3_file.path).name)
+
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    assert session.query(Album).filter_by(lib_id=MAIN_LIB_ID).count() == 1
+    assert session.query(Track).filter_by(lib_id=MAIN_LIB_ID).count() == len(lp.tracks)
+
+
+def test_compilationSync(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+
+    # Two albums by one artist, in separate directories, and a compilation
+    lps = [LpFactory(artist="Artist", title=f"Album {i}", id3_version=ID3_V2_4,
+                     temp_dir=str(tmpdir)) for i in range(3)]
+    for lp in lps:
+        DirectoryStructure.PREFERRED.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    for i, t in enumerate(lps[2].tracks):
+        tag = t._mp3_file.tag
+        tag.artist = "Artist" if i == 0 else f"Guest {i % 2}"
+        tag.album_artist = "Compiler"
+        tag.album_type = VARIOUS_TYPE
+        tag.save(version=ID3_V2_4)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+
+    # A compilation is by Various Artists, whatever its album artist.
+    assert sorted(a.name for a in session.query(Artist).filter_by(lib_id=MAIN_LIB_ID)) == \
+        ["Artist", "Guest 0", "Guest 1"]
+    album = session.query(Album).filter_by(type=VARIOUS_TYPE).one()
+    assert album.artist_id == VARIOUS_ARTISTS_ID
+
+    # The cached artists and albums are those found by querying each track's tags.
+    tracks = session.query(Track).filter_by(lib_id=MAIN_LIB_ID).all()
+    assert len(tracks) == sum(len(lp.tracks) for lp in lps)
+    for track in tracks:
+        tag = eyed3.load(track.path).tag
+        artist = session.query(Artist).filter_by(lib_id=MAIN_LIB_ID, name=tag.artist).one()
+        album_artist_id = VARIOUS_ARTISTS_ID if tag.album_type == VARIOUS_TYPE else artist.id
+        album = session.query(Album).filter_by(lib_id=MAIN_LIB_ID, artist_id=album_artist_id,
+                                               title=tag.album,
+                                               original_release_date=Date.parse(
+                                                   str(tag.original_release_date))).one()
+        assert (track.artist_id, track.album_id) == (artist.id, album.id)
+
+
+def test_lpSyncJobs(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+
+    dir_struct = DirectoryStructure.PREFERRED
+    dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+
+    mishmash_cmd(["sync", "--jobs", "2", str(tmpdir)], db_url=database.url)
+
+    assert session.query(Artist).filter_by(lib_id=MAIN_LIB_ID).count() == 1
+    assert session.query(Album).filter_by(lib_id=MAIN_LIB_ID).count() == 1
+    assert session.query(Track).filter_by(lib_id=MAIN_LIB_ID).count() == len(lp.tracks)
+
+
+def test_sharedImages(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+    cover = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+
+    dir_struct = DirectoryStructure.PREFERRED
+    lps = [LpFactory(temp_dir=str(tmpdir)), LpFactory(temp_dir=str(tmpdir))]
+    for lp in lps:
+        for t in lp.tracks:
+            t._mp3_file.tag.images.set(ImageFrame.FRONT_COVER, cover, "image/png")
+            t._mp3_file.tag.save(version=ID3_V2_4)
+        dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+
+    # Both albums reference the one stored image.
+    albums = session.query(Album).filter_by(lib_id=MAIN_LIB_ID).all()
+    assert len(albums) == 2
+    assert session.query(Image).count() == 1
+    assert [len(a.images) for a in albums] == [1, 1]
+
+
+def test_imageFilesUnchanged(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+    dir_struct = DirectoryStructure.PREFERRED
+    dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    cover = Path(lp.tracks[0]._mp3_file.path).parent / "cover-front.png"
+    cover.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 32)
+
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    album = session.query(Album).filter_by(lib_id=MAIN_LIB_ID).one()
+    assert session.query(ImageFile).filter_by(path=str(cover)).one().album_id == album.id
+
+    # Unchanged image files are not read again, and unchanged tracks are not stat'd again
+    # after the walk's listing.
+    reads, stats = [], []
+    from_file, stat = Image.fromFile, os.stat
+    monkeypatch.setattr(Image, "fromFile",
+                        staticmethod(lambda *args: reads.append(args) or from_file(*args)))
+    with monkeypatch.context() as m:
+        m.setattr(os, "stat", lambda path, *args, **kwargs: (stats.append(str(path)) or
+                                                             stat(path, *args, **kwargs)))
+        mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    assert reads == []
+    assert not [p for p in stats if p.endswith(".mp3")]
+
+    cover.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x01" * 32)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    assert len(reads) == 1
+
+    # The rows of renamed, and deleted, image files are purged.
+    renamed = cover.rename(cover.parent / "cover.png")
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    assert [f.path for f in session.query(ImageFile)] == [str(renamed)]
+    renamed.unlink()
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    assert session.query(ImageFile).count() == 0
+    assert session.query(Album).count() == 1
+
+
+def test_movedTracks(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+    dir_struct = DirectoryStructure.PREFERRED
+    dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    tracks = {t.id: (t.path, t.date_added) for t in session.query(Track)}
+    assert all(t.inode for t in session.query(Track))
+
+    # A renamed album directory updates the track paths, keeping the track rows.
+    album_dir = Path(next(iter(tracks.values()))[0]).parent
+    moved_dir = album_dir.parent / (album_dir.name + " (moved)")
+    album_dir.rename(moved_dir)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+
+    session.expire_all()
+    moved = {t.id: (t.path, t.date_added) for t in session.query(Track)}
+    assert moved == {id_: (str(moved_dir / Path(path).name), date_added)
+                        for id_, (path, date_added) in tracks.items()}
+
+
+def test_resume(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+
+    dir_struct = DirectoryStructure.PREFERRED
+    for lp in (LpFactory(temp_dir=str(tmpdir)), LpFactory(temp_dir=str(tmpdir))):
+        dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+
+    syncd = []
+    sync_dir = SyncPlugin._syncDirectory
+    plugins = []
+
+    def _syncDirectory(self, d, load_result, **kwargs):
+        plugins.append(self)
+        if syncd and interrupt:
+            raise KeyboardInterrupt()
+        syncd.append(d)
+        return sync_dir(self, d, load_result, **kwargs)
+
+    monkeypatch.setattr(SyncPlugin, "_syncDirectory", _syncDirectory)
+
+    # Interrupted after the first directory is committed.
+    interrupt = True
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    checkpoint = session.query(SyncCheckpoint).one()
+    assert checkpoint.path == syncd[0]
+    assert checkpoint.num_added == session.query(Track).count() > 0
+    # The interrupted sync no longer counts statements.
+    plugin = plugins[-1]
+    assert not event.contains(plugin.args.db_engine, "before_cursor_execute",
+                              plugin._stats.countStatement)
+
+    interrupt = False
+    first = syncd.pop()
+    mishmash_cmd(["sync", "--resume", str(tmpdir)], db_url=database.url)
+    assert first not in syncd and len(syncd) == 1
+    assert session.query(Track).count() == len(list(Path(str(tmpdir)).rglob("*.mp3")))
+    assert session.query(SyncCheckpoint).count() == 0
+
+
+def test_resumeCommitDirs(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+
+    dir_struct = DirectoryStructure.PREFERRED
+    for _ in range(3):
+        lp = LpFactory(temp_dir=str(tmpdir))
+        dir_struct.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+
+    syncd = []
+    sync_dir = SyncPlugin._syncDirectory
+
+    def _syncDirectory(self, d, load_result, **kwargs):
+        if len(syncd) == 2 and interrupt:
+            raise KeyboardInterrupt()
+        syncd.append(d)
+        return sync_dir(self, d, load_result, **kwargs)
+
+    monkeypatch.setattr(SyncPlugin, "_syncDirectory", _syncDirectory)
+
+    # Interrupted syncing the third directory, each directory is committed.
+    interrupt = True
+    mishmash_cmd(["sync", "--commit-dirs", "1", str(tmpdir)], db_url=database.url)
+    checkpoint = session.query(SyncCheckpoint).one()
+    assert checkpoint.path == syncd[1]
+    num_tracks = session.query(Track).count()
+    assert checkpoint.num_added == num_tracks == \
+        sum(len(list(Path(d).glob("*.mp3"))) for d in syncd)
+
+    # The resumed sync starts from the checkpoint, and counts the tracks added before it.
+    interrupt = False
+    mishmash_cmd(["sync", "--commit-dirs", "1", "--resume", str(tmpdir)],
+                 db_url=database.url)
+    assert len(syncd) == 3 and len(set(syncd)) == 3
+    num_tracks = len(list(Path(str(tmpdir)).rglob("*.mp3")))
+    assert session.query(Track).count() == num_tracks
+    assert session.query(SyncCheckpoint).count() == 0
+    session.expire_all()
+    assert session.query(SyncRun).order_by(SyncRun.id.desc()).first().num_added == num_tracks
+
+
+def test_syncRuns(tmpdir, database, mishmash_cmd):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+    DirectoryStructure.PREFERRED.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+
+    first, second = session.query(SyncRun).order_by(SyncRun.id).all()
+    assert first.num_files == first.num_added == len(lp.tracks)
+    assert first.bytes_parsed > 0 and first.statements > 0
+    # Unchanged files are not parsed.
+    assert second.num_added == second.bytes_parsed == 0
+    assert second.statements < first.statements
+    assert 0 < sum(getattr(second, f"{phase}_secs") for phase in SyncRun.PHASES) <= second.secs
+
+    mishmash_cmd(["info", "--sync-runs", "2"], db_url=database.url)
+
+
+def test_loadFilesUnchanged(mp3audiofile):
+    path = mp3audiofile.path
+
+    result = loadFiles([path])
+    assert [f.path for f in result.audio_files] == [path]
+    assert result.audio_files[0].tag.title == mp3audiofile.tag.title
+    assert not result.skipped
+
+    result = loadFiles([path], unchanged=[path])
+    assert not result.audio_files
+    assert result.skipped == [path]
+
+
+def test_loadFilesImageMemo(tmpdir, mp3audiofile):
+    cover = b"\x89PNG\r\n\x1a\n" + b"\x00" * 32
+    mp3audiofile.tag.images.set(ImageFrame.FRONT_COVER, cover, "image/png")
+    mp3audiofile.tag.save(version=ID3_V2_4)
+    copy = Path(str(tmpdir)) / "copy.mp3"
+    copy.write_bytes(Path(mp3audiofile.path).read_bytes())
+
+    # The image embedded in both files is hashed once, and shares its data.
+    img1, img2 = [f.tag.images[0] for f in loadFiles([mp3audiofile.path, str(copy)]).audio_files]
+    assert img1.md5 == img2.md5
+    assert img1.image_data is img2.image_data
+
+
+def test_TrackIndex(tmpdir):
+    path = Path(str(tmpdir)) / "track.mp3"
+    path.write_bytes(b"\x00" * 10)
+    st = path.stat()
+
+    index = TrackIndex()
+    assert str(path) not in index
+    assert not index.isUnchanged(str(path))
+
+    track = Track(id=1, path=str(path), size_bytes=st.st_size, album_id=None,
+                  ctime=datetime.fromtimestamp(st.st_ctime),
+                  mtime=datetime.fromtimestamp(st.st_mtime))
+    index.update(track)
+    assert len(index) == 1
+    assert index.get(str(path)).id == 1
+    assert index.get(str(path)).album_id is None
+    assert index.isUnchanged(str(path))
+
+    path.write_bytes(b"\x00" * 11)
+    assert not index.isUnchanged(str(path))
+
+    index.remove(str(path))
+    assert len(index) == 0
+    assert index.get(str(path)) is None
+
+
+def test_TrackIndexDirnames():
+    index = TrackIndex()
+    for id, path in enumerate(["/a/b/1.mp3", "/a/b/c/2.mp3", "/a/bc/3.mp3", "/a/4.mp3"], 1):
+        index.update(Track(id=id, path=path, size_bytes=0, album_id=None,
+                           ctime=datetime.now(), mtime=datetime.now()))
+
+    assert index.dirnames(["/a/b"]) == ["/a/b", "/a/b/c"]
+    assert index.dirnames(["/a/b/c", "/a/b"]) == ["/a/b/c", "/a/b"]
+    assert sorted(index.dirnames(["/"])) == ["/a", "/a/b", "/a/b/c", "/a/bc"]
+    assert index.hasDir("/a/b") and not index.hasDir("/a/b/d") and not index.hasDir("/b")
+
+    # The sorted directories are kept current.
+    index.remove("/a/b/c/2.mp3")
+    index.update(Track(id=5, path="/a/b/d/5.mp3", size_bytes=0, album_id=None,
+                       ctime=datetime.now(), mtime=datetime.now()))
+    assert index.dirnames(["/a/b"]) == ["/a/b", "/a/b/d"]
+    assert index.moveDir("/a/b", "/a/e") == ["/a/e", "/a/e/d"]
+    assert index.dirnames(["/a/b"]) == [] and not index.hasDir("/a/b")
+    assert index.dirnames(["/a/e"]) == ["/a/e", "/a/e/d"]
+    assert [t.id for t in index.tracksIn("/a/bc")] == [3]
+
+
+def test_DirectoryManifest(tmpdir, session, db_library):
+    class Handler:
+        def __init__(self):
+            self.dirs = []
+
+        def handleFile(self, f, stat=None):
+            assert stat == os.stat(f)
+
+        def handleDirectory(self, d, files):
+            self.dirs.append((d, files))
+
+    root = Path(str(tmpdir))
+    for name in ("a/1.mp3", "a/b/2.mp3", "c/3.mp3"):
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(b"")
+
+    manifest = DirectoryManifest(db_library.id)
+    handler = Handler()
+    manifest.walk(handler, str(root), prune=True)
+    assert handler.dirs == [(str(root / "a"), ["1.mp3"]), (str(root / "a/b"), ["2.mp3"]),
+                            (str(root / "c"), ["3.mp3"])]
+    manifest.save(session)
+    files_hash = manifest.get(str(root / "a/b")).files_hash
+
+    # Unchanged directories are not listed, and the manifest is reloaded the same.
+    manifest = DirectoryManifest.load(session, db_library.id)
+    assert len(manifest) == 4
+    handler = Handler()
+    manifest.walk(handler, str(root), prune=True)
+    assert handler.dirs == []
+    assert manifest.unchanged_dirs == {str(root), str(root / "a"), str(root / "a/b"),
+                                       str(root / "c")}
+
+    # Only the changed directory is listed.
+    (root / "a/b/2.mp3").unlink()
+    (root / "a/b/4.mp3").write_bytes(b"")
+    handler = Handler()
+    manifest.walk(handler, str(root), prune=True)
+    assert handler.dirs == [(str(root / "a/b"), ["4.mp3"])]
+    assert manifest.get(str(root / "a/b")).files_hash != files_hash
+
+
+def test_findOrphanedTracks(tmpdir):
+    root = Path(str(tmpdir))
+    index = TrackIndex()
+    now = datetime.now()
+    for i, name in enumerate(["a/1.mp3", "a/2.mp3", "b/1.mp3", "b/2.mp3"], 1):
+        path = root / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(b"")
+        index.update(Track(id=i, path=str(path), size_bytes=0, album_id=None,
+                           ctime=now, mtime=now))
+    assert findOrphanedTracks(index) == []
+
+    (root / "a/2.mp3").unlink()
+    for f in (root / "b").iterdir():
+        f.unlink()
+    (root / "b").rmdir()
+    assert sorted(t.id for t in findOrphanedTracks(index, threads=2)) == [2, 3, 4]
+
+
+def test_syncTrackTags(session, db_library, mp3audiofile):
+    lid = db_library.id
+    artist = Artist(name=mp3audiofile.tag.artist, lib_id=lid)
+    rock, jazz = Tag(name="Rock", lib_id=lid), Tag(name="Jazz", lib_id=lid)
+    session.add_all([artist, rock, jazz])
+    session.flush()
+    track = Track(audio_file=mp3audiofile, lib_id=lid, artist_id=artist.id)
+    session.add(track)
+    session.flush()
+
+    def _trackTags():
+        return sorted(tag_id for _, tag_id in session.execute(
+                          track_tags.select().where(track_tags.c.track_id == track.id)))
+
+    syncTrackTags(session, {track.id: {rock.id}}, new_ids={track.id})
+    assert _trackTags() == [rock.id]
+
+    # Duplicates are removed, and only the delta is written.
+    session.execute(track_tags.insert(), [{"track_id": track.id, "tag_id": rock.id}])
+    syncTrackTags(session, {track.id: {rock.id, jazz.id}})
+    assert _trackTags() == sorted([rock.id, jazz.id])
+
+    syncTrackTags(session, {track.id: set()})
+    assert _trackTags() == []
+
+
+def test_IdAllocator(database, session, db_library):
+    lid = db_library.id
+    ids = IdAllocator(session, Tag, batch_size=10)
+    session.add(Tag(id=ids.next(), name="Rock", lib_id=lid))
+    session.commit()
+    ids.refresh()
+
+    # Another writer inserts a row between two syncs sharing the allocator.
+    other = database.SessionMaker()
+    other.add(Tag(name="Jazz", lib_id=lid))
+    other.commit()
+    other.close()
+
+    session.add(Tag(id=ids.next(), name="Blues", lib_id=lid))
+    session.commit()
+    assert sorted(name for name, in session.query(Tag.name)) == ["Blues", "Jazz", "Rock"]
+
+
+def test_deleteOrphans(session, db_library, mp3audiofile):
+    lid = db_library.id
+    artist = Artist(name=mp3audiofile.tag.artist, lib_id=lid)
+    session.add(artist)
+    session.flush()
+    album = Album(title="Orphaned", artist_id=artist.id, lib_id=lid)
+    album.images.append(Image(type=Image.FRONT_COVER_TYPE, mime_type="image/png",
+                              md5="0" * 32, size=1, description="", data=b"\x00"))
+    rock = Tag(name="Rock", lib_id=lid)
+    session.add_all([album, rock])
+    session.flush()
+    track = Track(audio_file=mp3audiofile, lib_id=lid, artist_id=artist.id,
+                  album_id=album.id)
+    session.add(track)
+    session.flush()
+    syncTrackTags(session, {track.id: {rock.id}}, new_ids={track.id})
+
+    index = TrackIndex.load(session, lid)
+    assert deleteOrphans(session, index) == (0, 0, 0)
+
+    moved = Path(mp3audiofile.path).rename(mp3audiofile.path + ".moved")
+    try:
+        assert deleteOrphans(session, index) == (1, 1, 1)
+    finally:
+        moved.rename(mp3audiofile.path)
+    assert len(index) == 0
+    session.expire_all()
+    assert session.query(Track).filter_by(lib_id=lid).count() == 0
+    assert session.query(Album).filter_by(lib_id=lid).count() == 0
+    assert session.query(Artist).filter_by(lib_id=lid).count() == 0
+    assert session.query(Artist).get(VARIOUS_ARTISTS_ID) is not None
+    assert session.query(Image).count() == 0
+    assert session.execute(album_images.select()).fetchall() == []
+    assert session.execute(track_tags.select()).fetchall() == []
+
+
+def test_deleteOrphansScoped(tmpdir, session, db_library, mp3audiofile):
+    lid = db_library.id
+    root = Path(str(tmpdir))
+    albums = {}
+    for name in ("a", "b"):
+        artist = Artist(name=f"Artist {name}", lib_id=lid)
+        session.add(artist)
+        session.flush()
+        albums[name] = Album(title=f"Album {name}", artist_id=artist.id, lib_id=lid)
+        session.add(albums[name])
+        session.flush()
+        track = Track(audio_file=mp3audiofile, lib_id=lid, artist_id=artist.id,
+                      album_id=albums[name].id)
+        track.path = str(root / name / "gone.mp3")
+        session.add(track)
+    session.flush()
+    index = TrackIndex.load(session, lid)
+
+    # Only the tracks below the scope's paths, and what they referenced, are purged.
+    scope = PurgeScope([str(root / "a")], set(), set(), set())
+    assert deleteOrphans(session, index, scope=scope) == (1, 1, 1)
+    assert session.query(Album).filter_by(lib_id=lid).one().title == "Album b"
+
+    assert deleteOrphans(session, index) == (1, 1, 1)
+    assert session.query(Album).filter_by(lib_id=lid).count() == 0
+
+
+def test_moveDirectory(tmpdir, session, db_library, mp3audiofile):
+    lid = db_library.id
+    root = Path(str(tmpdir))
+    artist = Artist(name="Artist", lib_id=lid)
+    session.add(artist)
+    session.flush()
+    album = Album(title="Album", artist_id=artist.id, lib_id=lid)
+    session.add(album)
+    session.flush()
+    for name in ("a/1.mp3", "a/b/2.mp3", "ab/3.mp3"):
+        track = Track(audio_file=mp3audiofile, lib_id=lid, artist_id=artist.id)
+        track.path = str(root / name)
+        session.add(track)
+    session.add(ImageFile(path=str(root / "a/cover.png"), size_bytes=1, mtime=datetime.now(),
+                          album_id=album.id, lib_id=lid))
+    session.flush()
+
+    # Only paths below the directory, not those sharing its prefix.
+    assert moveDirectory(session, lid, str(root / "a"), str(root / "c")) == 2
+    session.expire_all()
+    assert sorted(t.path for t in session.query(Track).filter_by(lib_id=lid)) == \
+        [str(root / "ab/3.mp3"), str(root / "c/1.mp3"), str(root / "c/b/2.mp3")]
+    assert session.query(ImageFile).filter_by(lib_id=lid).one().path == \
+        str(root / "c/cover.png")
+
+
+def _incrementalSync(monkeypatch, mishmash_cmd, database, changes):
+    """Sync ``changes`` as a monitor sync would, without a monitor. Returns the
+    :meth:`SyncPlugin._syncFiles` results, as ``{dir: result}``."""
+    results = {}
+    run, sync_files = SyncPlugin.run, SyncPlugin._syncFiles
+
+    def _run(self, args):
+        args._incremental = True
+        args._changes = changes
+        return run(self, args)
+
+    def _syncFiles(self, d, files):
+        results[d] = sync_files(self, d, files)
+        return results[d]
+
+    with monkeypatch.context() as m:
+        m.setattr(SyncPlugin, "run", _run)
+        m.setattr(SyncPlugin, "_syncFiles", _syncFiles)
+        mishmash_cmd(["sync"] + sorted({d for c in changes for d in changeDirs(c)}),
+                     db_url=database.url)
+    return results
+
+
+def test_syncChanges(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+    DirectoryStructure.PREFERRED.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    album = session.query(Album).filter_by(lib_id=MAIN_LIB_ID).one()
+    tracks = {t.path: t.id for t in session.query(Track)}
+    paths = sorted(tracks)
+    album_dir = str(Path(paths[0]).parent)
+
+    album_types = []
+    dir_album_type = SyncPlugin._dirAlbumType
+
+    def _dirAlbumType(self, d, audio_files):
+        album_types.append(dir_album_type(self, d, audio_files))
+        return album_types[-1]
+
+    monkeypatch.setattr(SyncPlugin, "_dirAlbumType", _dirAlbumType)
+
+    # A retagged file is sync'd on its own.
+    audio_file = eyed3.load(paths[0])
+    audio_file.tag.title = "Retagged"
+    audio_file.tag.save()
+    changes = ChangeSet()
+    changes.modified(paths[0])
+    assert _incrementalSync(monkeypatch, mishmash_cmd, database, changes) == {album_dir: True}
+    assert album_types == [album.type]
+    session.expire_all()
+    track = session.query(Track).get(tracks[paths[0]])
+    assert (track.title, track.album_id) == ("Retagged", album.id)
+
+    # A file added to the album's directory joins the album.
+    new_path = str(Path(album_dir) / "new.mp3")
+    shutil.copyfile(paths[-1], new_path)
+    audio_file = eyed3.load(new_path)
+    audio_file.tag.title = "New"
+    audio_file.tag.track_num = len(paths) + 1
+    audio_file.tag.save()
+    changes = ChangeSet()
+    changes.created(new_path)
+    assert _incrementalSync(monkeypatch, mishmash_cmd, database, changes) == {album_dir: True}
+    assert album_types == [album.type] * 2
+    session.expire_all()
+    track = session.query(Track).filter_by(path=new_path).one()
+    assert (track.title, track.album_id) == ("New", album.id)
+    assert session.query(Album).count() == 1
+
+    # A deleted file is purged, the rest of the album is kept.
+    os.remove(paths[1])
+    changes = ChangeSet()
+    changes.deleted(paths[1])
+    assert _incrementalSync(monkeypatch, mishmash_cmd, database, changes) == {}
+    session.expire_all()
+    del tracks[paths[1]]
+    assert {t.path: t.id for t in session.query(Track) if t.path != new_path} == tracks
+    assert session.query(Album).one().id == album.id
+
+
+def test_syncChangedCover(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+
+    lp = LpFactory(temp_dir=str(tmpdir))
+    DirectoryStructure.PREFERRED.apply(*[t._mp3_file for t in lp.tracks], root_dir=tmpdir)
+    cover = Path(lp.tracks[0]._mp3_file.path).parent / "cover-front.png"
+    cover.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x00" * 32)
+    mishmash_cmd(["sync", str(tmpdir)], db_url=database.url)
+    old_md5 = session.query(Image).one().md5
+
+    # The replaced image is no longer linked to the album, and is purged.
+    cover.write_bytes(b"\x89PNG\r\n\x1a\n" + b"\x01" * 32)
+    changes = ChangeSet()
+    changes.modified(str(cover))
+    _incrementalSync(monkeypatch, mishmash_cmd, database, changes)
+    session.expire_all()
+    album = session.query(Album).filter_by(lib_id=MAIN_LIB_ID).one()
+    assert [img.id for img in album.images] == [session.query(Image).one().id]
+    assert album.images[0].md5 != old_md5
+
+
+def test_syncMovedDirectory(tmpdir, database, mishmash_cmd, monkeypatch):
+    session = database.SessionMaker()
+    root = Path(str(tmpdir)) / "lib"
+
+    # a/b, with a nested album, and its sibling a/bc
+    for i, album_dir in enumerate(("a/b", "a/b/disc 2", "a/bc")):
+        lp = LpFactory(temp_dir=str(tmpdir))
+        DirectoryStructure.PREFERRED.apply(*[t._mp3_file for t in lp.tracks],
+                                           root_dir=tmpdir / f"src{i}")
+        (root / album_dir).parent.mkdir(parents=True, exist_ok=True)
+        Path(lp.tracks[0]._mp3_file.path).parent.rename(root / album_dir)
+        (root / album_dir / "cover-front.png").write_bytes(b"\x89PNG\r\n\x1a\n" +
+                                                           bytes([i]) * 32)
+    mishmash_cmd(["sync", str(root)], db_url=database.url)
+
+    def _paths():
+        session.expire_all()
+        return {T: {row.path: row.id for row in session.query(T)}
+                    for T in (Track, ImageFile, Directory)}
+
+    def _moved(path):
+        src_path = str(root / "a/b")
+        if path == src_path or path.startswith(src_path + os.sep):
+            return str(root / "a/x") + path[len(src_path):]
+        return path
+
+    paths = _paths()
+    assert len(paths[ImageFile]) == 3
+    assert str(root / "a/b/disc 2") in paths[Directory]
+
+    (root / "a/b").rename(root / "a/x")
+    changes = ChangeSet()
+    changes.movedDirectory(str(root / "a/b"), str(root / "a/x"))
+    reads = []
+    monkeypatch.setattr(SyncPlugin, "_syncDirectory", lambda *args, **kw: reads.append(args))
+    _incrementalSync(monkeypatch, mishmash_cmd, database, changes)
+    assert reads == []
+
+    # The paths are updated, keeping the ids, and a/bc is not touched.
+    moved = _paths()
+    for T in (Track, ImageFile, Directory):
+        assert moved[T] == {_moved(p): id for p, id in paths[T].items()}
+    assert len([p for p in moved[Track] if p.startswith(str(root / "a/bc") + os.sep)]) == \
+        len([p for p in paths[Track] if p.startswith(str(root / "a/bc") + os.sep)]) > 0
+
+
+def test_ChangeSet():
+    changes = ChangeSet()
+    changes.created("/a/1.mp3")
+    changes.modified("/a/1.mp3")
+    changes.modified("/a/2.mp3")
+    changes.deleted("/a/3.mp3")
+    changes.created("/a/3.mp3")
+    changes.moved("/a/4.mp3", "/b/4.mp3")
+    changes.moved("/b/4.mp3", "/c/4.mp3")
+    changes.moved("/a/5.mp3", "/b/5.mp3")
+    changes.deleted("/b/5.mp3")
+    changes.directory("/d")
+
+    assert sorted(changes) == sorted([Change(CREATED, "/a/1.mp3", None),
+                                      Change(MODIFIED, "/a/2.mp3", None),
+                                      Change(MODIFIED, "/a/3.mp3", None),
+                                      Change(MOVED, "/c/4.mp3", "/a/4.mp3"),
+                                      Change(DELETED, "/a/5.mp3", None),
+                                      Change(DELETED, "/b/5.mp3", None),
+                                      Change(DIRECTORY, "/d", None)])
+    assert changeDirs(Change(MOVED, "/c/4.mp3", "/a/4.mp3")) == ["/c", "/a"]
+    assert changeDirs(Change(DIRECTORY, "/d", None)) == ["/d"]
+
+
+def test_ChangeSetMovedDirectory():
+    changes = ChangeSet()
+    changes.modified("/a/1.mp3")
+    changes.moved("/b/2.mp3", "/a/2.mp3")
+    changes.modified("/ab/3.mp3")
+    changes.movedDirectory("/a", "/c")
+    # Renamed again, one move
+    changes.movedDirectory("/c", "/d")
+    changes.created("/d/4.mp3")
+
+    assert list(changes)[0] == Change(MOVED_DIRECTORY, "/d", "/a")
+    assert sorted(list(changes)[1:]) == [Change(CREATED, "/d/4.mp3", None),
+                                         Change(MODIFIED, "/ab/3.mp3", None),
+                                         Change(MODIFIED, "/d/1.mp3", None),
+                                         Change(MOVED, "/d/2.mp3", "/b/2.mp3")]
+    assert changeDirs(list(changes)[0]) == ["/d", "/a"]
+
+    # Renamed back
+    changes.movedDirectory("/d", "/a")
+    assert Change(MODIFIED, "/a/1.mp3", None) in changes
+    assert not [c for c in changes if c.type == MOVED_DIRECTORY]
+
+
+def test_WatchRegistry():
+    watches = WatchRegistry()
+    for wd, path in enumerate(["/m", "/m/a", "/m/a/b", "/m/ab", "/m/a/b/c"], 1):
+        watches.add(path, wd, {"Music"})
+    watches.add("/m/a", 2, {"Other"})
+    assert len(watches) == 5
+    assert watches.wd("/m/a/b") == 3 and watches.path(3) == "/m/a/b"
+    assert watches.libs("/m/a") == {"Music", "Other"}
+    assert watches.libs("/x") == set()
+    assert watches.tree("/m/a") == ["/m/a", "/m/a/b", "/m/a/b/c"]
+
+    # Moves keep the watch descriptors
+    assert watches.move("/m/a", "/m/z", {"Music"}) == [("/m/a", "/m/z", 2),
+                                                       ("/m/a/b", "/m/z/b", 3),
+                                                       ("/m/a/b/c", "/m/z/b/c", 5)]
+    assert "/m/a" not in watches and watches.wd("/m/z/b") == 3
+    assert watches.libs("/m/z") == {"Music"}
+    assert sorted(watches.tree("/m")) == ["/m", "/m/ab", "/m/z", "/m/z/b", "/m/z/b/c"]
+
+    assert watches.remove("/m/z/b") == [("/m/z/b", 3), ("/m/z/b/c", 5)]
+    assert sorted(watches) == ["/m", "/m/ab", "/m/z"]
+    assert watches.path(3) is None
+
+
+def test_MonitorWatchLimit(tmpdir, monkeypatch):
+    import errno
+    from inotify.calls import InotifyError
+    from mishmash.commands.sync import _inotify
+
+    root = Path(str(tmpdir))
+    for name in ("a/1", "a/2", "b/1", "b/2"):
+        (root / name).mkdir(parents=True)
+
+    monitor = _inotify.Monitor()
+    add_watch = monitor._inotify.add_watch
+
+    def _addWatch(path, mask):
+        if len(monitor._watches) >= 3:
+            ex = InotifyError("No space")
+            ex._errno = errno.ENOSPC
+            raise ex
+        return add_watch(path, mask)
+
+    monkeypatch.setattr(monitor._inotify, "add_watch", _addWatch)
+    assert monitor._watchTree(str(root), {"Music"})
+    monitor._updateStats()
+
+    # Breadth first, the deepest directories are not watched.
+    assert sorted(monitor._watches) == [str(root), str(root / "a"), str(root / "b")]
+    assert monitor.stats[:3] == (3, 4, 0)
+    assert monitor._retry_t is not None
+
+    # Retried once watches are available, and sync'd.
+    monkeypatch.setattr(monitor._inotify, "add_watch", add_watch)
+    assert monitor._retryUnwatched() == 4
+    assert len(monitor._watches) == 7
+    assert monitor.stats[:3] == (7, 0, 0)
+    assert monitor._retry_t is None
+    assert sorted(c.path for c in monitor._changes) == [str(root / n) for n in
+                                                         ("a/1", "a/2", "b/1", "b/2")]
+
+
+def test_Poller(tmpdir):
+    root = Path(str(tmpdir))
+    for name in ("a/1.mp3", "a/2.mp3", "a/3.mp3", "a/4.mp3", "b/c/5.mp3", "d/6.mp3"):
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_bytes(b"\x00" * 10)
+
+    poller = Poller("Music")
+    requests = queue.Queue()
+    # The first scan records the directories, without changes.
+    poller._scan(str(root))
+    poller._requestSyncs(requests)
+    assert requests.empty()
+
+    (root / "a/1.mp3").write_bytes(b"\x00" * 20)
+    (root / "a/2.mp3").unlink()
+    (root / "a/3.mp3").rename(root / "a/3 - renamed.mp3")
+    (root / "a/7.mp3").write_bytes(b"\x00" * 10)
+    (root / "b").rename(root / "b renamed")
+    (root / "d/6.mp3").unlink()
+    (root / "d").rmdir()
+    (root / "e").mkdir()
+    poller._scan(str(root))
+    poller._requestSyncs(requests)
+    assert sorted(requests.get_nowait()) == sorted([
+        ("Music", Change(MODIFIED, str(root / "a/1.mp3"), None)),
+        ("Music", Change(DELETED, str(root / "a/2.mp3"), None)),
+        ("Music", Change(MOVED, str(root / "a/3 - renamed.mp3"), str(root / "a/3.mp3"))),
+        ("Music", Change(CREATED, str(root / "a/7.mp3"), None)),
+        ("Music", Change(MOVED_DIRECTORY, str(root / "b renamed"), str(root / "b"))),
+        ("Music", Change(DIRECTORY, str(root / "d"), None)),
+        ("Music", Change(DIRECTORY, str(root / "e"), None)),
+    ])
+
+    # The moved, and new, directories are scanned by their new paths.
+    (root / "b renamed/c/5.mp3").write_bytes(b"\x00" * 20)
+    (root / "e/8.mp3").write_bytes(b"\x00" * 10)
+    poller._scan(str(root))
+    poller._requestSyncs(requests)
+    assert sorted(requests.get_nowait()) == [
+        ("Music", Change(CREATED, str(root / "e/8.mp3"), None)),
+        ("Music", Change(MODIFIED, str(root / "b renamed/c/5.mp3"), None)),
+    ]
+
+
+def test_PollerBudget(tmpdir, monkeypatch):
+    from mishmash.commands.sync import poller as poller_mod
+
+    root = Path(str(tmpdir))
+    for i in range(10):
+        (root / str(i)).mkdir()
+        (root / str(i) / "1.mp3").write_bytes(b"")
+
+    # Only sleeping takes time.
+    clock = [0.0]
+    monkeypatch.setattr(poller_mod, "monotonic", lambda: clock[0])
+    monkeypatch.setattr(poller_mod.time, "sleep", lambda secs: clock.__setitem__(0,
+                                                                                clock[0] + secs))
+    poller = Poller("Music", budget=100)
+    poller._scan(str(root))
+    # A stat and a listing of each directory, and a stat of each file.
+    assert poller._ops == 2 + 10 * 3
+    assert clock[0] == pytest.approx(poller._ops / 100, abs=poller_mod.MIN_SLEEP)
+
+
+def test_PollerProcess(tmpdir):
+    album_d = Path(str(tmpdir)) / "Album"
+    album_d.mkdir()
+    poller = Poller("Music", interval=0.1)
+    poller.watch("Music", album_d)
+    poller.start()
+    try:
+        # Give the poller time to scan the library
+        time.sleep(0.5)
+        (album_d / "track.mp3").write_bytes(b"\x00" * 1024)
+        requests = poller.sync_queue.get(timeout=5)
+        assert requests == [("Music", Change(CREATED, str(album_d / "track.mp3"), None))]
+    finally:
+        poller.terminate()
+        poller.join()
+
+
+def test_Monitor(tmpdir):
+    from mishmash.commands.sync._inotify import Monitor, QUIET_PERIOD, MAX_DELAY
+
+    album_d = Path(str(tmpdir)) / "Album"
+    album_d.mkdir()
+    (album_d / "old.mp3").write_bytes(b"\x00" * 1024)
+    monitor = Monitor()
+    monitor.start()
+    try:
+        monitor.watch("Music", album_d)
+        # Wait for the monitor to add the watch
+        timeout = time.monotonic() + 5
+        while monitor.stats.watched != 1 and time.monotonic() < timeout:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        (album_d / "track.mp3").write_bytes(b"\x00" * 1024)
+        (album_d / "track.mp3").write_bytes(b"\x00" * 2048)
+        (album_d / "old.mp3").rename(album_d / "new.mp3")
+        (album_d / "Disc 2").mkdir()
+        # One request for the changes, once they are quiet
+        requests = monitor.sync_queue.get(timeout=MAX_DELAY * 2)
+        assert QUIET_PERIOD <= time.monotonic() - start < MAX_DELAY
+        assert sorted(requests) == [
+            ("Music", Change(CREATED, str(album_d / "track.mp3"), None)),
+            ("Music", Change(DIRECTORY, str(album_d / "Disc 2"), None)),
+            ("Music", Change(MOVED, str(album_d / "new.mp3"), str(album_d / "old.mp3"))),
+        ]
+    finally:
+        monitor.terminate()
+        monitor.join()